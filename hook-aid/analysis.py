@@ -0,0 +1,311 @@
+"""Single-pass loop analysis: one STFT feeds tempo, groove and scale detection."""
+import io
+import time
+from dataclasses import dataclass
+from typing import BinaryIO, Optional, Union
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+from audio_store import AudioStore, audio_digest
+from instrument import span, timed
+from motif import SCALE_MODES, sampled_chroma, scale_from_chroma
+from rhythm import (
+    bpm_and_beats_from_envelope,
+    groove_matrix_from_onsets,
+    histogram_from_onsets,
+    ticks_from_beats,
+    timing_offsets_from_onsets,
+)
+
+
+# Match librosa's onset_strength defaults so the shared envelope is identical
+# to what estimate_bpm_and_beats/groove_histogram compute on their own.
+N_FFT = 2048
+HOP_LENGTH = 512
+
+# Chroma gets almost nothing from the top of the spectrum, so the costly HPSS
+# median filters only run over the bins below this frequency.
+CHROMA_FMAX = 5000.0
+
+BEATS_PER_BAR = 4
+
+ANALYSIS_SR = 22050
+
+# Streaming mode: analysis frames per decoded block (~6 s at the analysis rate)
+# and the upload length above which analyze_bytes switches to it.
+STREAM_BLOCK_FRAMES = 256
+STREAM_MIN_SECONDS = 90.0
+
+# Length of the synthetic loop analyzed by warm_up.
+WARM_UP_SECONDS = 2.0
+
+
+@dataclass(frozen=True)
+class LoopAnalysis:
+    """Everything the app needs from an uploaded loop, derived from one spectrogram."""
+
+    sr: int
+    duration: float
+    bpm: float
+    beat_times: np.ndarray
+    tick_times: np.ndarray
+    onset_times: np.ndarray
+    histogram: np.ndarray
+    groove_matrix: np.ndarray  # (bars, grid) onset counts; histogram is its normalized column sum
+    timing_offsets: np.ndarray  # (16,) mean onset offset per 16th of the bar, in 16ths (see loop_timing)
+    chroma: np.ndarray
+    scale: Optional[str]
+    scale_score: float
+
+
+def _harmonic_chroma(stft: np.ndarray, sr: int, n_fft: int = N_FFT) -> np.ndarray:
+    """12 x frames chroma of the harmonic part of an STFT."""
+    # Median-filter HPSS on the existing STFT instead of a time-domain round trip.
+    magnitude = np.abs(stft)
+    n_bins = min(magnitude.shape[0], int(np.ceil(CHROMA_FMAX * n_fft / sr)) + 1)
+    harmonic = np.zeros_like(magnitude)
+    harmonic[:n_bins], _ = librosa.decompose.hpss(magnitude[:n_bins])
+    source = harmonic if np.any(harmonic) else magnitude
+    return librosa.feature.chroma_stft(S=source ** 2, sr=sr, n_fft=n_fft)
+
+
+def _chroma_from_stft(stft: np.ndarray, sr: int, scale_mode: str = "full") -> np.ndarray:
+    if scale_mode == "fast":
+        return sampled_chroma(np.abs(stft), sr, N_FFT, fmax=CHROMA_FMAX)
+    chroma = _harmonic_chroma(stft, sr)
+    if chroma.size == 0:
+        return np.zeros(12)
+    return chroma.mean(axis=1)
+
+
+def loop_timing(onset_times, beat_times) -> np.ndarray:
+    """Micro-timing profile on the hooks' 16th grid, whatever subdiv the groove uses.
+
+    Entry i is how far (in 16ths, + = late) the loop's hits on the i-th 16th
+    of the bar land from the straight grid between detected beats: swing
+    shows up as late off-beat 16ths, a laid-back snare as a late slot 4/12.
+    """
+    ticks = ticks_from_beats(beat_times, subdiv=4)
+    return np.asarray(timing_offsets_from_onsets(onset_times, ticks, grid=4 * BEATS_PER_BAR), dtype=float)
+
+
+@timed("analysis.analyze_loop")
+def analyze_loop(y: np.ndarray, sr: int, *, subdiv: int = 4, scale_mode: str = "full") -> LoopAnalysis:
+    """Estimate BPM, beats, groove histogram and scale from a mono signal.
+
+    scale_mode="fast" skips HPSS and takes chroma from a sample of STFT frames.
+    """
+    if scale_mode not in SCALE_MODES:
+        raise ValueError(f"Unknown scale detection mode {scale_mode!r}; expected one of {SCALE_MODES}")
+    y = np.asarray(y, dtype=np.float32)
+    duration = float(y.size) / sr if sr else 0.0
+
+    with span("analysis.stft"):
+        stft = librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH)
+        power = np.abs(stft) ** 2
+        mel_db = librosa.power_to_db(librosa.feature.melspectrogram(S=power, sr=sr))
+        onset_env = librosa.onset.onset_strength(S=mel_db, sr=sr, hop_length=HOP_LENGTH)
+
+    with span("analysis.beats"):
+        # The plain-tracker fallback uses the median-aggregated envelope, as beat_track(y=...) does.
+        median_env = lambda: librosa.onset.onset_strength(S=mel_db, sr=sr, hop_length=HOP_LENGTH, aggregate=np.median)
+        bpm, beat_times = bpm_and_beats_from_envelope(onset_env, sr, median_env=median_env)
+    with span("analysis.groove"):
+        tick_times = ticks_from_beats(beat_times, subdiv=subdiv)
+        onset_times = librosa.onset.onset_detect(onset_envelope=onset_env, sr=sr, hop_length=HOP_LENGTH, units="time")
+        histogram = histogram_from_onsets(onset_times, tick_times, grid=subdiv * BEATS_PER_BAR)
+        groove_matrix = groove_matrix_from_onsets(onset_times, tick_times, grid=subdiv * BEATS_PER_BAR)
+        timing_offsets = loop_timing(onset_times, beat_times)
+
+    if np.any(np.abs(y)):
+        with span("analysis.chroma"):
+            chroma = _chroma_from_stft(stft, sr, scale_mode)
+        scale, scale_score = scale_from_chroma(chroma)
+    else:
+        chroma = np.zeros(12)
+        scale, scale_score = None, 0.0
+
+    return LoopAnalysis(
+        sr=int(sr),
+        duration=duration,
+        bpm=float(bpm),
+        beat_times=np.asarray(beat_times, dtype=float),
+        tick_times=np.asarray(tick_times, dtype=float),
+        onset_times=np.asarray(onset_times, dtype=float),
+        histogram=np.asarray(histogram, dtype=float),
+        groove_matrix=groove_matrix,
+        timing_offsets=timing_offsets,
+        chroma=np.asarray(chroma, dtype=float),
+        scale=scale,
+        scale_score=float(scale_score),
+    )
+
+
+def _stable(history, tolerance: float) -> bool:
+    (bpm_a, scale_a), (bpm_b, scale_b) = history[-2:]
+    return scale_a == scale_b and abs(bpm_a - bpm_b) <= tolerance * max(bpm_a, 1e-9)
+
+
+@timed("analysis.analyze_stream")
+def analyze_stream(
+    source: Union[str, BinaryIO],
+    *,
+    subdiv: int = 4,
+    block_frames: int = STREAM_BLOCK_FRAMES,
+    early_stop: bool = False,
+    check_every: int = 4,
+    tolerance: float = 0.01,
+    scale_mode: str = "full",
+) -> LoopAnalysis:
+    """Analyze a file block by block with memory bounded by one block.
+
+    Audio is read at its native rate with FFT/hop sizes scaled to keep the
+    analysis frame rate of ANALYSIS_SR, so tempo and onset settings carry over.
+    Only the onset envelope (one float per frame) and a running chroma sum
+    outlive each block. With early_stop, reading stops once BPM (within
+    `tolerance`) and the suggested scale agree over consecutive checks made
+    every `check_every` blocks. scale_mode is as for analyze_loop.
+    """
+    if scale_mode not in SCALE_MODES:
+        raise ValueError(f"Unknown scale detection mode {scale_mode!r}; expected one of {SCALE_MODES}")
+    with sf.SoundFile(source) as sfo:
+        sr = sfo.samplerate
+        total_samples = sfo.frames
+        ratio = sr / ANALYSIS_SR
+        hop = max(1, int(round(HOP_LENGTH * ratio)))
+        n_fft = int(2 ** round(np.log2(N_FFT * ratio)))
+        # Uncentered frame j lines up with centered frame j + n_fft // (2 * hop);
+        # pad like onset_strength(center=True) does, plus that shift.
+        lead = 1 + 2 * (n_fft // (2 * hop))
+        mel_basis = librosa.filters.mel(sr=sr, n_fft=n_fft, fmax=ANALYSIS_SR / 2)
+        # Rate that makes the default 512-sample hop match this frame rate, so the
+        # envelope can go straight into the ANALYSIS_SR-based tempo/onset helpers.
+        env_sr = sr / hop * HOP_LENGTH
+
+        env_parts = [np.zeros(lead, dtype=np.float32)]
+        chroma_sum = np.zeros(12)
+        chroma_frames = 0
+        previous = None
+        samples_read = 0
+        history = []
+        blocks = librosa.stream(sfo, block_length=block_frames, frame_length=n_fft, hop_length=hop, mono=True, fill_value=0)
+        for count, block in enumerate(blocks, 1):
+            with span("analysis.stream_block"):
+                stft = librosa.stft(block, n_fft=n_fft, hop_length=hop, center=False)
+                mel_db = librosa.power_to_db(mel_basis @ (np.abs(stft) ** 2))
+                frames = mel_db if previous is None else np.hstack([previous, mel_db])
+                env_parts.append(np.maximum(0.0, np.diff(frames, axis=1)).mean(axis=0))
+                previous = mel_db[:, -1:]
+                if scale_mode == "fast":
+                    chroma_sum += sampled_chroma(np.abs(stft), sr, n_fft, fmax=CHROMA_FMAX) * stft.shape[1]
+                else:
+                    chroma_sum += _harmonic_chroma(stft, sr, n_fft=n_fft).sum(axis=1)
+                chroma_frames += stft.shape[1]
+                samples_read = min(total_samples, samples_read + block_frames * hop)
+
+            if early_stop and count % check_every == 0 and samples_read < total_samples:
+                bpm_now, _ = bpm_and_beats_from_envelope(np.concatenate(env_parts), env_sr)
+                history.append((round(bpm_now, 1), scale_from_chroma(chroma_sum)[0]))
+                if len(history) >= 2 and _stable(history, tolerance):
+                    break
+
+    onset_env = np.concatenate(env_parts)[: 1 + samples_read // hop]
+    bpm, beat_times = bpm_and_beats_from_envelope(onset_env, env_sr)
+    tick_times = ticks_from_beats(beat_times, subdiv=subdiv)
+    onset_times = librosa.onset.onset_detect(onset_envelope=onset_env, sr=env_sr, hop_length=HOP_LENGTH, units="time")
+    histogram = histogram_from_onsets(onset_times, tick_times, grid=subdiv * BEATS_PER_BAR)
+    groove_matrix = groove_matrix_from_onsets(onset_times, tick_times, grid=subdiv * BEATS_PER_BAR)
+    timing_offsets = loop_timing(onset_times, beat_times)
+    scale_name, scale_score = scale_from_chroma(chroma_sum) if np.any(chroma_sum) else (None, 0.0)
+
+    return LoopAnalysis(
+        sr=int(sr),
+        duration=samples_read / sr,
+        bpm=float(bpm),
+        beat_times=np.asarray(beat_times, dtype=float),
+        tick_times=np.asarray(tick_times, dtype=float),
+        onset_times=np.asarray(onset_times, dtype=float),
+        histogram=np.asarray(histogram, dtype=float),
+        groove_matrix=groove_matrix,
+        timing_offsets=timing_offsets,
+        chroma=chroma_sum / max(chroma_frames, 1),
+        scale=scale_name,
+        scale_score=float(scale_score),
+    )
+
+
+@timed("analysis.decode_audio")
+def decode_audio(audio_bytes: bytes, *, sr: int = 22050, store: Optional[AudioStore] = None, digest: Optional[str] = None):
+    """Decode WAV/MP3 bytes to a mono float32 signal at the analysis sample rate.
+
+    With an AudioStore the signal comes back as a read-only memmap, decoded
+    only if the store doesn't have it yet (digest defaults to its sha256).
+    """
+    if store is None:
+        return librosa.load(io.BytesIO(audio_bytes), sr=sr, mono=True)
+    digest = digest or audio_digest(audio_bytes)
+    y = store.get(digest, sr)
+    if y is None:
+        y, _ = librosa.load(io.BytesIO(audio_bytes), sr=sr, mono=True)
+        y = store.put(digest, sr, y)
+    return y, sr
+
+
+@timed("analysis.decode_loop")
+def decode_loop(audio_bytes: bytes, *, sr: int = 22050) -> np.ndarray:
+    """Decode an upload at sr keeping its channels, as (channels, samples) float32 (for export.loop_mix)."""
+    y, _ = librosa.load(io.BytesIO(audio_bytes), sr=sr, mono=False)
+    return np.atleast_2d(y)
+
+
+def audio_duration(audio_bytes: bytes) -> Optional[float]:
+    """Length in seconds from the file header, or None if libsndfile can't read it."""
+    try:
+        return sf.info(io.BytesIO(audio_bytes)).duration
+    except RuntimeError:  # format libsndfile can't read; librosa falls back to audioread
+        return None
+
+
+def analyze_bytes(
+    audio_bytes: bytes, *, sr: int = 22050, subdiv: int = 4, scale_mode: str = "full", store: Optional[AudioStore] = None,
+) -> LoopAnalysis:
+    """Decode an uploaded WAV/MP3 to mono and analyze it.
+
+    Uploads longer than STREAM_MIN_SECONDS go through analyze_stream so a
+    full-song stem is never decoded into memory at once (nor kept in the store).
+    """
+    duration = audio_duration(audio_bytes) if sr == ANALYSIS_SR else None
+    if duration is not None and duration > STREAM_MIN_SECONDS:
+        return analyze_stream(io.BytesIO(audio_bytes), subdiv=subdiv, scale_mode=scale_mode)
+    y, sr = decode_audio(audio_bytes, sr=sr, store=store)
+    return analyze_loop(y, sr, subdiv=subdiv, scale_mode=scale_mode)
+
+
+def _warm_up_signal(sr: int, seconds: float = WARM_UP_SECONDS) -> np.ndarray:
+    """Eighth-note clicks over an A3 drone at 120 BPM: enough for beats, onsets and chroma."""
+    t = np.arange(int(sr * seconds)) / sr
+    y = 0.1 * np.sin(2 * np.pi * 220.0 * t)
+    click = np.hanning(256)
+    for start in np.arange(0.0, seconds - 0.05, 0.25):
+        i = int(start * sr)
+        y[i:i + click.size] += click
+    return y.astype(np.float32)
+
+
+@timed("analysis.warm_up")
+def warm_up(sr: int = ANALYSIS_SR) -> float:
+    """Run the whole analysis once on a short synthetic loop; returns the seconds taken.
+
+    librosa loads its DSP submodules (scipy, numba and its compiled kernels) on
+    first use, which costs several seconds in a fresh process. Worker pools run
+    this as their initializer so the first upload doesn't pay for it.
+    """
+    started = time.perf_counter()
+    buf = io.BytesIO()
+    sf.write(buf, _warm_up_signal(sr), sr, format="WAV")
+    y, sr = decode_audio(buf.getvalue(), sr=sr)
+    for scale_mode in SCALE_MODES:
+        analyze_loop(y, sr, scale_mode=scale_mode)
+    return time.perf_counter() - started
@@ -1,14 +1,23 @@
-import io
-import zipfile
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
 from typing import Optional
 
-import librosa
 import numpy as np
 import streamlit as st
 
-from rhythm import estimate_bpm_and_beats, ticks_from_beats, groove_histogram
-from motif import sample_rhythm, assign_pitches, list_available_scales, detect_scale_from_audio
-from export import notes_to_wav_bytes, hooks_to_wav_bytes
+import instrument
+from analysis import analyze_bytes, audio_duration, decode_loop, warm_up
+from audio_store import AudioStore
+from cache import AnalysisCache, analysis_key
+from export import PREVIEW_SAMPLE_RATE, render_hooks
+from fingerprint import FingerprintIndex, fingerprint_bytes, index_path, reuse_analysis
+from graph import GenerationGraph, notes_key
+from motif import PHRASE_FORMS, REGISTERS, SCALE_MODES, list_available_scales
+from bundle import bundle_file
 from ui_helpers import build_zip_name
 
 
@@ -16,16 +25,173 @@ st.set_page_config(page_title="Hook Generator Aid", layout="centered")
 st.title("Hook Generator Aid")
 st.caption("Upload a drum loop - generate five monophonic hooks")
 
+ANALYSIS_SR = 22050
+ANALYSIS_SUBDIV = 4
+EXPORT_SR = 22050
+# Download choices; the preview always plays the EXPORT_SR render.
+EXPORT_RATES = (22050, 44100, 48000)
+DOWNLOAD_FORMATS = {
+    "WAV 16-bit": "wav",
+    "WAV 24-bit": "wav24",
+    "WAV 32-bit float": "wav-float",
+    "FLAC 16-bit (smallest)": "flac",
+    "FLAC 24-bit": "flac24",
+}
+# "full" (HPSS chroma) or "fast" (sampled STFT frames); see benchmarks/scale_modes.py.
+SCALE_MODE = os.environ.get("HOOK_AID_SCALE_MODE", "full")
+if SCALE_MODE not in SCALE_MODES:
+    st.warning(f"HOOK_AID_SCALE_MODE={SCALE_MODE!r} is not one of {', '.join(SCALE_MODES)}; using full.")
+    SCALE_MODE = "full"
+# Worker processes for analysis and full-rate renders (default: CPU count).
+WORKERS = int(os.environ.get("HOOK_AID_WORKERS", "0")) or None
+# Rough analysis cost, only used to pace the progress bar.
+ANALYSIS_STARTUP_S = 1.0
+ANALYSIS_S_PER_AUDIO_S = 0.1
+
+
+@st.cache_resource
+def _analysis_cache() -> AnalysisCache:
+    # Shared across sessions; set HOOK_AID_CACHE_DIR to keep results between restarts.
+    return AnalysisCache(max_entries=32, cache_dir=os.environ.get("HOOK_AID_CACHE_DIR"))
+
+
+@st.cache_resource
+def _fingerprint_index() -> FingerprintIndex:
+    # Near-duplicate lookup; persisted next to the analysis cache when it is on disk.
+    cache_dir = os.environ.get("HOOK_AID_CACHE_DIR")
+    path = index_path(cache_dir, sr=ANALYSIS_SR, subdiv=ANALYSIS_SUBDIV, scale_mode=SCALE_MODE) if cache_dir else None
+    return FingerprintIndex(path, groove_bins=4 * ANALYSIS_SUBDIV)
+
+
+@st.cache_resource
+def _audio_store() -> Optional[AudioStore]:
+    # Decoded uploads, so the full analysis reuses the fingerprint probe's decode.
+    cache_dir = os.environ.get("HOOK_AID_CACHE_DIR")
+    return AudioStore(Path(cache_dir) / "audio") if cache_dir else None
+
+
+@st.cache_resource
+def _generation_graph() -> GenerationGraph:
+    # Rhythms, pitches and renders keyed by their inputs, so a slider only redoes its own stages.
+    return GenerationGraph(max_entries=16)
+
+
+@st.cache_resource
+def _worker_pool() -> ProcessPoolExecutor:
+    # One pool per server. DSP runs outside the script thread and the GIL, so reruns
+    # stay responsive and sessions use separate cores. Spawned workers avoid forking
+    # Streamlit's threads.
+    return ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn"), initializer=warm_up)
+
+
+def _job(slot: str, key, fn, *args, **kwargs) -> Future:
+    """Return this session's job in `slot` for `key`, submitting it (and cancelling a superseded one) if needed."""
+    pending = st.session_state.get(slot)
+    if pending is not None and pending[0] == key:
+        return pending[1]
+    if pending is not None:
+        pending[1].cancel()  # a no-op once a worker has picked it up; the result is just dropped
+    future = _worker_pool().submit(fn, *args, **kwargs)
+    st.session_state[slot] = (key, future, time.monotonic())
+    return future
+
+
+def _job_progress(slot: str, label: str, expected_s: float) -> None:
+    """Poll a pending job; reruns the app once it has finished."""
+    _, future, started = st.session_state[slot]
+    if future.done():
+        st.rerun()
+    elapsed = time.monotonic() - started
+    st.progress(min(elapsed / expected_s, 0.95), text=f"{label} ({elapsed:.1f} s)")
+
+
+def _analysis_for(key: str, audio_bytes: bytes, label: str):
+    """Cached, near-duplicate or freshly computed analysis; None while a job is still running.
+
+    A quick fingerprint job runs first; only if the index has no near-duplicate
+    does the full analysis job start. A near-duplicate only lends its scale
+    detection; beats and groove come from this upload's quick pass.
+    """
+    cache, index = _analysis_cache(), _fingerprint_index()
+    probing, analyzing = (st.session_state.get(slot, (None,))[0] == key for slot in ("fingerprint_job", "analysis_job"))
+    # While this upload's jobs are in flight the cache can't have it yet.
+    analysis = None if probing or analyzing else cache.get(key)
+    if analysis is not None:
+        return analysis
+
+    slot = "fingerprint_job"
+    probe = _job(slot, key, fingerprint_bytes, audio_bytes, sr=ANALYSIS_SR, subdiv=ANALYSIS_SUBDIV, store=_audio_store())
+    if probe.done():
+        fingerprint, quick = probe.result()
+        match = None if analyzing else index.match(fingerprint)  # searched once, not on every poll
+        stored = cache.get(match) if match is not None else None
+        if match is not None and stored is None:
+            index.discard(match)  # evicted from the cache; this upload's row takes its place
+            match = None
+        analysis = reuse_analysis(quick, stored) if stored is not None else None
+        if analysis is None and SCALE_MODE == "fast":
+            analysis = quick  # the quick pass already is the full analysis
+        if analysis is None:
+            slot = "analysis_job"
+            job = _job(
+                slot, key, analyze_bytes, audio_bytes,
+                sr=ANALYSIS_SR, subdiv=ANALYSIS_SUBDIV, scale_mode=SCALE_MODE, store=_audio_store(),
+            )
+            analysis = job.result() if job.done() else None
+        if analysis is not None:
+            for done in ("fingerprint_job", "analysis_job"):
+                st.session_state.pop(done, None)
+            if match is None:
+                index.add(key, fingerprint)
+            cache.put(key, analysis)
+            return analysis
+
+    expected_s = ANALYSIS_STARTUP_S + ANALYSIS_S_PER_AUDIO_S * (audio_duration(audio_bytes) or 30.0)
+    st.fragment(run_every=0.25)(_job_progress)(slot, label, expected_s)
+    return None
+
+
+def _full_render(hooks, bpm: int, timing) -> Future:
+    """Start (or reuse) the background full-rate render for these hooks."""
+    key = (notes_key(hooks), bpm, None if timing is None else tuple(timing))
+    return _job("full_render", key, render_hooks, hooks, bpm=bpm, sample_rate=EXPORT_SR, timing=timing)
+
+
+def _preview_players(hooks, bpm: int, timing, full: Future, polling: bool) -> None:
+    if full.done():
+        if polling:
+            st.rerun()  # drop the polling fragment now that the upgrade landed
+        rendered = full.result()
+        _generation_graph().store_audio(hooks, rendered, bpm=bpm, timing=timing)  # the download reuses it
+    else:
+        rendered = _generation_graph().audio(hooks, bpm=bpm, sample_rate=PREVIEW_SAMPLE_RATE, timing=timing)
+        st.caption(f"Quick preview at {PREVIEW_SAMPLE_RATE // 1000} kHz; full quality is loading.")
+    for i in range(len(rendered)):
+        st.audio(rendered.wav_bytes(i), format="audio/wav")
+
+
+def _bundle_download(
+    hooks, *, bpm: int, timing, include_midi: bool, loop_bytes: Optional[bytes], loop_start: float, loop_bpm: float,
+    sample_rate: int, audio_format: str,
+):
+    """Build the ZIP when the download button is clicked, decoding the loop only if it is mixed in."""
+    loop = decode_loop(loop_bytes, sr=sample_rate) if loop_bytes is not None else None
+    return bundle_file(
+        hooks, bpm=bpm, sample_rate=sample_rate, include_midi=include_midi, timing=timing,
+        loop=loop, loop_start=loop_start, loop_bpm=loop_bpm, audio_format=audio_format,
+        renderer=_generation_graph().audio,
+    )
+
 
 def _confidence_badge(scale: Optional[str], score: float) -> None:
     if not scale:
         st.info("Scale detection: loop sounded mostly percussive, so pick a scale manually.")
         return
 
-    if score >= 0.6:
+    if score >= 0.4:
         tone = "success"
         note = "High confidence"
-    elif score >= 0.4:
+    elif score >= 0.3:
         tone = "warning"
         note = "Medium confidence"
     else:
@@ -36,97 +202,151 @@ def _confidence_badge(scale: Optional[str], score: float) -> None:
     getattr(st, tone)(msg)
 
 
-file = st.file_uploader("Upload WAV/MP3", type=["wav", "mp3"])
-
-scale_options = list_available_scales()
-default_scale = "C minor"
-scale_index = scale_options.index(default_scale) if default_scale in scale_options else 0
-
-suggested_scale = None
-suggested_score = 0.0
-uploaded_name = None
-audio_array = None
-sample_rate = None
-histogram = None
-detected_bpm = None
-
-notes_help = "Lower values give sparse hooks, higher values pack in more notes each bar."
-density = st.slider("Notes per bar", 4, 12, 7, help=notes_help)
-
-sync_help = "0 keeps hits on the grid; 1 pushes accents to the off-beats for a funkier feel."
-sync = st.slider("Groove push", 0.0, 1.0, 0.5, 0.1, help=sync_help)
-
-register_help = "Low hugs the lower octave, mid sits around middle C, high jumps up an octave."
-register = st.select_slider("Pitch range", options=["low", "mid", "high"], value="mid", help=register_help)
-
-if file:
-    uploaded_name = file.name
-    file.seek(0)
-    audio_bytes = file.read()
-    audio_array, sample_rate = librosa.load(io.BytesIO(audio_bytes), sr=22050, mono=True)
-
-    detected_bpm, beat_times = estimate_bpm_and_beats(audio_array, sample_rate)
-    ticks = ticks_from_beats(beat_times, subdiv=4)
-    histogram = groove_histogram(audio_array, sample_rate, ticks)
-    if histogram is None or not np.any(histogram):
-        histogram = np.ones(16) / 16.0
-
-    suggested_scale, suggested_score = detect_scale_from_audio(audio_array, sample_rate)
-    if suggested_scale and suggested_scale in scale_options:
-        scale_index = scale_options.index(suggested_scale)
-
-scale = st.selectbox(
-    "Scale",
-    scale_options,
-    index=scale_index,
-    help="Choose the key for the generated hooks. Override the suggestion if it sounds off.",
-)
-
-sidebar = st.sidebar
-sidebar.header("Loop Summary")
-if uploaded_name:
-    sidebar.markdown(f"**File:** {uploaded_name}")
-    sidebar.markdown(f"**Download:** `{build_zip_name(uploaded_name)}`")
-    if detected_bpm:
-        sidebar.markdown(f"**Detected BPM:** {detected_bpm:.1f}")
-    if suggested_scale:
-        sidebar.markdown(f"**Suggested scale:** {suggested_scale} ({suggested_score:.2f})")
-    else:
-        sidebar.markdown("**Suggested scale:** (manual selection)")
-else:
-    sidebar.info("Upload a loop above to see session details.")
-
-if file:
-    _confidence_badge(suggested_scale, suggested_score)
-
-if audio_array is not None:
-    st.write(f"Detected BPM: **{detected_bpm:.1f}** (override with the slider if it feels wrong)")
-    bpm = st.slider(
-        "BPM",
-        60,
-        180,
-        int(round(detected_bpm)),
-        help="Use this to correct the tempo if the detector guesses wrong.",
-    )
+if __name__ == "__main__":  # spawned workers re-run this script as __mp_main__
+    # Start (and warm) the workers now so librosa's import and JIT cost is paid
+    # while the first visitor is still picking a file, not after the upload.
+    _worker_pool().submit(int)
+
+# Per-rerun stage timings for the debug panel at the bottom of the sidebar. The
+# with-block closes the report (and any profiler) even when st.rerun()/st.stop()
+# or an error ends the script early.
+with instrument.request("rerun") as debug_report:
+    file = st.file_uploader("Upload WAV/MP3", type=["wav", "mp3"])
+
+    scale_options = list_available_scales()
+    default_scale = "C minor"
+    scale_index = scale_options.index(default_scale) if default_scale in scale_options else 0
+
+    suggested_scale = None
+    suggested_score = 0.0
+    uploaded_name = None
+    analysis = None
+    histogram = None
+    detected_bpm = None
+
+    notes_help = "Lower values give sparse hooks, higher values pack in more notes each bar."
+    density = st.slider("Notes per bar", 4, 12, 7, help=notes_help)
+
+    sync_help = "0 keeps hits on the grid; 1 pushes accents to the off-beats for a funkier feel."
+    sync = st.slider("Groove push", 0.0, 1.0, 0.5, 0.1, help=sync_help)
+
+    register_help = "Low hugs the lower octave, mid sits around middle C, high jumps up an octave."
+    register = st.select_slider("Pitch range", options=["low", "mid", "high"], value="mid", help=register_help)
+
+    bars_help = "Longer phrases repeat and vary a one-bar motif, following the loop's groove bar by bar."
+    bars = st.select_slider("Phrase length (bars)", options=sorted(PHRASE_FORMS), value=1, help=bars_help)
+
+    if file:
+        uploaded_name = file.name
+        file.seek(0)
+        audio_bytes = file.read()
+        key = analysis_key(audio_bytes, sr=ANALYSIS_SR, subdiv=ANALYSIS_SUBDIV, scale_mode=SCALE_MODE)
+        analysis = _analysis_for(key, audio_bytes, f"Analyzing {uploaded_name}")
 
-    reg_map = {"low": (48, 69), "mid": (55, 76), "high": (62, 84)}
-    hooks = []
-    for i in range(5):
-        events = sample_rhythm(histogram, density=density, syncopation=sync, seed=i)
-        notes = assign_pitches(events, scale=scale, register=reg_map[register], seed=i)
-        hooks.append(notes)
-
-    zbuf = io.BytesIO()
-    with zipfile.ZipFile(zbuf, "w") as zf:
-        for i, notes in enumerate(hooks, 1):
-            wav_bytes = notes_to_wav_bytes(notes, bpm=bpm)
-            zf.writestr(f"hook_{i}.wav", wav_bytes)
-        zf.writestr("hooks_combined.wav", hooks_to_wav_bytes(hooks, bpm=bpm))
-
-    download_name = build_zip_name(uploaded_name)
-    st.download_button(
-        "Download 5 hooks (ZIP)",
-        data=zbuf.getvalue(),
-        file_name=download_name,
-        mime="application/zip",
+    if analysis is not None:
+        detected_bpm = analysis.bpm
+        histogram = analysis.histogram
+        if histogram is None or not np.any(histogram):
+            histogram = np.ones(16) / 16.0
+
+        suggested_scale, suggested_score = analysis.scale, analysis.scale_score
+        if suggested_scale and suggested_scale in scale_options:
+            scale_index = scale_options.index(suggested_scale)
+
+    scale = st.selectbox(
+        "Scale",
+        scale_options,
+        index=scale_index,
+        help="Choose the key for the generated hooks. Override the suggestion if it sounds off.",
     )
+
+    sidebar = st.sidebar
+    sidebar.header("Loop Summary")
+    if uploaded_name:
+        sidebar.markdown(f"**File:** {uploaded_name}")
+        sidebar.markdown(f"**Download:** `{build_zip_name(uploaded_name)}`")
+        if detected_bpm:
+            sidebar.markdown(f"**Detected BPM:** {detected_bpm:.1f}")
+        if suggested_scale:
+            sidebar.markdown(f"**Suggested scale:** {suggested_scale} ({suggested_score:.2f})")
+        elif analysis is not None:
+            sidebar.markdown("**Suggested scale:** (manual selection)")
+        else:
+            sidebar.markdown("**Suggested scale:** (analyzing...)")
+    else:
+        sidebar.info("Upload a loop above to see session details.")
+
+    cache_stats = _analysis_cache().stats()
+    near_duplicates = _fingerprint_index().stats()["matches"]
+    sidebar.caption(f"Analysis cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, {near_duplicates} near-duplicates")
+
+    if analysis is not None:
+        _confidence_badge(suggested_scale, suggested_score)
+
+    if analysis is not None:
+        st.write(f"Detected BPM: **{detected_bpm:.1f}** (override with the slider if it feels wrong)")
+        bpm = st.slider(
+            "BPM",
+            60,
+            180,
+            int(round(detected_bpm)),
+            help="Use this to correct the tempo if the detector guesses wrong.",
+        )
+        feel_help = "Shift each note by the loop's own micro-timing (swing, laid-back hits) instead of a straight grid."
+        follow_feel = st.checkbox("Follow the loop's feel", value=True, help=feel_help)
+        timing = tuple(analysis.timing_offsets.tolist()) if follow_feel else None
+
+        graph = _generation_graph()
+        settings = dict(
+            k=5, pool=2000, density=density, syncopation=sync, scale=scale, register=REGISTERS[register], seed=0,
+            chroma=analysis.chroma,
+        )
+        if bars == 1:
+            batch = graph.rank(histogram, **settings)
+        else:
+            batch = graph.phrases(analysis.groove_matrix, bars=bars, **settings)
+        hooks = batch.to_notes()
+
+        st.subheader("Preview")
+        full_render = _full_render(hooks, bpm, timing)
+        polling = not full_render.done()
+        # Poll only while the full-rate render is outstanding.
+        st.fragment(run_every=0.25 if polling else None)(_preview_players)(hooks, bpm, timing, full_render, polling)
+
+        include_midi = st.checkbox("Include MIDI files", value=False, help="Adds hook_N.mid plus a multi-track hooks.mid.")
+        with_loop_help = "Adds stereo hook_N_with_loop.wav files: each hook over your loop, starting on its first beat."
+        with_loop = st.checkbox("Include hooks over the loop", value=False, help=with_loop_help)
+        format_col, rate_col = st.columns(2)
+        format_help = "FLAC files are lossless and several times smaller than 16-bit WAV."
+        download_format = format_col.selectbox("Audio format", list(DOWNLOAD_FORMATS), help=format_help)
+        download_sr = rate_col.select_slider("Sample rate (Hz)", options=EXPORT_RATES, value=EXPORT_SR)
+
+        download_name = build_zip_name(uploaded_name)
+        st.download_button(
+            "Download 5 hooks (ZIP)",
+            # Rendered only when the button is clicked, not on every rerun.
+            data=partial(
+                _bundle_download, hooks, bpm=bpm, timing=timing, include_midi=include_midi,
+                loop_bytes=audio_bytes if with_loop else None,
+                loop_start=float(analysis.beat_times[0]) if analysis.beat_times.size else 0.0,
+                loop_bpm=analysis.bpm,
+                sample_rate=download_sr,
+                audio_format=DOWNLOAD_FORMATS[download_format],
+            ),
+            file_name=download_name,
+            mime="application/zip",
+            on_click="ignore",
+        )
+
+with sidebar.expander("Debug: stage timings"):
+    if debug_report.spans:
+        sidebar_rows = [
+            {"stage": "  " * item["depth"] + item["name"], "ms": round(item["duration_s"] * 1e3, 2)}
+            for item in debug_report.spans
+        ]
+        st.dataframe(sidebar_rows, hide_index=True)
+    st.caption(f"Rerun total: {debug_report.total_s * 1e3:.0f} ms")
+    if debug_report.counters:
+        st.json(debug_report.counters)
+    if debug_report.profile:
+        st.code(debug_report.profile)
@@ -0,0 +1,116 @@
+"""Disk store of decoded, resampled audio, shared between runs and worker processes.
+
+Every analysis starts by decoding the upload and resampling it to the
+analysis rate. The app's fingerprint probe and full analysis decode the same
+bytes twice, and batch re-runs with new settings decode every file again. This
+store keeps each decoded signal as a raw little-endian float32 file,
+
+    <sha256 of the file>-sr<rate>.f32
+
+and hands it back as a read-only np.memmap: no copy is made on load, and
+workers reading the same file share the OS page cache instead of each
+holding a decoded copy.
+
+The store is bounded by max_bytes: each put evicts the least recently used
+files (by mtime, which get refreshes) until the folder fits again.
+"""
+import hashlib
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Union
+
+import numpy as np
+
+from instrument import count
+
+
+PCM_DTYPE = np.dtype("<f4")
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # about 3.4 hours of 44.1 kHz mono
+
+
+def audio_digest(audio_bytes: bytes) -> str:
+    """Store key for an upload: the same sha256 cli.file_hash computes for a file."""
+    return hashlib.sha256(audio_bytes).hexdigest()
+
+
+def _map(file: Path, size: int) -> np.ndarray:
+    if size == 0:  # np.memmap refuses empty files
+        return np.zeros(0, dtype=PCM_DTYPE)
+    return np.memmap(file, dtype=PCM_DTYPE, mode="r")
+
+
+class AudioStore:
+    """Decoded mono float32 signals on disk, keyed by content hash and sample rate.
+
+    Instances only hold a path and a budget, so they pickle cheaply into worker
+    processes; hits, misses and evictions show up as instrument counters in
+    each request's report. max_bytes=None leaves the store unbounded.
+    """
+
+    def __init__(self, path: Union[str, Path], max_bytes: Optional[int] = DEFAULT_MAX_BYTES):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = None if max_bytes is None else max(0, int(max_bytes))
+
+    def _file(self, digest: str, sr: int) -> Path:
+        return self.path / f"{digest}-sr{int(sr)}.f32"
+
+    def get(self, digest: str, sr: int) -> Optional[np.ndarray]:
+        """Read-only memmap of a stored signal, or None."""
+        file = self._file(digest, sr)
+        try:
+            size = file.stat().st_size
+        except FileNotFoundError:
+            count("audio_store.miss")
+            return None
+        count("audio_store.hit")
+        try:
+            os.utime(file)  # mark as recently used
+        except OSError:
+            pass
+        return _map(file, size)
+
+    def put(self, digest: str, sr: int, y) -> np.ndarray:
+        """Store a decoded signal and return it as a memmap of the stored file."""
+        file = self._file(digest, sr)
+        # Write then rename, so concurrent workers never map a half-written file.
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "wb") as fh:
+            np.ascontiguousarray(y, dtype=PCM_DTYPE).tofile(fh)
+        os.replace(tmp, file)
+        self._evict(keep=file)
+        return _map(file, file.stat().st_size)
+
+    def _evict(self, keep: Path) -> None:
+        """Delete least recently used files until the store fits max_bytes again."""
+        if self.max_bytes is None:
+            return
+        files = []
+        for other in self.path.glob("*.f32"):
+            try:
+                files.append((other.stat(), other))
+            except FileNotFoundError:  # evicted by another worker meanwhile
+                continue
+        total = sum(st.st_size for st, _ in files)
+        for st, other in sorted(files, key=lambda item: item[0].st_mtime):
+            if total <= self.max_bytes:
+                break
+            if other == keep:
+                continue
+            try:
+                other.unlink()  # open memmaps of it stay valid on POSIX
+            except OSError:
+                continue
+            total -= st.st_size
+            count("audio_store.evict")
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.path.glob("*.f32"))
+
+    def stats(self) -> Dict[str, int]:
+        files = list(self.path.glob("*.f32"))
+        return {
+            "entries": len(files),
+            "bytes": sum(file.stat().st_size for file in files),
+        }
@@ -0,0 +1,100 @@
+"""Bundle size and build time for every export format.
+
+    python benchmarks/bundle_formats.py
+    python benchmarks/bundle_formats.py --bars 4 --sample-rate 44100 --with-loop --json formats.json
+
+Five hooks are ranked from an example loop's groove, rendered once, then
+bundled in each export.AUDIO_FORMATS entry with and without deflate. Build
+time covers encoding and zipping only (the render is shared), and the
+threaded formats are also timed with a single encode worker so the gain from
+the thread pool is visible.
+"""
+import argparse
+import io
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from analysis import analyze_bytes, decode_loop
+from bundle import write_bundle
+from export import AUDIO_FORMATS, render_hooks
+from scoring import rank_hooks, rank_phrases
+
+
+EXAMPLE = ROOT / "examples" / "reggaeton_96bpm.wav"
+
+
+def _median_s(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times)
+
+
+def run(path: Path, *, bars: int, sample_rate: int, with_loop: bool, repeat: int):
+    audio_bytes = path.read_bytes()
+    analysis = analyze_bytes(audio_bytes)
+    if bars == 1:
+        hooks = rank_hooks(analysis.histogram, pool=500, chroma=analysis.chroma).to_notes()
+    else:
+        hooks = rank_phrases(analysis.groove_matrix, bars=bars, pool=500, chroma=analysis.chroma).to_notes()
+    rendered = render_hooks(hooks, bpm=analysis.bpm, sample_rate=sample_rate)
+    loop = decode_loop(audio_bytes, sr=sample_rate) if with_loop else None
+
+    rows = []
+    for audio_format in AUDIO_FORMATS:
+        for deflate in (False, True):
+            for workers in ((None, 1) if audio_format != "wav" else (None,)):
+                def build():
+                    buf = io.BytesIO()
+                    write_bundle(
+                        buf, hooks, bpm=analysis.bpm, sample_rate=sample_rate, include_midi=True,
+                        loop=loop, loop_start=float(analysis.beat_times[0]) if analysis.beat_times.size else 0.0, loop_bpm=analysis.bpm,
+                        audio_format=audio_format, deflate=deflate, encode_workers=workers,
+                        renderer=lambda *args, **kwargs: rendered,
+                    )
+                    return buf
+
+                size = build().getbuffer().nbytes
+                rows.append({
+                    "format": audio_format,
+                    "deflate": deflate,
+                    "workers": workers or "pool",
+                    "bytes": size,
+                    "median_s": _median_s(build, repeat),
+                })
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("file", nargs="?", default=str(EXAMPLE), help="Loop to generate hooks from.")
+    parser.add_argument("--bars", type=int, default=1, choices=(1, 2, 4, 8))
+    parser.add_argument("--sample-rate", type=int, default=22050)
+    parser.add_argument("--with-loop", action="store_true", help="Include the hook-over-loop mixes.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Write results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    rows = run(Path(args.file), bars=args.bars, sample_rate=args.sample_rate, with_loop=args.with_loop, repeat=args.repeat)
+    baseline = rows[0]["bytes"]
+    print(f"{'format':<10} {'deflate':<8} {'workers':<8} {'KiB':>9} {'size':>6} {'median ms':>10}")
+    for row in rows:
+        print(
+            f"{row['format']:<10} {str(row['deflate']):<8} {str(row['workers']):<8} {row['bytes'] / 1024:>9.1f} "
+            f"{row['bytes'] / baseline:>6.2f} {row['median_s'] * 1e3:>10.2f}"
+        )
+    if args.json:
+        Path(args.json).write_text(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Scaling benchmark for the tick grid and groove histogram helpers.
+
+Compares the vectorized rhythm helpers against the original per-beat /
+per-onset Python loops on synthetic multi-minute stems. No audio decoding is
+involved, so the numbers isolate the grid and histogram work itself.
+
+    python benchmarks/groove_scaling.py --minutes 1 4 16
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import numpy as np
+
+from rhythm import histogram_from_onsets, ticks_from_beats
+
+
+def _legacy_ticks(beat_times, subdiv=4):
+    if len(beat_times) < 2: return np.array([])
+    tick_times = []
+    for i in range(len(beat_times)-1):
+        seg = np.linspace(beat_times[i], beat_times[i+1], subdiv, endpoint=False)
+        tick_times.extend(seg.tolist())
+    return np.array(tick_times)
+
+
+def _legacy_histogram(onsets, tick_times):
+    hist = np.zeros(16)
+    for t in onsets:
+        idx = np.argmin(np.abs(tick_times - t))
+        hist[idx % 16] += 1
+    return hist / hist.sum() if hist.sum() > 0 else np.ones(16)/16
+
+
+def _synthetic_stem(minutes, bpm=120.0, seed=0):
+    rng = np.random.default_rng(seed)
+    beat = 60.0 / bpm
+    beats = np.arange(0.0, minutes * 60.0, beat) + rng.normal(0.0, 0.004, int(np.ceil(minutes * 60.0 / beat)))
+    beats = np.sort(beats)
+    # Busy 16th-note part with ~60% of slots hit and a little human jitter.
+    slots = np.arange(0.0, minutes * 60.0, beat / 4)
+    onsets = slots[rng.random(slots.size) < 0.6]
+    onsets = onsets + rng.normal(0.0, 0.01, onsets.size)
+    return beats, np.sort(onsets)
+
+
+def _best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--minutes", type=float, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    print(f"{'minutes':>8} {'onsets':>8} {'ticks':>8} {'legacy ms':>10} {'vector ms':>10} {'speedup':>8}")
+    for minutes in args.minutes:
+        beats, onsets = _synthetic_stem(minutes)
+        ticks = ticks_from_beats(beats)
+        np.testing.assert_array_equal(ticks, _legacy_ticks(beats))
+        np.testing.assert_allclose(histogram_from_onsets(onsets, ticks), _legacy_histogram(onsets, ticks))
+
+        legacy = _best_of(lambda: _legacy_histogram(onsets, _legacy_ticks(beats)), args.repeat)
+        vector = _best_of(lambda: histogram_from_onsets(onsets, ticks_from_beats(beats)), args.repeat)
+        print(
+            f"{minutes:>8g} {onsets.size:>8d} {ticks.size:>8d} "
+            f"{legacy * 1e3:>10.2f} {vector * 1e3:>10.3f} {legacy / vector:>7.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""Accuracy vs. speed of the scale detection modes over the bundled examples.
+
+    python benchmarks/scale_modes.py
+    python benchmarks/scale_modes.py --json scale_modes.json
+
+For each loop both detect_scale_from_audio modes and both analyze_loop chroma
+paths (HPSS vs. sampled frames of the shared STFT) are timed. A mode counts as
+correct when its best template has the tonic of the key in the file name (e.g.
+keys_eminor_100bpm.wav), so E phrygian passes for E minor. Agreement with the
+full mode (same best template) is reported for every loop, named key or not.
+"""
+import argparse
+import json
+import re
+import statistics
+import sys
+import time
+import warnings
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import librosa
+import numpy as np
+
+from analysis import HOP_LENGTH, N_FFT, _chroma_from_stft, decode_audio
+from motif import (
+    NOTE_TO_SEMITONE,
+    SCALE_MODES,
+    SCALE_NAMES,
+    _fast_chroma,
+    _parse_scale,
+    detect_scale_from_audio,
+    match_scales,
+)
+
+
+EXAMPLES = ROOT / "examples"
+SR = 22050
+KEY_IN_NAME = re.compile(r"_([a-g][b#]?)(major|minor)_", re.IGNORECASE)
+
+
+def _tonic(scale):
+    return NOTE_TO_SEMITONE[_parse_scale(scale)[0]]
+
+
+def _expected(path):
+    match = KEY_IN_NAME.search(path.name)
+    if not match:
+        return None
+    return f"{match.group(1).capitalize()} {match.group(2).lower()}"
+
+
+def _best_template(chroma):
+    chroma = np.asarray(chroma, dtype=float)
+    if not np.any(chroma):
+        return None
+    return SCALE_NAMES[int(match_scales(chroma)[0][0])]
+
+
+def _timed(fn, repeat):
+    times, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), result
+
+
+def bench_file(path, repeat):
+    y, sr = decode_audio(path.read_bytes(), sr=SR)
+    stft = librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH)
+
+    def full_chroma():
+        harmonic, _ = librosa.effects.hpss(y)
+        return librosa.feature.chroma_cqt(y=harmonic, sr=sr).mean(axis=1)
+
+    paths = {
+        "detect/full": (lambda: detect_scale_from_audio(y, sr, mode="full"), full_chroma),
+        "detect/fast": (lambda: detect_scale_from_audio(y, sr, mode="fast"), lambda: _fast_chroma(y, sr)),
+        "analysis/full": (lambda: _chroma_from_stft(stft, sr, "full"), lambda: _chroma_from_stft(stft, sr, "full")),
+        "analysis/fast": (lambda: _chroma_from_stft(stft, sr, "fast"), lambda: _chroma_from_stft(stft, sr, "fast")),
+    }
+    expected = _expected(path)
+    rows = []
+    for name, (run, chroma_fn) in paths.items():
+        median_s, _ = _timed(run, repeat)
+        best = _best_template(chroma_fn())
+        rows.append({
+            "file": path.name,
+            "path": name,
+            "median_s": median_s,
+            "best": best,
+            "expected": expected,
+            "correct": None if expected is None or best is None else _tonic(best) == _tonic(expected),
+        })
+    reference = {r["path"].split("/")[0]: r["best"] for r in rows if r["path"].endswith("/full")}
+    for row in rows:
+        ref = reference[row["path"].split("/")[0]]
+        row["agrees_with_full"] = ref is not None and row["best"] == ref
+    return rows
+
+
+def summarize(rows):
+    print(f"\n{'path':<15} {'median ms':>10} {'key acc':>8} {'agree':>6}")
+    summary = {}
+    for name in sorted({r["path"] for r in rows}):
+        picked = [r for r in rows if r["path"] == name]
+        graded = [r["correct"] for r in picked if r["correct"] is not None]
+        summary[name] = {
+            "median_s": statistics.median(r["median_s"] for r in picked),
+            "key_accuracy": sum(graded) / len(graded) if graded else None,
+            "agreement_with_full": sum(r["agrees_with_full"] for r in picked) / len(picked),
+        }
+        s = summary[name]
+        acc = f"{s['key_accuracy']:.2f}" if s["key_accuracy"] is not None else "-"
+        print(f"{name:<15} {s['median_s'] * 1e3:>10.2f} {acc:>8} {s['agreement_with_full']:>6.2f}")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*", help="Audio files (default: every examples/*.wav).")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="Write per-file rows and the summary to this JSON file.")
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings("ignore")
+    files = [Path(f) for f in args.files] or sorted(EXAMPLES.glob("*.wav"))
+    # Warm-up so numba JIT doesn't land on the first file.
+    for mode in SCALE_MODES:
+        detect_scale_from_audio(np.random.default_rng(0).standard_normal(SR).astype(np.float32), SR, mode=mode)
+
+    rows = []
+    print(f"{'file':<28} {'path':<15} {'median ms':>10} {'best template':<20} {'expected':<10}")
+    for path in files:
+        for row in bench_file(path, args.repeat):
+            rows.append(row)
+            mark = {True: "ok", False: "MISS", None: ""}[row["correct"]]
+            print(f"{row['file']:<28} {row['path']:<15} {row['median_s'] * 1e3:>10.2f} {str(row['best']):<20} {row['expected'] or '-':<10} {mark}")
+
+    summary = summarize(rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump({"results": rows, "summary": summary}, fh, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
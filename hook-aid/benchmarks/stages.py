@@ -0,0 +1,187 @@
+"""Per-stage timing and peak-memory benchmark over the bundled example loops.
+
+    python benchmarks/stages.py --json bench.json
+    python benchmarks/stages.py --json new.json --compare bench.json
+
+Each stage is timed `--repeat` times (min and median reported) and then run
+once more under tracemalloc to record its peak Python-heap allocation. The
+JSON output carries the git revision so runs from different commits can be
+compared with --compare.
+"""
+import argparse
+import io
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import librosa
+import numpy as np
+
+from analysis import analyze_loop, decode_audio
+from bundle import write_bundle
+from export import hooks_to_wav_bytes, notes_to_wav_bytes
+from motif import DEFAULT_SCALE, REGISTERS, detect_scale_from_audio
+from rhythm import estimate_bpm_and_beats, groove_histogram, ticks_from_beats
+from scoring import rank_hooks
+
+
+EXAMPLES = ROOT / "examples"
+SR = 22050
+
+
+def _stages(audio_bytes):
+    """Yield (name, fn) pairs; later stages reuse earlier outputs like the app does."""
+    state = {}
+
+    def decode():
+        state["y"], state["sr"] = decode_audio(audio_bytes, sr=SR)
+
+    def bpm():
+        state["bpm"], state["beats"] = estimate_bpm_and_beats(state["y"], state["sr"])
+
+    def groove():
+        state["hist"] = groove_histogram(state["y"], state["sr"], ticks_from_beats(state["beats"]))
+
+    def scale():
+        state["scale"] = detect_scale_from_audio(state["y"], state["sr"])[0] or DEFAULT_SCALE
+
+    def analysis():
+        analyze_loop(state["y"], state["sr"])
+
+    def generation():
+        batch = rank_hooks(state["hist"], k=5, pool=2000, scale=state["scale"], register=REGISTERS["mid"])
+        state["hooks"] = batch.to_notes()
+
+    def single_wavs():
+        for notes in state["hooks"]:
+            notes_to_wav_bytes(notes, bpm=state["bpm"])
+
+    def combined_wav():
+        hooks_to_wav_bytes(state["hooks"], bpm=state["bpm"])
+
+    def zip_build():
+        write_bundle(io.BytesIO(), state["hooks"], bpm=state["bpm"])
+
+    return [
+        ("decode", decode),
+        ("estimate_bpm_and_beats", bpm),
+        ("groove_histogram", groove),
+        ("detect_scale_from_audio", scale),
+        ("analyze_loop", analysis),
+        ("generation", generation),
+        ("notes_to_wav_bytes", single_wavs),
+        ("hooks_to_wav_bytes", combined_wav),
+        ("zip_build", zip_build),
+    ]
+
+
+def _peak_bytes(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_file(path: Path, repeat: int):
+    audio_bytes = path.read_bytes()
+    rows = []
+    for name, fn in _stages(audio_bytes):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - start)
+        rows.append({
+            "file": path.name,
+            "stage": name,
+            "min_s": min(times),
+            "median_s": statistics.median(times),
+            "peak_bytes": _peak_bytes(fn),
+        })
+    return rows
+
+
+def _git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline, threshold):
+    """Print per-stage median ratios against a previous run; return the regressions."""
+    before = {(r["file"], r["stage"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\nvs {baseline['meta'].get('git') or 'baseline'} (ratio > {threshold:.2f} flagged)")
+    for row in current["results"]:
+        old = before.get((row["file"], row["stage"]))
+        if not old or old["median_s"] <= 0:
+            continue
+        ratio = row["median_s"] / old["median_s"]
+        flag = "  REGRESSION" if ratio > threshold else ""
+        if flag:
+            regressions.append((row["file"], row["stage"], ratio))
+        print(f"{row['file']:<28} {row['stage']:<24} {ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*", help="Audio files to benchmark (default: every examples/*.wav).")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="Write results to this JSON file.")
+    parser.add_argument("--compare", help="Previous JSON run to compare medians against.")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Slowdown ratio reported as a regression.")
+    args = parser.parse_args(argv)
+
+    warnings.filterwarnings("ignore")
+    files = [Path(f) for f in args.files] or sorted(EXAMPLES.glob("*.wav"))
+
+    # Warm-up so numba JIT and first-call caches don't land on the first file.
+    for _, fn in _stages(files[0].read_bytes()):
+        fn()
+
+    results = []
+    print(f"{'file':<28} {'stage':<24} {'median ms':>10} {'peak MiB':>9}")
+    for path in files:
+        for row in bench_file(path, args.repeat):
+            results.append(row)
+            print(f"{row['file']:<28} {row['stage']:<24} {row['median_s'] * 1e3:>10.2f} {row['peak_bytes'] / 2**20:>9.2f}")
+
+    report = {
+        "meta": {
+            "git": _git_revision(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "librosa": librosa.__version__,
+            "repeat": args.repeat,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump(report, fh, indent=2)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""Streaming ZIP bundle builder for the hook download.
+
+Nothing is rendered until the bundle is actually written. In the default
+16-bit WAV format, frames are converted and pushed into each zip entry in
+chunks, so the only full-size audio held in memory is the float render
+buffer itself. Other formats (export.AUDIO_FORMATS) are encoded with
+soundfile on a thread pool of at most one thread per CPU, with only a few
+files in flight at once; mixes over the loop are encoded block by block.
+"""
+import io
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import BinaryIO, Callable, Iterable, List, Optional
+
+import numpy as np
+
+from instrument import timed
+from export import (
+    AUDIO_FORMATS,
+    Note,
+    RenderedHooks,
+    Timing,
+    encode_audio,
+    hooks_to_midi_bytes,
+    loop_mix,
+    midi_files,
+    render_hooks,
+    write_wav_stream,
+)
+
+
+def _in_order(pool: ThreadPoolExecutor, jobs, *, window: int):
+    """Run (name, job) pairs on pool and yield (name, result) in order, with at most `window` submitted ahead.
+
+    Entries are written while later files are still encoding, but only a
+    window's worth of signals and encoded files is ever held at once.
+    """
+    pending = deque()
+    for name, job in jobs:
+        if len(pending) >= window:
+            done, future = pending.popleft()
+            yield done, future.result()
+        pending.append((name, pool.submit(job)))
+    while pending:
+        done, future = pending.popleft()
+        yield done, future.result()
+
+
+@timed("bundle.write_bundle")
+def write_bundle(
+    fileobj: BinaryIO,
+    hooks: Iterable[Iterable[Note]],
+    *,
+    bpm: float,
+    sample_rate: int = 22050,
+    include_midi: bool = False,
+    chunk_frames: int = 16384,
+    timing: Timing = None,
+    loop: Optional[np.ndarray] = None,
+    loop_start: float = 0.0,
+    loop_bpm: Optional[float] = None,
+    audio_format: str = "wav",
+    deflate: bool = False,
+    encode_workers: Optional[int] = None,
+    renderer: Callable[..., RenderedHooks] = render_hooks,
+) -> List[str]:
+    """Render hooks and stream hook_N.wav, hooks_combined.wav (and MIDI) into a ZIP.
+
+    timing (a loop's analysis.timing_offsets) applies to the audio and the MIDI
+    alike. With the original loop at sample_rate (see export.loop_mix), each
+    hook is also written over it as hook_N_with_loop.wav, whole bars long and
+    starting from the loop's first beat at loop_start seconds and resampled
+    from the loop's detected loop_bpm to bpm, so a rounded tempo doesn't drift.
+
+    audio_format picks one of export.AUDIO_FORMATS (encoded on up to
+    encode_workers threads, default one per CPU). deflate compresses WAV and MIDI entries; FLAC
+    entries are always stored as-is, since deflating them again gains
+    nothing. renderer takes render_hooks' arguments; pass
+    GenerationGraph.audio to reuse cached renders. Returns the entry names
+    in the order they were written.
+    """
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f"Unknown audio format {audio_format!r}; expected one of {sorted(AUDIO_FORMATS)}")
+    extension, _, _, precompressed = AUDIO_FORMATS[audio_format]
+    hooks = [list(notes) for notes in hooks]
+    rendered = renderer(hooks, bpm=bpm, sample_rate=sample_rate, timing=timing)
+    mix = None
+    if loop is not None:
+        last = max((onset + duration for notes in hooks for onset, duration, _ in notes), default=0)
+        mix = loop_mix(rendered, loop, bpm=bpm, bars=max(-(-last // 16), 1), start=loop_start, loop_bpm=loop_bpm)
+
+    names = []
+    with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED) as zf:
+        if audio_format == "wav":
+            for i in range(len(rendered)):
+                name = f"hook_{i + 1}.wav"
+                with zf.open(name, "w") as entry:
+                    write_wav_stream(entry, rendered.track(i), sample_rate=sample_rate, chunk_frames=chunk_frames)
+                names.append(name)
+
+            with zf.open("hooks_combined.wav", "w") as entry:
+                write_wav_stream(entry, rendered.mix(), sample_rate=sample_rate, chunk_frames=chunk_frames)
+            names.append("hooks_combined.wav")
+
+            for i in range(len(mix) if mix is not None else 0):
+                name = f"hook_{i + 1}_with_loop.wav"
+                with zf.open(name, "w") as entry:
+                    mix.write_wav(entry, i, chunk_frames=chunk_frames)
+                names.append(name)
+        else:
+            def encode(signal):
+                return lambda: encode_audio(signal(), sample_rate=sample_rate, audio_format=audio_format)
+
+            jobs = [(f"hook_{i + 1}", encode(partial(rendered.track, i))) for i in range(len(rendered))]
+            jobs.append(("hooks_combined", encode(rendered.mix)))
+            if mix is not None:
+                # Block by block, so no mix holds its own full copy of the bed.
+                jobs += [
+                    (f"hook_{i + 1}_with_loop", partial(mix.encode, i, audio_format, chunk_frames=chunk_frames))
+                    for i in range(len(mix))
+                ]
+
+            workers = max(1, min(encode_workers or os.cpu_count() or 1, len(jobs)))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for stem, data in _in_order(pool, jobs, window=workers):
+                    name = f"{stem}.{extension}"
+                    zf.writestr(name, data, compress_type=zipfile.ZIP_STORED if precompressed else None)
+                    names.append(name)
+
+        if include_midi:
+            for i, data in enumerate(midi_files(hooks, bpm=bpm, timing=timing), 1):
+                name = f"hook_{i}.mid"
+                zf.writestr(name, data)
+                names.append(name)
+            zf.writestr("hooks.mid", hooks_to_midi_bytes(hooks, bpm=bpm, timing=timing))
+            names.append("hooks.mid")
+    return names
+
+
+def bundle_file(
+    hooks: Iterable[Iterable[Note]],
+    *,
+    bpm: float,
+    sample_rate: int = 22050,
+    include_midi: bool = False,
+    timing: Timing = None,
+    loop: Optional[np.ndarray] = None,
+    loop_start: float = 0.0,
+    loop_bpm: Optional[float] = None,
+    audio_format: str = "wav",
+    deflate: bool = False,
+    renderer: Callable[..., RenderedHooks] = render_hooks,
+) -> io.BytesIO:
+    """Build the bundle into a rewound in-memory file (for st.download_button callables)."""
+    buf = io.BytesIO()
+    write_bundle(
+        buf, hooks, bpm=bpm, sample_rate=sample_rate, include_midi=include_midi, timing=timing,
+        loop=loop, loop_start=loop_start, loop_bpm=loop_bpm, audio_format=audio_format, deflate=deflate,
+        renderer=renderer,
+    )
+    buf.seek(0)
+    return buf
@@ -0,0 +1,150 @@
+"""Content-addressed cache for loop analysis results.
+
+Entries are keyed by a hash of the uploaded bytes plus the analysis parameters,
+held in a bounded in-memory LRU and optionally mirrored to compact .npz files
+so they survive restarts.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import fields
+from pathlib import Path
+from typing import Callable, Dict, Optional, Union
+
+import numpy as np
+
+from analysis import LoopAnalysis
+from instrument import count, span
+
+
+# Bump when LoopAnalysis changes shape (or how a field is computed) so stale .npz files are ignored.
+CACHE_VERSION = 6
+
+
+def analysis_key(audio_bytes: bytes, *, sr: int, subdiv: int, scale_mode: str = "full") -> str:
+    """Hash the audio payload together with the parameters that shape the analysis."""
+    digest = hashlib.sha256()
+    digest.update(f"v{CACHE_VERSION}:sr={int(sr)}:subdiv={int(subdiv)}:scale={scale_mode}:".encode("ascii"))
+    digest.update(audio_bytes)
+    return digest.hexdigest()
+
+
+def _analysis_to_arrays(analysis: LoopAnalysis) -> Dict[str, np.ndarray]:
+    arrays = {"version": np.array(CACHE_VERSION)}
+    for field in fields(LoopAnalysis):
+        value = getattr(analysis, field.name)
+        if field.name == "scale":
+            value = "" if value is None else value
+        arrays[field.name] = np.asarray(value)
+    return arrays
+
+
+def _analysis_from_arrays(arrays) -> Optional[LoopAnalysis]:
+    if "version" not in arrays or int(arrays["version"]) != CACHE_VERSION:
+        return None
+    values = {}
+    for field in fields(LoopAnalysis):
+        value = arrays[field.name]
+        if value.ndim == 0:
+            value = value.item()
+        values[field.name] = value
+    values["scale"] = values["scale"] or None
+    return LoopAnalysis(**values)
+
+
+class AnalysisCache:
+    """Two-tier (memory LRU + optional disk) store of LoopAnalysis results."""
+
+    def __init__(self, max_entries: int = 32, cache_dir: Optional[Union[str, Path]] = None):
+        self.max_entries = max(1, int(max_entries))
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._entries: "OrderedDict[str, LoopAnalysis]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _path(self, key: str) -> Optional[Path]:
+        return self.cache_dir / f"{key}.npz" if self.cache_dir is not None else None
+
+    def _remember(self, key: str, analysis: LoopAnalysis) -> None:
+        self._entries[key] = analysis
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self, key: str) -> Optional[LoopAnalysis]:
+        path = self._path(key)
+        if path is None or not path.exists():
+            return None
+        try:
+            with np.load(path, allow_pickle=False) as arrays:
+                return _analysis_from_arrays(arrays)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _store(self, key: str, analysis: LoopAnalysis) -> None:
+        path = self._path(key)
+        if path is None:
+            return
+        tmp = path.with_name(path.stem + ".tmp.npz")
+        np.savez_compressed(tmp, **_analysis_to_arrays(analysis))
+        tmp.replace(path)
+
+    def get(self, key: str) -> Optional[LoopAnalysis]:
+        with self._lock:
+            analysis = self._entries.get(key)
+            if analysis is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return analysis
+
+        analysis = self._load(key)
+        with self._lock:
+            if analysis is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, analysis)
+        return analysis
+
+    def put(self, key: str, analysis: LoopAnalysis) -> None:
+        with self._lock:
+            self._remember(key, analysis)
+        self._store(key, analysis)
+
+    def get_or_compute(
+        self,
+        audio_bytes: bytes,
+        compute: Callable[[bytes], LoopAnalysis],
+        *,
+        sr: int,
+        subdiv: int,
+        scale_mode: str = "full",
+    ) -> LoopAnalysis:
+        """Return the cached analysis for these bytes, running compute() on a miss."""
+        key = analysis_key(audio_bytes, sr=sr, subdiv=subdiv, scale_mode=scale_mode)
+        analysis = self.get(key)
+        if analysis is None:
+            count("analysis_cache.miss")
+            with span("cache.compute"):
+                analysis = compute(audio_bytes)
+            self.put(key, analysis)
+        else:
+            count("analysis_cache.hit")
+        return analysis
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
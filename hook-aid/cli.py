@@ -0,0 +1,335 @@
+"""Headless entry point for pre-generating hooks over a folder of loops.
+
+    python cli.py batch examples/ --out out/ --workers 8
+
+Each loop gets its own ZIP bundle (same layout as the app download), an
+entry in out/manifest.json and one JSON line of stage timings in
+out/trace.jsonl. Re-running skips loops whose content hash is already in
+the manifest with the same settings, so an interrupted run can simply be
+restarted; loops done with other settings are processed again.
+"""
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import instrument
+from analysis import ANALYSIS_SR, analyze_loop, decode_audio, decode_loop, warm_up
+from audio_store import AudioStore
+from bundle import write_bundle
+from export import AUDIO_FORMATS
+from motif import DEFAULT_SCALE, PHRASE_FORMS, REGISTERS, SCALE_MODES
+from scoring import rank_hooks, rank_phrases
+from ui_helpers import build_zip_name
+
+
+AUDIO_SUFFIXES = (".wav", ".mp3")
+MANIFEST_NAME = "manifest.json"
+# Results since the manifest was last written, one JSON line per loop.
+JOURNAL_NAME = "manifest.journal.jsonl"
+TRACE_NAME = "trace.jsonl"
+MANIFEST_VERSION = 1
+
+
+@dataclass(frozen=True)
+class BatchSettings:
+    """Generation settings applied to every loop in a batch run."""
+
+    hooks: int = 5
+    pool: int = 2000
+    density: int = 7
+    syncopation: float = 0.5
+    register: str = "mid"
+    sample_rate: int = 22050
+    include_midi: bool = False
+    seed: int = 0
+    scale_mode: str = "full"
+    bars: int = 1
+    follow_feel: bool = True
+    with_loop: bool = False
+    audio_format: str = "wav"
+    deflate: bool = False
+
+
+def settings_key(settings: BatchSettings) -> str:
+    """Short hash of the settings a bundle was made with, stored in its manifest entry."""
+    encoded = json.dumps(asdict(settings), sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def find_loops(inputs: Iterable[str]) -> List[Path]:
+    """Expand directories (recursively) and glob patterns into a sorted list of audio files."""
+    found = set()
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            candidates = path.rglob("*")
+        elif path.is_file():
+            candidates = [path]
+        else:
+            candidates = (Path(p) for p in glob.glob(item, recursive=True))
+        found.update(p.resolve() for p in candidates if p.is_file() and p.suffix.lower() in AUDIO_SUFFIXES)
+    return sorted(found)
+
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(out_dir: Path) -> Dict:
+    """The manifest with any journal left by an interrupted run applied."""
+    manifest = {"version": MANIFEST_VERSION, "loops": {}}
+    path = out_dir / MANIFEST_NAME
+    if path.exists():
+        with open(path, "r", encoding="utf-8") as fh:
+            stored = json.load(fh)
+        if stored.get("version") == MANIFEST_VERSION:
+            manifest = stored
+    journal = out_dir / JOURNAL_NAME
+    if journal.exists():
+        failures = manifest.setdefault("failures", {})
+        with open(journal, "r", encoding="utf-8") as fh:
+            for line in fh:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:  # torn last line from a killed run
+                    continue
+                if "entry" in record:
+                    manifest["loops"][record["hash"]] = record["entry"]
+                    failures.pop(record["hash"], None)
+                else:
+                    failures[record["hash"]] = record["failure"]
+    return manifest
+
+
+def save_manifest(out_dir: Path, manifest: Dict) -> None:
+    """Write the whole manifest and drop the journal it now includes."""
+    path = out_dir / MANIFEST_NAME
+    tmp = path.with_suffix(".json.tmp")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    tmp.replace(path)
+    (out_dir / JOURNAL_NAME).unlink(missing_ok=True)
+
+
+def process_loop(path: str, digest: str, out_dir: str, settings: BatchSettings, store: Optional[AudioStore] = None) -> Dict:
+    """Analyze one loop, generate hooks and write its bundle; returns the manifest entry.
+
+    The per-loop instrument report rides along under "trace" for the JSON-lines log.
+    With an AudioStore, a loop decoded by an earlier run is memory-mapped instead.
+    """
+    with instrument.request(str(path)) as report:
+        with instrument.span("batch.decode"):
+            with open(path, "rb") as fh:
+                audio_bytes = fh.read()
+            y, sr = decode_audio(audio_bytes, sr=ANALYSIS_SR, store=store, digest=digest)
+
+        with instrument.span("batch.analysis"):
+            analysis = analyze_loop(y, sr, scale_mode=settings.scale_mode)
+
+        with instrument.span("batch.generation"):
+            scale = analysis.scale or DEFAULT_SCALE
+            generation = dict(
+                k=settings.hooks,
+                pool=settings.pool,
+                density=settings.density,
+                syncopation=settings.syncopation,
+                scale=scale,
+                register=REGISTERS[settings.register],
+                seed=settings.seed,
+                chroma=analysis.chroma,
+            )
+            if settings.bars == 1:
+                batch = rank_hooks(analysis.histogram, **generation)
+            else:
+                batch = rank_phrases(analysis.groove_matrix, bars=settings.bars, **generation)
+
+        with instrument.span("batch.export"):
+            # Hash suffix keeps same-named loops from different folders apart.
+            bundle_name = build_zip_name(Path(path).name)[: -len(".zip")] + f" - {digest[:8]}.zip"
+            bundle_path = Path(out_dir) / bundle_name
+            tmp_path = bundle_path.with_suffix(".zip.tmp")
+            loop = decode_loop(audio_bytes, sr=settings.sample_rate) if settings.with_loop else None
+            with open(tmp_path, "wb") as fh:
+                write_bundle(
+                    fh, batch.to_notes(), bpm=analysis.bpm, sample_rate=settings.sample_rate,
+                    include_midi=settings.include_midi,
+                    timing=analysis.timing_offsets if settings.follow_feel else None,
+                    loop=loop,
+                    loop_start=float(analysis.beat_times[0]) if analysis.beat_times.size else 0.0,
+                    loop_bpm=analysis.bpm,
+                    audio_format=settings.audio_format,
+                    deflate=settings.deflate,
+                )
+            tmp_path.replace(bundle_path)
+
+    totals = report.totals()
+    return {
+        "file": str(path),
+        "bundle": bundle_name,
+        "bpm": round(analysis.bpm, 2),
+        "scale": scale,
+        "scale_detected": analysis.scale is not None,
+        "confidence": round(analysis.scale_score, 4),
+        "duration": round(analysis.duration, 3),
+        "timings": {stage: round(totals[f"batch.{stage}"], 4) for stage in ("decode", "analysis", "generation", "export")},
+        "trace": report.to_dict(),
+    }
+
+
+def run_batch(
+    inputs: Iterable[str],
+    out_dir: str,
+    *,
+    workers: Optional[int] = None,
+    settings: BatchSettings = BatchSettings(),
+    audio_store: Optional[str] = None,
+    log=print,
+) -> Dict:
+    """Process every loop not already in the manifest; returns the updated manifest.
+
+    audio_store is a folder of decoded loops (see audio_store.py) to reuse and fill.
+    Each result is appended to a journal as it lands and the manifest itself
+    is rewritten once at the end, so a large library costs O(N) writes.
+    """
+    store = AudioStore(audio_store) if audio_store else None
+    out = Path(out_dir)
+    out.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(out)
+    manifest["settings"] = asdict(settings)
+    key = settings_key(settings)
+    failures = manifest.setdefault("failures", {})
+
+    pending, up_to_date = {}, set()
+    for path in find_loops(inputs):
+        digest = file_hash(path)
+        done = manifest["loops"].get(digest)
+        if done and done.get("settings_key") == key and (out / done["bundle"]).exists():
+            up_to_date.add(digest)
+            continue
+        pending.setdefault(digest, str(path))
+    log(f"{len(pending)} loop(s) to process, {len(up_to_date)} already done")
+
+    def record(journal, digest, path, result=None, error=None):
+        if error is None:
+            with open(out / TRACE_NAME, "a", encoding="utf-8") as fh:
+                fh.write(json.dumps({"hash": digest, **result.pop("trace")}, sort_keys=True) + "\n")
+            result["settings_key"] = key
+            manifest["loops"][digest] = result
+            failures.pop(digest, None)
+            journal.write(json.dumps({"hash": digest, "entry": result}, sort_keys=True) + "\n")
+            log(f"ok   {path} ({result['bpm']} BPM, {result['scale']})")
+        else:
+            failures[digest] = {"file": path, "error": error}
+            journal.write(json.dumps({"hash": digest, "failure": failures[digest]}, sort_keys=True) + "\n")
+            log(f"FAIL {path}: {error}")
+        journal.flush()
+
+    workers = workers or os.cpu_count() or 1
+    try:
+        with open(out / JOURNAL_NAME, "a", encoding="utf-8") as journal:
+            if workers == 1:
+                for digest, path in pending.items():
+                    try:
+                        record(journal, digest, path, process_loop(path, digest, str(out), settings, store))
+                    except Exception as exc:  # keep going; the failure is recorded for the next run
+                        record(journal, digest, path, error=f"{type(exc).__name__}: {exc}")
+                return manifest
+
+            # Warm each worker up front so per-loop timings in the trace don't include librosa's start-up.
+            with ProcessPoolExecutor(max_workers=workers, initializer=warm_up) as pool:
+                futures = {
+                    pool.submit(process_loop, path, digest, str(out), settings, store): (digest, path)
+                    for digest, path in pending.items()
+                }
+                for future in as_completed(futures):
+                    digest, path = futures[future]
+                    try:
+                        record(journal, digest, path, future.result())
+                    except Exception as exc:  # keep going; the failure is recorded for the next run
+                        record(journal, digest, path, error=f"{type(exc).__name__}: {exc}")
+            return manifest
+    finally:
+        save_manifest(out, manifest)
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="hook-aid", description="Hook Generator Aid command line tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch = commands.add_parser("batch", help="Generate hook bundles for a folder or glob of loops.")
+    batch.add_argument("inputs", nargs="+", help="Audio files, directories or glob patterns.")
+    batch.add_argument("--out", default="hook-bundles", help="Output folder for bundles and manifest.json.")
+    batch.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    batch.add_argument("--hooks", type=int, default=BatchSettings.hooks)
+    batch.add_argument("--pool", type=int, default=BatchSettings.pool, help="Candidates scored per loop.")
+    batch.add_argument("--density", type=int, default=BatchSettings.density)
+    batch.add_argument("--syncopation", type=float, default=BatchSettings.syncopation)
+    batch.add_argument("--register", choices=sorted(REGISTERS), default=BatchSettings.register)
+    batch.add_argument("--bars", type=int, choices=sorted(PHRASE_FORMS), default=BatchSettings.bars, help="Phrase length in bars.")
+    batch.add_argument("--midi", action="store_true", help="Include MIDI files in each bundle.")
+    batch.add_argument("--with-loop", action="store_true", help="Also write each hook mixed over its loop (stereo).")
+    batch.add_argument("--format", dest="audio_format", choices=sorted(AUDIO_FORMATS), default=BatchSettings.audio_format, help="Audio file format in the bundles.")
+    batch.add_argument("--sample-rate", type=int, default=BatchSettings.sample_rate, help="Sample rate of the bundled audio.")
+    batch.add_argument("--deflate", action="store_true", help="Compress WAV/MIDI entries (FLAC is always stored as-is).")
+    batch.add_argument(
+        "--follow-feel", action=argparse.BooleanOptionalAction, default=BatchSettings.follow_feel,
+        help="Render and export with each loop's micro-timing (--no-follow-feel for a straight grid).",
+    )
+    batch.add_argument("--seed", type=int, default=BatchSettings.seed)
+    batch.add_argument("--scale-mode", choices=SCALE_MODES, default=BatchSettings.scale_mode, help="Scale detection: full (HPSS) or fast.")
+    batch.add_argument("--audio-store", default=None, help="Folder of decoded loops reused across runs.")
+
+    serve = commands.add_parser("serve", help="Run the local HTTP generation API (see server.py).")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    serve.add_argument("--audio-store", default=None, help="Folder of decoded uploads shared by the workers.")
+    serve.add_argument(
+        "--cache-dir", default=os.environ.get("HOOK_AID_CACHE_DIR"),
+        help="Keep analyses and the fingerprint index here between restarts (default: $HOOK_AID_CACHE_DIR).",
+    )
+    return parser
+
+
+def main(argv=None) -> int:
+    args = _build_parser().parse_args(argv)
+    if args.command == "batch":
+        settings = BatchSettings(
+            hooks=args.hooks,
+            pool=args.pool,
+            density=args.density,
+            syncopation=args.syncopation,
+            register=args.register,
+            include_midi=args.midi,
+            seed=args.seed,
+            scale_mode=args.scale_mode,
+            bars=args.bars,
+            follow_feel=args.follow_feel,
+            with_loop=args.with_loop,
+            audio_format=args.audio_format,
+            sample_rate=args.sample_rate,
+            deflate=args.deflate,
+        )
+        manifest = run_batch(args.inputs, args.out, workers=args.workers, settings=settings, audio_store=args.audio_store)
+        return 1 if manifest.get("failures") else 0
+    if args.command == "serve":
+        from server import run  # keeps asyncio/http setup out of batch runs
+
+        run(args.host, args.port, workers=args.workers, audio_store=args.audio_store, cache_dir=args.cache_dir)
+        return 0
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
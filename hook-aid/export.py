@@ -1,9 +1,11 @@
 import io
-import wave
-from typing import Iterable, Tuple
+import struct
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import BinaryIO, Iterable, List, Optional, Sequence, Tuple
 
 import numpy as np
-from mido import Message, MetaMessage, MidiFile, MidiTrack, bpm2tempo
+from instrument import timed
 
 
 DEFAULT_TICKS_PER_BEAT = 480
@@ -15,156 +17,475 @@ TIME_SIGNATURE = {
 }
 
 Note = Tuple[int, int, int]
+# Per-slot micro-timing for the 16ths of a bar, in 16ths (+ = late); see analysis.loop_timing.
+Timing = Optional[Sequence[float]]
+
+# Sample rate of the quick in-app preview render; downloads use the full rate.
+PREVIEW_SAMPLE_RATE = 11025
+# Bundle audio formats: name -> (file extension, soundfile format, subtype, already compressed).
+# "wav" is written by write_wav_stream; the others are encoded with soundfile.
+AUDIO_FORMATS = {
+    "wav": ("wav", "WAV", "PCM_16", False),
+    "wav24": ("wav", "WAV", "PCM_24", False),
+    "wav-float": ("wav", "WAV", "FLOAT", False),
+    "flac": ("flac", "FLAC", "PCM_16", True),
+    "flac24": ("flac", "FLAC", "PCM_24", True),
+}
 
+# Level of the original loop under a hook in the "with loop" mixes (hook tones peak at 0.35).
+LOOP_GAIN = 0.5
+
+
+# Fixed events, pre-encoded. Files match mido's MidiFile.save byte for byte
+# (note_on and note_off alternate, so running status never applies).
+_TIME_SIGNATURE_EVENT = bytes([
+    0x00, 0xFF, 0x58, 0x04,
+    TIME_SIGNATURE["numerator"],
+    TIME_SIGNATURE["denominator"].bit_length() - 1,  # stored as a power of two
+    TIME_SIGNATURE["clocks_per_click"],
+    TIME_SIGNATURE["notated_32nd_notes_per_beat"],
+])
+_END_OF_TRACK_EVENT = bytes([0x00, 0xFF, 0x2F, 0x00])
+_VLQ_SHIFTS = np.array([21, 14, 7, 0], dtype=np.int64)
+_VLQ_MAX = (1 << 28) - 1
+NOTE_VELOCITY = 96
+
+
+def _timing_key(timing: Timing) -> Optional[Tuple[float, ...]]:
+    """Hashable form of a timing profile; None when it is absent or all zero (the straight grid)."""
+    if timing is None:
+        return None
+    values = tuple(float(v) for v in np.asarray(timing, dtype=float).ravel())
+    if len(values) != 16:
+        raise ValueError(f"Expected a timing offset for each of 16 slots, got {len(values)}")
+    return values if any(values) else None
+
+
+def _slot_offsets(timing: Timing, onsets: np.ndarray) -> np.ndarray:
+    """Timing offset (in 16ths) of each onset's slot; zeros for a straight grid."""
+    key = _timing_key(timing)
+    if key is None:
+        return np.zeros(np.shape(onsets))
+    return np.asarray(key)[np.asarray(onsets, dtype=np.int64) % 16]
+
+
+def _vlq(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """MIDI variable-length quantities as (n, 4) byte columns plus a mask of the bytes in use."""
+    values = np.asarray(values, dtype=np.int64)
+    if values.size and (values.min() < 0 or values.max() > _VLQ_MAX):
+        raise ValueError("MIDI delta times must be between 0 and 2**28 - 1 ticks")
+    groups = (values[:, None] >> _VLQ_SHIFTS) & 0x7F
+    n_bytes = 1 + (values[:, None] >= (1 << _VLQ_SHIFTS[:-1])).sum(axis=1)
+    used = np.arange(4) >= 4 - n_bytes[:, None]
+    groups[:, :3] |= 0x80  # continuation bit on all but the last byte
+    return groups.astype(np.uint8), used
+
+
+def _note_events(hooks, channels, ticks_per_beat: int, velocity: int = NOTE_VELOCITY, timing: Timing = None):
+    """Encode every hook's note_on/note_off pairs in one pass; returns one bytes body per hook.
+
+    Notes are ordered by (onset, pitch) and each note_off directly follows its
+    note_on, so a note that overlaps the previous one starts when that one ends.
+    A timing profile moves each note_on by its slot's offset; lengths are kept.
+    """
+    counts = np.array([len(notes) for notes in hooks], dtype=np.int64)
+    if not counts.sum():
+        return [b"" for _ in hooks]
+    notes = np.array([note for notes in hooks for note in notes], dtype=np.int64).reshape(-1, 3)
+    row = np.repeat(np.arange(len(hooks)), counts)
+    order = np.lexsort((notes[:, 2], notes[:, 0], row))
+    onset, duration, pitch = notes[order].T
+    if pitch.min() < 0 or pitch.max() > 127:
+        raise ValueError("MIDI note numbers must be between 0 and 127")
+
+    start = np.maximum(0, np.rint((onset + _slot_offsets(timing, onset)) * ticks_per_beat / 4.0).astype(np.int64))
+    length = np.maximum(1, np.rint(duration * ticks_per_beat / 4.0).astype(np.int64))
+    previous_end = np.r_[0, (start + length)[:-1]]
+    previous_end[(np.cumsum(counts) - counts)[counts > 0]] = 0  # each hook starts at tick 0
+
+    on_delta, on_used = _vlq(np.maximum(0, start - previous_end))
+    off_delta, off_used = _vlq(length)
+    channel = np.asarray(channels, dtype=np.int64)[row]
+    on = np.stack([0x90 | channel, pitch, np.full_like(pitch, velocity)], axis=1).astype(np.uint8)
+    off = np.stack([0x80 | channel, pitch, np.zeros_like(pitch)], axis=1).astype(np.uint8)
+    always = np.ones(on.shape, dtype=bool)
+    events = np.concatenate([on_delta, on, off_delta, off], axis=1)
+    used = np.concatenate([on_used, always, off_used, always], axis=1)
+
+    encoded = events[used]  # row-major, so each note's bytes stay together and in order
+    hook_bytes = np.bincount(row, weights=used.sum(axis=1), minlength=len(hooks)).astype(np.int64)
+    return [chunk.tobytes() for chunk in np.split(encoded, np.cumsum(hook_bytes)[:-1])]
+
+
+def _vlq_bytes(value: int) -> bytes:
+    groups, used = _vlq(np.array([value]))
+    return groups[used].tobytes()
+
+
+def _tempo_events(bpm: float) -> bytes:
+    tempo = int(round(60 * 1e6 / max(bpm, 1)))
+    return bytes([0x00, 0xFF, 0x51, 0x03]) + tempo.to_bytes(3, "big") + _TIME_SIGNATURE_EVENT
+
+
+def _program_event(program: int, channel: int) -> bytes:
+    return bytes([0x00, 0xC0 | channel, program])
+
+
+def _track_name_event(name: str) -> bytes:
+    data = name.encode("latin-1")
+    return bytes([0x00, 0xFF, 0x03]) + _vlq_bytes(len(data)) + data
+
+
+def _chunk(name: bytes, data: bytes) -> bytes:
+    return name + struct.pack(">L", len(data)) + data
+
+
+def _midi_file(file_type: int, ticks_per_beat: int, tracks) -> bytes:
+    header = _chunk(b"MThd", struct.pack(">hhh", file_type, len(tracks), ticks_per_beat))
+    return header + b"".join(_chunk(b"MTrk", track + _END_OF_TRACK_EVENT) for track in tracks)
+
+
+@timed("export.midi_files")
+def midi_files(
+    midis: Iterable[Iterable[Note]], *, bpm: float, program: int = 0, channel: int = 0,
+    ticks_per_beat: int = DEFAULT_TICKS_PER_BEAT, timing: Timing = None,
+) -> List[bytes]:
+    """One type-0 file per hook (same bytes as notes_to_midi_bytes), encoded together."""
+    hooks = [list(notes) for notes in midis]
+    prefix = _tempo_events(bpm) + _program_event(program, channel)
+    bodies = _note_events(hooks, [channel] * len(hooks), ticks_per_beat, timing=timing)
+    return [_midi_file(0, ticks_per_beat, [prefix + body]) for body in bodies]
+
+
+@timed("export.notes_to_midi_bytes")
+def notes_to_midi_bytes(
+    notes: Iterable[Note], *, bpm: float, program: int = 0, channel: int = 0,
+    ticks_per_beat: int = DEFAULT_TICKS_PER_BEAT, timing: Timing = None,
+) -> bytes:
+    return midi_files([notes], bpm=bpm, program=program, channel=channel, ticks_per_beat=ticks_per_beat, timing=timing)[0]
+
+
+def _multi_track_midi(midis: Iterable[Iterable[Note]], *, bpm: float, program: int, ticks_per_beat: int, timing: Timing = None) -> bytes:
+    hooks = [list(notes) for notes in midis]
+    channels = [(idx - 1) % 16 for idx in range(1, len(hooks) + 1)]
+    bodies = _note_events(hooks, channels, ticks_per_beat, timing=timing)
+    tracks = [_tempo_events(bpm)]
+    for idx, (channel, body) in enumerate(zip(channels, bodies), start=1):
+        tracks.append(_track_name_event(f"hook_{idx}") + _program_event(program, channel) + body)
+    return _midi_file(1, ticks_per_beat, tracks)
 
-def _ticks_for_onset(onset: int, ticks_per_beat: int) -> int:
-    return max(0, int(round(onset * ticks_per_beat / 4.0)))
-
-
-def _ticks_for_duration(duration: int, ticks_per_beat: int) -> int:
-    return max(1, int(round(duration * ticks_per_beat / 4.0)))
-
-
-def _append_notes(track: MidiTrack, notes: Iterable[Note], *, channel: int, ticks_per_beat: int, velocity: int = 96) -> None:
-    current_tick = 0
-    for onset, dur, pitch in sorted(notes, key=lambda item: (item[0], item[2])):
-        start_tick = _ticks_for_onset(onset, ticks_per_beat)
-        delta_to_start = max(0, start_tick - current_tick)
-        track.append(Message("note_on", note=int(pitch), velocity=velocity, time=delta_to_start, channel=channel))
-        current_tick = start_tick
 
-        span_ticks = _ticks_for_duration(dur, ticks_per_beat)
-        track.append(Message("note_off", note=int(pitch), velocity=0, time=span_ticks, channel=channel))
-        current_tick = start_tick + span_ticks
+def write_multi_track(
+    midis: Iterable[Iterable[Note]], *, bpm: float, path: str, program: int = 0,
+    ticks_per_beat: int = DEFAULT_TICKS_PER_BEAT, timing: Timing = None,
+) -> str:
+    with open(path, "wb") as fh:
+        fh.write(_multi_track_midi(midis, bpm=bpm, program=program, ticks_per_beat=ticks_per_beat, timing=timing))
+    return path
 
 
-def _tempo_messages(bpm: float) -> Tuple[MetaMessage, MetaMessage]:
-    tempo = bpm2tempo(max(bpm, 1))
-    return (
-        MetaMessage("set_tempo", tempo=int(tempo), time=0),
-        MetaMessage("time_signature", time=0, **TIME_SIGNATURE),
-    )
+@timed("export.hooks_to_midi_bytes")
+def hooks_to_midi_bytes(
+    midis: Iterable[Iterable[Note]], *, bpm: float, program: int = 0,
+    ticks_per_beat: int = DEFAULT_TICKS_PER_BEAT, timing: Timing = None,
+) -> bytes:
+    """Same type-1 file as write_multi_track, returned as bytes instead of saved to disk."""
+    return _multi_track_midi(midis, bpm=bpm, program=program, ticks_per_beat=ticks_per_beat, timing=timing)
 
 
-def notes_to_midi_bytes(notes: Iterable[Note], *, bpm: float, program: int = 0, channel: int = 0, ticks_per_beat: int = DEFAULT_TICKS_PER_BEAT) -> bytes:
-    mid = MidiFile(type=0, ticks_per_beat=ticks_per_beat)
-    track = MidiTrack()
-    mid.tracks.append(track)
+def _note_unit_seconds(bpm: float) -> float:
+    beat_seconds = 60.0 / max(bpm, 1.0)
+    return beat_seconds / 4.0  # 16th-note resolution
 
-    for msg in _tempo_messages(bpm):
-        track.append(msg)
-    track.append(Message("program_change", program=program, channel=channel, time=0))
 
-    _append_notes(track, notes, channel=channel, ticks_per_beat=ticks_per_beat)
-    track.append(MetaMessage("end_of_track", time=0))
+@lru_cache(maxsize=64)
+def _timing_lut(timing: Tuple[float, ...], bpm: float, sample_rate: int) -> np.ndarray:
+    """Sample offset of each of the 16 slots, so placing a note is one table lookup."""
+    lut = np.rint(np.asarray(timing) * _note_unit_seconds(bpm) * sample_rate).astype(np.int64)
+    lut.flags.writeable = False
+    return lut
 
-    buf = io.BytesIO()
-    mid.save(file=buf)
-    return buf.getvalue()
 
+@lru_cache(maxsize=64)
+def _envelope(segment_len: int, sample_rate: int) -> np.ndarray:
+    attack_samples = max(int(0.01 * sample_rate), 1)
+    release_samples = max(int(0.02 * sample_rate), 1)
+    envelope = np.ones(segment_len, dtype=np.float32)
 
-def write_multi_track(midis: Iterable[Iterable[Note]], *, bpm: float, path: str, program: int = 0, ticks_per_beat: int = DEFAULT_TICKS_PER_BEAT) -> str:
-    mid = MidiFile(type=1, ticks_per_beat=ticks_per_beat)
+    atk = min(attack_samples, segment_len)
+    if atk > 0:
+        envelope[:atk] *= np.linspace(0.0, 1.0, atk, endpoint=False, dtype=np.float32)
 
-    tempo_track = MidiTrack()
-    mid.tracks.append(tempo_track)
-    for msg in _tempo_messages(bpm):
-        tempo_track.append(msg)
-    tempo_track.append(MetaMessage("end_of_track", time=0))
+    rel = min(release_samples, segment_len)
+    if rel > 0:
+        envelope[-rel:] *= np.linspace(1.0, 0.0, rel, endpoint=False, dtype=np.float32)
 
-    for idx, notes in enumerate(midis, start=1):
-        channel = (idx - 1) % 16
-        track = MidiTrack()
-        track.append(MetaMessage("track_name", name=f"hook_{idx}", time=0))
-        track.append(Message("program_change", program=program, channel=channel, time=0))
-        _append_notes(track, notes, channel=channel, ticks_per_beat=ticks_per_beat)
-        track.append(MetaMessage("end_of_track", time=0))
-        mid.tracks.append(track)
+    envelope.flags.writeable = False
+    return envelope
 
-    mid.save(path)
-    return path
 
+@lru_cache(maxsize=1024)
+def _tone(pitch: int, segment_len: int, sample_rate: int) -> np.ndarray:
+    """Enveloped sine for one (pitch, length) pair; hooks reuse a handful of these."""
+    t = np.arange(segment_len, dtype=np.float32) / sample_rate
+    freq = 440.0 * (2.0 ** ((pitch - 69) / 12.0))
+    tone = 0.35 * np.sin(2.0 * np.pi * freq * t).astype(np.float32) * _envelope(segment_len, sample_rate)
+    tone.flags.writeable = False
+    return tone
 
-def _note_unit_seconds(bpm: float) -> float:
-    beat_seconds = 60.0 / max(bpm, 1.0)
-    return beat_seconds / 4.0  # 16th-note resolution
 
+@dataclass(frozen=True)
+class RenderedHooks:
+    """Audio for several hooks in one zero-padded (n_hooks, samples) buffer."""
 
-def _notes_to_audio_array(notes: Iterable[Note], *, bpm: float, sample_rate: int) -> np.ndarray:
-    unit = _note_unit_seconds(bpm)
-    tail_seconds = unit
-    if not notes:
-        total_samples = int(sample_rate * tail_seconds)
-        return np.zeros(max(total_samples, sample_rate // 10), dtype=np.float32)
+    buffer: np.ndarray
+    lengths: np.ndarray
+    sample_rate: int
 
-    notes = list(notes)
-    end_16th = max(onset + duration for onset, duration, _ in notes)
-    total_seconds = (end_16th * unit) + tail_seconds
-    total_samples = max(int(np.ceil(total_seconds * sample_rate)), 1)
-    audio = np.zeros(total_samples, dtype=np.float32)
+    def __len__(self) -> int:
+        return self.buffer.shape[0]
 
-    attack_samples = max(int(0.01 * sample_rate), 1)
-    release_samples = max(int(0.02 * sample_rate), 1)
+    def track(self, i: int) -> np.ndarray:
+        return self.buffer[i, : self.lengths[i]]
 
-    for onset, duration, pitch in notes:
-        start_idx = int(round(onset * unit * sample_rate))
-        span = max(int(round(duration * unit * sample_rate)), 1)
-        end_idx = min(start_idx + span, total_samples)
-        if end_idx <= start_idx:
-            continue
+    def mix(self) -> np.ndarray:
+        """Average of all tracks, padded to the longest one."""
+        if len(self) == 0:
+            return np.zeros(0, dtype=np.float32)
+        mix = self.buffer.sum(axis=0, dtype=np.float32)
+        if len(self) > 1:
+            mix /= len(self)
+        return np.clip(mix, -1.0, 1.0)
 
-        segment_len = end_idx - start_idx
-        t = np.arange(segment_len, dtype=np.float32) / sample_rate
-        freq = 440.0 * (2.0 ** ((pitch - 69) / 12.0))
-        envelope = np.ones(segment_len, dtype=np.float32)
+    def wav_bytes(self, i: int) -> bytes:
+        return _float_audio_to_wav_bytes(self.track(i), sample_rate=self.sample_rate)
 
-        atk = min(attack_samples, segment_len)
-        if atk > 0:
-            envelope[:atk] *= np.linspace(0.0, 1.0, atk, endpoint=False, dtype=np.float32)
+    def mix_wav_bytes(self) -> bytes:
+        return _float_audio_to_wav_bytes(self.mix(), sample_rate=self.sample_rate)
 
-        rel = min(release_samples, segment_len)
-        if rel > 0:
-            envelope[-rel:] *= np.linspace(1.0, 0.0, rel, endpoint=False, dtype=np.float32)
 
-        tone = 0.35 * np.sin(2.0 * np.pi * freq * t).astype(np.float32) * envelope
-        audio[start_idx:end_idx] += tone
+@timed("export.render_hooks")
+def render_hooks(midis: Iterable[Iterable[Note]], *, bpm: float, sample_rate: int = 22050, timing: Timing = None) -> RenderedHooks:
+    """Render every note of every hook into one preallocated (n_hooks, samples) buffer.
 
-    return np.clip(audio, -1.0, 1.0)
+    With a timing profile each note starts at its grid position plus its
+    slot's offset, read from a per-(profile, bpm, rate) sample lookup table.
+    """
+    hooks = [list(notes) for notes in midis]
+    unit = _note_unit_seconds(bpm)
+    tail_seconds = unit
+    key = _timing_key(timing)
+    lut = _timing_lut(key, float(bpm), int(sample_rate)) if key is not None else None
+    late = max(int(lut.max()), 0) if lut is not None else 0
+
+    lengths = np.empty(len(hooks), dtype=np.int64)
+    for row, notes in enumerate(hooks):
+        if not notes:
+            lengths[row] = max(int(sample_rate * tail_seconds), sample_rate // 10)
+            continue
+        end_16th = max(onset + duration for onset, duration, _ in notes)
+        total_seconds = (end_16th * unit) + tail_seconds
+        lengths[row] = max(int(np.ceil(total_seconds * sample_rate)), 1) + late
+
+    width = int(lengths.max()) if len(hooks) else 0
+    flat = [(row, onset, duration, pitch) for row, notes in enumerate(hooks) for onset, duration, pitch in notes]
+    if not flat:
+        return RenderedHooks(np.zeros((len(hooks), width), dtype=np.float32), lengths, sample_rate)
+
+    rows, onsets, durations, pitches = (np.asarray(col) for col in zip(*flat))
+    starts = np.round(onsets * unit * sample_rate).astype(np.int64)
+    if lut is not None:
+        starts = np.maximum(starts + lut[onsets % 16], 0)
+    spans = np.maximum(np.round(durations * unit * sample_rate).astype(np.int64), 1)
+    ends = np.minimum(starts + spans, lengths[rows])
+    seg_lens = ends - starts
+    keep = seg_lens > 0
+    rows, starts, seg_lens, pitches = rows[keep], starts[keep], seg_lens[keep], pitches[keep]
+
+    # One pass over the flattened note table: all index math is vectorized above and
+    # each note is a slice-add of a cached tone, so nothing is re-synthesized.
+    buffer = np.zeros((len(hooks), width), dtype=np.float32)
+    for row, start, seg_len, pitch in zip(rows.tolist(), starts.tolist(), seg_lens.tolist(), pitches.tolist()):
+        buffer[row, start : start + seg_len] += _tone(pitch, seg_len, sample_rate)
+    return RenderedHooks(np.clip(buffer, -1.0, 1.0, out=buffer), lengths, sample_rate)
+
+
+@dataclass(frozen=True)
+class LoopMix:
+    """Hooks over the original loop: one shared (frames, channels) loop bed plus the mono hook render.
+
+    Mixes are formed a block at a time by broadcasting a hook's samples across
+    the bed's channels, so memory stays at one bed plus the hook render.
+    """
+
+    hooks: RenderedHooks
+    bed: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.hooks)
+
+    @property
+    def sample_rate(self) -> int:
+        return self.hooks.sample_rate
+
+    def block(self, i: int, start: int, stop: int) -> np.ndarray:
+        """(frames, channels) mix of hook i for frames [start, stop) of the bed."""
+        out = self.bed[start:stop].copy()
+        hook = self.hooks.buffer[i, start : start + out.shape[0]]
+        out[: hook.size] += hook[:, None]
+        return np.clip(out, -1.0, 1.0, out=out)
+
+    def track(self, i: int) -> np.ndarray:
+        return self.block(i, 0, self.bed.shape[0])
+
+    def write_wav(self, fileobj: BinaryIO, i: int, *, chunk_frames: int = 16384) -> int:
+        """Stream hook i's stereo (or multi-channel) mix as a 16-bit WAV."""
+        frames, channels = self.bed.shape
+        header = _wav_header(frames, sample_rate=self.sample_rate, channels=channels)
+        fileobj.write(header)
+        written = len(header)
+        for start in range(0, frames, chunk_frames):
+            data = _pcm16(self.block(i, start, start + chunk_frames))
+            fileobj.write(data)
+            written += len(data)
+        return written
+
+    def wav_bytes(self, i: int) -> bytes:
+        buf = io.BytesIO()
+        self.write_wav(buf, i)
+        return buf.getvalue()
+
+    def encode(self, i: int, audio_format: str, *, chunk_frames: int = 16384) -> bytes:
+        """Hook i's mix as a complete file in one of AUDIO_FORMATS, encoded block by block."""
+        frames, channels = self.bed.shape
+        blocks = (self.block(i, start, start + chunk_frames) for start in range(0, frames, chunk_frames))
+        return encode_audio_blocks(blocks, sample_rate=self.sample_rate, channels=channels, audio_format=audio_format)
+
+
+@timed("export.loop_mix")
+def loop_mix(
+    rendered: RenderedHooks, loop, *, bpm: float, bars: int, start: float = 0.0, loop_bpm: Optional[float] = None,
+    loop_gain: float = LOOP_GAIN,
+) -> LoopMix:
+    """Put rendered hooks over the original loop, tiled to `bars` bars from `start` seconds in.
+
+    loop is a (samples,) or (channels, samples) signal at the render's sample
+    rate (librosa.load(..., mono=False) layout); a mono loop is played on both
+    channels, so mixes are always at least stereo. start is the loop's first
+    detected beat, so hook bar 1 lines up with the loop's downbeat; the loop
+    wraps around past its end. With the loop's own tempo as loop_bpm, the bed
+    is resampled (varispeed, linear interpolation) by bpm / loop_bpm so its
+    beats stay on the hooks' grid instead of drifting a little every bar.
+    """
+    loop = np.atleast_2d(np.asarray(loop, dtype=np.float32))
+    if loop.shape[0] == 1:
+        loop = np.repeat(loop, 2, axis=0)
+    sample_rate = rendered.sample_rate
+    frames = max(int(round(bars * 16 * _note_unit_seconds(bpm) * sample_rate)), 1)
+    length = loop.shape[1]
+    if length == 0:
+        return LoopMix(rendered, np.zeros((frames, loop.shape[0]), dtype=np.float32))
+    if not loop_bpm or loop_bpm == bpm:
+        idx = (int(round(start * sample_rate)) + np.arange(frames)) % length
+        bed = np.ascontiguousarray(loop[:, idx].T)
+    else:
+        pos = start * sample_rate + np.arange(frames) * (bpm / loop_bpm)
+        left = np.floor(pos)
+        frac = (pos - left).astype(np.float32)[:, None]
+        left = left.astype(np.int64) % length
+        bed = np.ascontiguousarray(loop[:, left].T * (1.0 - frac) + loop[:, (left + 1) % length].T * frac)
+    bed *= loop_gain
+    return LoopMix(rendered, bed)
+
+
+def _notes_to_audio_array(notes: Iterable[Note], *, bpm: float, sample_rate: int, timing: Timing = None) -> np.ndarray:
+    return render_hooks([notes], bpm=bpm, sample_rate=sample_rate, timing=timing).track(0)
+
+
+def _wav_header(n_frames: int, *, sample_rate: int, channels: int = 1, sampwidth: int = 2) -> bytes:
+    data_size = n_frames * channels * sampwidth
+    return b"".join([
+        b"RIFF", struct.pack("<I", 36 + data_size), b"WAVE",
+        b"fmt ", struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, sample_rate * channels * sampwidth, channels * sampwidth, sampwidth * 8),
+        b"data", struct.pack("<I", data_size),
+    ])
+
+
+@timed("export.write_wav_stream")
+def write_wav_stream(fileobj: BinaryIO, audio: np.ndarray, *, sample_rate: int, chunk_frames: int = 16384) -> int:
+    """Write a (frames,) or (frames, channels) signal as a 16-bit WAV to a forward-only stream, chunk by chunk.
+
+    The header is computed up front, so the target never needs to seek (zip
+    entries, sockets). Returns the number of bytes written.
+    """
+    audio = _silence_if_empty(audio, sample_rate)
+    header = _wav_header(audio.shape[0], sample_rate=sample_rate, channels=audio.shape[1] if audio.ndim > 1 else 1)
+    fileobj.write(header)
+    written = len(header)
+    for start in range(0, audio.shape[0], chunk_frames):
+        frames = _pcm16(audio[start : start + chunk_frames])
+        fileobj.write(frames)
+        written += len(frames)
+    return written
+
+
+def _silence_if_empty(audio: np.ndarray, sample_rate: int) -> np.ndarray:
+    """0.1 s of silence in place of an empty signal, so every format writes a playable file."""
+    if audio.shape[0] == 0:
+        return np.zeros((sample_rate // 10,) + audio.shape[1:], dtype=np.float32)
+    return audio
+
+
+def _pcm16(audio: np.ndarray) -> bytes:
+    """Little-endian 16-bit frames; (frames, channels) input comes out interleaved."""
+    return (np.clip(audio, -1.0, 1.0) * 32767.0).astype("<i2").tobytes()
+
+
+@timed("export.encode_audio")
+def encode_audio(audio: np.ndarray, *, sample_rate: int, audio_format: str = "wav") -> bytes:
+    """One (frames,) or (frames, channels) signal as a complete file in one of AUDIO_FORMATS.
+
+    soundfile releases the GIL while libsndfile converts and (for FLAC)
+    compresses, so several of these can run at once on a thread pool.
+    """
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f"Unknown audio format {audio_format!r}; expected one of {sorted(AUDIO_FORMATS)}")
+    if audio_format == "wav":
+        return _float_audio_to_wav_bytes(audio, sample_rate=sample_rate)
+    audio = _silence_if_empty(audio, sample_rate)
+    channels = audio.shape[1] if audio.ndim > 1 else 1
+    return encode_audio_blocks([audio], sample_rate=sample_rate, channels=channels, audio_format=audio_format)
+
+
+def encode_audio_blocks(blocks: Iterable[np.ndarray], *, sample_rate: int, channels: int, audio_format: str) -> bytes:
+    """encode_audio for a signal given as consecutive blocks, so it never has to exist in one piece."""
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f"Unknown audio format {audio_format!r}; expected one of {sorted(AUDIO_FORMATS)}")
+    import soundfile as sf  # only the non-default formats need libsndfile
+
+    _, container, subtype, _ = AUDIO_FORMATS[audio_format]
+    buf = io.BytesIO()
+    with sf.SoundFile(buf, "w", samplerate=sample_rate, channels=channels, format=container, subtype=subtype) as out:
+        for block in blocks:
+            block = np.clip(block, -1.0, 1.0)
+            if subtype == "PCM_16":  # quantize like _pcm16, so 16-bit FLAC decodes to the WAV's samples
+                block = (block * 32767.0).astype(np.int16)
+            out.write(block)
+    return buf.getvalue()
 
 
 def _float_audio_to_wav_bytes(audio: np.ndarray, *, sample_rate: int) -> bytes:
-    if audio.size == 0:
-        audio = np.zeros(sample_rate // 10, dtype=np.float32)
-    pcm = np.clip(audio, -1.0, 1.0)
-    frames = (pcm * 32767.0).astype(np.int16).tobytes()
     buf = io.BytesIO()
-    with wave.open(buf, "wb") as wf:
-        wf.setnchannels(1)
-        wf.setsampwidth(2)
-        wf.setframerate(sample_rate)
-        wf.writeframes(frames)
+    write_wav_stream(buf, audio, sample_rate=sample_rate)
     return buf.getvalue()
 
 
-def notes_to_wav_bytes(notes: Iterable[Note], *, bpm: float, sample_rate: int = 22050) -> bytes:
-    audio = _notes_to_audio_array(notes, bpm=bpm, sample_rate=sample_rate)
-    return _float_audio_to_wav_bytes(audio, sample_rate=sample_rate)
+def notes_to_wav_bytes(notes: Iterable[Note], *, bpm: float, sample_rate: int = 22050, timing: Timing = None) -> bytes:
+    return render_hooks([notes], bpm=bpm, sample_rate=sample_rate, timing=timing).wav_bytes(0)
 
 
-def hooks_to_wav_bytes(midis: Iterable[Iterable[Note]], *, bpm: float, sample_rate: int = 22050) -> bytes:
-    tracks = [
-        _notes_to_audio_array(notes, bpm=bpm, sample_rate=sample_rate)
-        for notes in midis
-    ]
-    if not tracks:
+def hooks_to_wav_bytes(midis: Iterable[Iterable[Note]], *, bpm: float, sample_rate: int = 22050, timing: Timing = None) -> bytes:
+    rendered = render_hooks(midis, bpm=bpm, sample_rate=sample_rate, timing=timing)
+    if len(rendered) == 0:
         return notes_to_wav_bytes([], bpm=bpm, sample_rate=sample_rate)
-
-    max_len = max(track.shape[0] for track in tracks)
-    mix = np.zeros(max_len, dtype=np.float32)
-    for track in tracks:
-        mix[: track.shape[0]] += track
-
-    if len(tracks) > 1:
-        mix /= len(tracks)
-
-    return _float_audio_to_wav_bytes(np.clip(mix, -1.0, 1.0), sample_rate=sample_rate)
+    return rendered.mix_wav_bytes()
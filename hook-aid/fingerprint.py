@@ -0,0 +1,210 @@
+"""Loop fingerprints, so near-duplicate uploads reuse a stored analysis.
+
+Identical files never get here: AnalysisCache answers them by content hash.
+A re-exported copy of the same loop (other bit depth or container, resampled,
+gain change, trimmed silence) hashes differently but has the same tempo,
+groove and pitch content. Its fingerprint is
+
+    tempo   detected BPM, which must agree within TEMPO_TOLERANCE
+    vector  unit groove histogram (lightly smoothed) followed by unit mean chroma
+
+taken from a quick scale_mode="fast" analysis. The groove part is compared
+under every whole-beat rotation, because trimming or padding silence moves the
+first detected beat. Matches closer than MATCH_DISTANCE return the key of
+the analysis stored for the earlier upload; reuse_analysis merges it into
+this upload's quick analysis.
+"""
+import json
+import threading
+from dataclasses import dataclass, replace
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from analysis import BEATS_PER_BAR, LoopAnalysis, analyze_bytes
+from audio_store import AudioStore
+from instrument import count, span, timed
+
+
+FINGERPRINT_VERSION = 1
+TEMPO_TOLERANCE = 0.01
+# Measured on re-encoded copies of examples/: format/bit-depth/gain/resampling
+# land within 0.06, trimmed silence mostly within 0.15; distinct loops that
+# pass the tempo gate were 0.28 or further apart.
+MATCH_DISTANCE = 0.15
+
+_INITIAL_CAPACITY = 1024
+
+
+@dataclass(frozen=True)
+class Fingerprint:
+    bpm: float
+    vector: np.ndarray
+
+
+def _unit(values) -> np.ndarray:
+    values = np.asarray(values, dtype=np.float32)
+    norm = float(np.linalg.norm(values))
+    return values / norm if norm > 0 else values
+
+
+def fingerprint_analysis(analysis: LoopAnalysis) -> Fingerprint:
+    """Fingerprint of an existing analysis (use the fast-mode one for index entries)."""
+    hist = np.asarray(analysis.histogram, dtype=np.float32)
+    smoothed = 0.5 * hist + 0.25 * np.roll(hist, 1) + 0.25 * np.roll(hist, -1)  # tolerate one-tick jitter
+    return Fingerprint(float(analysis.bpm), np.concatenate([_unit(smoothed), _unit(analysis.chroma)]))
+
+
+@timed("fingerprint.fingerprint_bytes")
+def fingerprint_bytes(
+    audio_bytes: bytes, *, sr: int = 22050, subdiv: int = 4, store: Optional[AudioStore] = None,
+) -> Tuple[Fingerprint, LoopAnalysis]:
+    """Quick analysis of an upload and its fingerprint; runs in worker processes.
+
+    Pass the same AudioStore to the full analysis that may follow, so it reuses this decode.
+    """
+    quick = analyze_bytes(audio_bytes, sr=sr, subdiv=subdiv, scale_mode="fast", store=store)
+    return fingerprint_analysis(quick), quick
+
+
+def reuse_analysis(quick: LoopAnalysis, stored: LoopAnalysis) -> LoopAnalysis:
+    """This upload's quick analysis with the pitch fields of a near-duplicate's full one.
+
+    Only chroma, scale and scale_score (the fields scale_mode changes, and the
+    costly ones) come from the stored analysis; they don't depend on where the
+    loop starts. Tempo, beats, onsets, groove and duration are the quick pass's
+    own, so a trimmed or padded copy keeps its own beat_times.
+    """
+    return replace(quick, chroma=stored.chroma, scale=stored.scale, scale_score=stored.scale_score)
+
+
+def index_path(cache_dir: Union[str, Path], *, sr: int, subdiv: int, scale_mode: str) -> Path:
+    """Where the index for one set of analysis parameters lives inside a cache directory."""
+    return Path(cache_dir) / f"fingerprints-sr{int(sr)}-subdiv{int(subdiv)}-{scale_mode}"
+
+
+class FingerprintIndex:
+    """Growing nearest-neighbour index from fingerprints to analysis keys.
+
+    Rows live in one float32 matrix ([log2 bpm, vector...]) that grows by
+    doubling; a search is a tempo mask plus one small matrix product, a few
+    milliseconds at a few hundred thousand entries. With a path, rows and keys
+    are appended to files there and reloaded on start. discard() retires the
+    rows of a key whose analysis is gone by overwriting their tempo with NaN
+    in place, which no tempo mask ever selects again.
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None, *, groove_bins: int = 16):
+        self.path = Path(path) if path else None
+        self.groove_bins = int(groove_bins)
+        self.dim = self.groove_bins + 12
+        self._rows = np.zeros((0, 1 + self.dim), dtype=np.float32)
+        self._keys: list = []
+        self._lock = threading.Lock()
+        self.matches = 0
+        self.misses = 0
+        if self.path is not None:
+            self._open()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._live()
+
+    def _live(self) -> int:
+        return int(np.count_nonzero(~np.isnan(self._rows[: len(self._keys), 0])))
+
+    def _files(self):
+        return self.path / "index.json", self.path / "rows.f32", self.path / "keys.txt"
+
+    def _open(self) -> None:
+        meta_file, rows_file, keys_file = self._files()
+        self.path.mkdir(parents=True, exist_ok=True)
+        meta = {"version": FINGERPRINT_VERSION, "dim": self.dim}
+        try:
+            stale = json.loads(meta_file.read_text()) != meta
+        except (OSError, ValueError):
+            stale = True
+        if stale:
+            for file in (rows_file, keys_file):
+                file.unlink(missing_ok=True)
+            meta_file.write_text(json.dumps(meta))
+            return
+
+        rows = np.fromfile(rows_file, dtype=np.float32) if rows_file.exists() else np.zeros(0, np.float32)
+        keys = keys_file.read_text(encoding="ascii").split() if keys_file.exists() else []
+        # An interrupted append can leave one side short; keep only complete entries.
+        n = min(rows.size // (1 + self.dim), len(keys))
+        self._rows = np.zeros((max(_INITIAL_CAPACITY, 2 * n), 1 + self.dim), dtype=np.float32)
+        self._rows[:n] = rows[: n * (1 + self.dim)].reshape(n, 1 + self.dim)
+        self._keys = keys[:n]
+
+    def _row(self, fingerprint: Fingerprint) -> np.ndarray:
+        vector = np.asarray(fingerprint.vector, dtype=np.float32)
+        if vector.shape != (self.dim,):
+            raise ValueError(f"Expected a {self.dim}-value fingerprint, got shape {vector.shape}")
+        return np.concatenate([[np.log2(max(fingerprint.bpm, 1.0))], vector]).astype(np.float32)
+
+    def add(self, key: str, fingerprint: Fingerprint) -> None:
+        row = self._row(fingerprint)
+        with self._lock:
+            n = len(self._keys)
+            if n == self._rows.shape[0]:
+                grown = np.zeros((max(_INITIAL_CAPACITY, 2 * n), 1 + self.dim), dtype=np.float32)
+                grown[:n] = self._rows[:n]
+                self._rows = grown
+            self._rows[n] = row
+            self._keys.append(key)
+            if self.path is not None:
+                _, rows_file, keys_file = self._files()
+                with open(rows_file, "ab") as fh:
+                    fh.write(row.tobytes())
+                with open(keys_file, "a", encoding="ascii") as fh:
+                    fh.write(key + "\n")
+
+    def discard(self, key: str) -> None:
+        """Stop matching key, e.g. once its analysis has been evicted from the cache."""
+        with self._lock:
+            rows = [i for i, other in enumerate(self._keys) if other == key and not np.isnan(self._rows[i, 0])]
+            self._rows[rows, 0] = np.nan
+            if self.path is not None and rows:
+                _, rows_file, _ = self._files()
+                with open(rows_file, "r+b") as fh:
+                    for i in rows:
+                        fh.seek(i * (1 + self.dim) * 4)
+                        fh.write(np.float32(np.nan).tobytes())
+
+    def nearest(self, fingerprint: Fingerprint) -> Optional[Tuple[str, float]]:
+        """Closest entry within the tempo tolerance as (key, distance), or None."""
+        query = self._row(fingerprint)
+        step = max(1, self.groove_bins // BEATS_PER_BAR)
+        rotations = np.repeat(query[None, 1:], BEATS_PER_BAR, axis=0)
+        for r in range(BEATS_PER_BAR):
+            rotations[r, : self.groove_bins] = np.roll(query[1 : 1 + self.groove_bins], r * step)
+
+        with span("fingerprint.nearest"), self._lock:
+            rows = self._rows[: len(self._keys)]
+            candidates = np.flatnonzero(np.abs(rows[:, 0] - query[0]) <= np.log2(1.0 + TEMPO_TOLERANCE))
+            if candidates.size == 0:
+                return None
+            vectors = rows[candidates, 1:]
+            squared = (vectors ** 2).sum(axis=1)[:, None] - 2.0 * vectors @ rotations.T + (rotations[0] ** 2).sum()
+            closest = squared.min(axis=1)
+            best = int(np.argmin(closest))
+            return self._keys[candidates[best]], float(np.sqrt(max(closest[best], 0.0)))
+
+    def match(self, fingerprint: Fingerprint, max_distance: float = MATCH_DISTANCE) -> Optional[str]:
+        """Key of a stored near-duplicate, or None."""
+        found = self.nearest(fingerprint)
+        hit = found is not None and found[1] <= max_distance
+        with self._lock:
+            if hit:
+                self.matches += 1
+            else:
+                self.misses += 1
+        count("fingerprint.match" if hit else "fingerprint.miss")
+        return found[0] if hit else None
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": self._live(), "matches": self.matches, "misses": self.misses}
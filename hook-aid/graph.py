@@ -0,0 +1,174 @@
+"""Memoized generation graph: rhythms -> pitches -> ranked hooks -> audio.
+
+Each stage is cached on exactly the inputs it depends on, so a widget change
+only recomputes the stages downstream of it:
+
+    rhythms  (histogram, density, syncopation, seed, pool)
+    pitches  (rhythms, scale, register, seed)
+    ranking  (pitches, k, diversity, chroma)
+    audio    (notes, bpm, sample_rate, timing)
+
+Multi-bar phrases (rank_phrases) are cached as one stage of their own.
+Moving the BPM slider re-renders audio only; changing the register or scale
+reuses the rhythm pool. Results match scoring.rank_hooks for the same arguments.
+"""
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Iterable, Tuple
+
+import numpy as np
+
+from export import Note, RenderedHooks, Timing, _timing_key, render_hooks
+from instrument import count, span
+from motif import HookBatch, _stage_rngs, assign_pitches_batch, sample_rhythms
+from scoring import rank_phrases, score_hooks, select_top_k
+
+
+class MemoStage:
+    """Bounded LRU for one graph stage, with hit/miss counters."""
+
+    def __init__(self, name: str, max_entries: int = 16):
+        self.name = name
+        self.max_entries = max(1, int(max_entries))
+        self._entries: "OrderedDict[Hashable, object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def put(self, key: Hashable, value) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], object]):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                count(f"graph.{self.name}.hit")
+                return self._entries[key]
+            self.misses += 1
+        count(f"graph.{self.name}.miss")
+        with span(f"graph.{self.name}"):
+            value = compute()
+        self.put(key, value)
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def _array_key(values) -> Tuple:
+    array = np.ascontiguousarray(values, dtype=float)
+    return array.shape, array.tobytes()
+
+
+def notes_key(hooks: Iterable[Iterable[Note]]) -> Tuple:
+    """Hashable form of a list of hooks."""
+    return tuple(tuple((int(o), int(d), int(p)) for o, d, p in notes) for notes in hooks)
+
+
+class GenerationGraph:
+    """Per-stage memoization of the hook pipeline; safe to share between sessions."""
+
+    def __init__(self, max_entries: int = 16):
+        self.rhythm_stage = MemoStage("rhythms", max_entries)
+        self.pitch_stage = MemoStage("pitches", max_entries)
+        self.rank_stage = MemoStage("ranking", max_entries)
+        self.audio_stage = MemoStage("audio", max_entries)
+        self.phrase_stage = MemoStage("phrases", max_entries)
+
+    def rhythms(self, hist16, *, pool: int, density: int, syncopation: float, seed: int):
+        """Return (key, onsets, durations) for a pool of sampled rhythms."""
+        key = ("rhythms", _array_key(hist16), int(pool), int(density), float(syncopation), int(seed))
+
+        def compute():
+            rhythm_rng, _ = _stage_rngs(seed)
+            return sample_rhythms(hist16, pool, density=density, syncopation=syncopation, rng=rhythm_rng)
+
+        onsets, durations = self.rhythm_stage.get_or_compute(key, compute)
+        return key, onsets, durations
+
+    def pitches(self, rhythm_key: Tuple, n_notes: int, n: int, *, scale: str, register, seed: int):
+        """Return (key, pitches) for the rhythm pool identified by rhythm_key."""
+        key = ("pitches", rhythm_key, scale, tuple(int(r) for r in register), int(seed))
+
+        def compute():
+            _, pitch_rng = _stage_rngs(seed)
+            return assign_pitches_batch(n_notes, n, scale=scale, register=register, rng=pitch_rng)
+
+        return key, self.pitch_stage.get_or_compute(key, compute)
+
+    def rank(
+        self,
+        hist16,
+        *,
+        k: int = 5,
+        pool: int = 2000,
+        density: int = 7,
+        syncopation: float = 0.5,
+        scale: str = "C minor",
+        register=(55, 76),
+        seed: int = 0,
+        diversity: float = 0.3,
+        chroma=None,
+    ) -> HookBatch:
+        """Cached equivalent of scoring.rank_hooks."""
+        rhythm_key, onsets, durations = self.rhythms(hist16, pool=pool, density=density, syncopation=syncopation, seed=seed)
+        pitch_key, pitches = self.pitches(rhythm_key, onsets.shape[1], pool, scale=scale, register=register, seed=seed)
+        batch = HookBatch(onsets, durations, pitches)
+
+        def compute():
+            scores = score_hooks(batch, hist16, scale, syncopation=syncopation, chroma=chroma)
+            return batch.take(select_top_k(batch, scores, k=k, diversity=diversity))
+
+        key = ("ranking", pitch_key, int(k), float(diversity), None if chroma is None else _array_key(chroma))
+        return self.rank_stage.get_or_compute(key, compute)
+
+    def phrases(
+        self,
+        groove,
+        *,
+        bars: int,
+        k: int = 5,
+        pool: int = 2000,
+        density: int = 7,
+        syncopation: float = 0.5,
+        scale: str = "C minor",
+        register=(55, 76),
+        seed: int = 0,
+        diversity: float = 0.3,
+        chroma=None,
+    ) -> HookBatch:
+        """Cached scoring.rank_phrases, memoized as a single stage."""
+        key = (
+            "phrases", _array_key(groove), int(bars), int(k), int(pool), int(density), float(syncopation), scale,
+            tuple(int(r) for r in register), int(seed), float(diversity), None if chroma is None else _array_key(chroma),
+        )
+        return self.phrase_stage.get_or_compute(key, lambda: rank_phrases(
+            groove, k=k, pool=pool, bars=bars, density=density, syncopation=syncopation, scale=scale,
+            register=register, seed=seed, diversity=diversity, chroma=chroma,
+        ))
+
+    def audio(self, hooks: Iterable[Iterable[Note]], *, bpm: float, sample_rate: int = 22050, timing: Timing = None) -> RenderedHooks:
+        """Cached render_hooks; drop-in for write_bundle's renderer."""
+        hooks = [list(notes) for notes in hooks]
+        key = ("audio", notes_key(hooks), float(bpm), int(sample_rate), _timing_key(timing))
+        return self.audio_stage.get_or_compute(
+            key, lambda: render_hooks(hooks, bpm=bpm, sample_rate=sample_rate, timing=timing),
+        )
+
+    def store_audio(self, hooks: Iterable[Iterable[Note]], rendered: RenderedHooks, *, bpm: float, timing: Timing = None) -> None:
+        """Add a render made elsewhere (e.g. in a worker process) to the audio stage."""
+        key = ("audio", notes_key(hooks), float(bpm), int(rendered.sample_rate), _timing_key(timing))
+        self.audio_stage.put(key, rendered)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        stages = (self.rhythm_stage, self.pitch_stage, self.rank_stage, self.phrase_stage, self.audio_stage)
+        return {stage.name: stage.stats() for stage in stages}
@@ -0,0 +1,203 @@
+"""Lightweight per-request timing spans, counters and optional profiling.
+
+Stages wrap themselves in `span("module.stage")`. Outside an active request
+a span is a no-op, so library code pays nothing unless a caller opts in:
+
+    with request("upload") as report:
+        analyze_loop(y, sr)
+    print(report.to_json())
+
+Set HOOK_AID_PROFILE=cprofile and/or tracemalloc (comma separated) to also
+capture a cProfile summary for the request and per-span peak allocations.
+tracemalloc is process-wide, so concurrent requests (e.g. Streamlit
+sessions on their own threads) share it and it stops with the last one.
+"""
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+
+PROFILE_ENV = "HOOK_AID_PROFILE"
+
+_active: "contextvars.ContextVar[Optional[Report]]" = contextvars.ContextVar("hook_aid_report", default=None)
+
+
+# Reports currently using tracemalloc, and whether this module started it.
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_started_tracing = False
+
+
+def _acquire_tracing() -> None:
+    global _tracing_users, _started_tracing
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _tracing_users += 1
+
+
+def _release_tracing() -> None:
+    global _tracing_users, _started_tracing
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+def _profile_modes() -> set:
+    raw = os.environ.get(PROFILE_ENV, "")
+    return {mode.strip().lower() for mode in raw.split(",") if mode.strip()}
+
+
+@dataclass
+class Report:
+    """Spans, counters and optional profile output collected for one request."""
+
+    name: str
+    spans: List[Dict] = field(default_factory=list)
+    counters: Dict[str, int] = field(default_factory=dict)
+    profile: Optional[str] = None
+    total_s: float = 0.0
+    _origin: float = field(default_factory=time.perf_counter, repr=False)
+    _depth: int = field(default=0, repr=False)
+    _peaks: List[int] = field(default_factory=list, repr=False)
+    _token: Optional[contextvars.Token] = field(default=None, repr=False)
+    _profiler: Optional[cProfile.Profile] = field(default=None, repr=False)
+    _owns_tracing: bool = field(default=False, repr=False)
+
+    def totals(self) -> Dict[str, float]:
+        """Summed duration per span name."""
+        out: Dict[str, float] = {}
+        for item in self.spans:
+            out[item["name"]] = out.get(item["name"], 0.0) + item["duration_s"]
+        return out
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "total_s": round(self.total_s, 6),
+            "spans": self.spans,
+            "counters": dict(self.counters),
+            "profile": self.profile,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+
+def start(name: str = "request") -> Report:
+    """Begin collecting into a fresh Report; pair with finish().
+
+    For code that can't wrap its work in a with-block, such as a Streamlit
+    script body. Prefer request() elsewhere.
+    """
+    report = Report(name)
+    report._token = _active.set(report)
+    modes = _profile_modes()
+    if "tracemalloc" in modes:
+        _acquire_tracing()
+        report._owns_tracing = True
+    if "cprofile" in modes:
+        report._profiler = cProfile.Profile()
+        report._profiler.enable()
+    return report
+
+
+def finish(report: Report) -> Report:
+    """Stop profiling, stamp the total duration and deactivate the report."""
+    if report._profiler is not None:
+        report._profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(report._profiler, stream=out).sort_stats("cumulative").print_stats(25)
+        report.profile = out.getvalue()
+        report._profiler = None
+    if report._owns_tracing:
+        _release_tracing()
+        report._owns_tracing = False
+    report.total_s = time.perf_counter() - report._origin
+    if report._token is not None:
+        _active.reset(report._token)
+        report._token = None
+    return report
+
+
+@contextmanager
+def request(name: str = "request"):
+    """Collect spans from everything called inside the block into a fresh Report."""
+    report = start(name)
+    try:
+        yield report
+    finally:
+        finish(report)
+
+
+def current() -> Optional[Report]:
+    return _active.get()
+
+
+@contextmanager
+def span(name: str):
+    """Time a stage (monotonic clock) into the active report, if any."""
+    report = _active.get()
+    if report is None:
+        yield
+        return
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        # Fold the peak seen so far into the parent before resetting it for this span.
+        if report._peaks:
+            report._peaks[-1] = max(report._peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        report._peaks.append(0)
+
+    depth = report._depth
+    report._depth += 1
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        ended = time.perf_counter()
+        report._depth = depth
+        entry = {
+            "name": name,
+            "start_s": round(began - report._origin, 6),
+            "duration_s": round(ended - began, 6),
+            "depth": depth,
+        }
+        if tracing and report._peaks:
+            peak = max(report._peaks.pop(), tracemalloc.get_traced_memory()[1])
+            entry["peak_bytes"] = peak
+            if report._peaks:
+                report._peaks[-1] = max(report._peaks[-1], peak)
+        report.spans.append(entry)
+
+
+def timed(name: str):
+    """Decorator form of span()."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+def count(name: str, n: int = 1) -> None:
+    """Bump a counter on the active report, if any."""
+    report = _active.get()
+    if report is not None:
+        report.counters[name] = report.counters.get(name, 0) + n
@@ -1,10 +1,29 @@
+from dataclasses import dataclass
+from typing import List, Tuple
+
 import numpy as np
-import librosa
+
+from instrument import span, timed
 
 # Interval patterns are defined relative to the root and reused for any key.
+# Order matters: it is the order of list_available_scales() for each root.
 SCALE_PATTERNS = {
     "major": [0, 2, 4, 5, 7, 9, 11],
     "minor": [0, 2, 3, 5, 7, 8, 10],  # natural minor
+    "dorian": [0, 2, 3, 5, 7, 9, 10],
+    "mixolydian": [0, 2, 4, 5, 7, 9, 10],
+    "phrygian": [0, 1, 3, 5, 7, 8, 10],
+    "harmonic minor": [0, 2, 3, 5, 7, 8, 11],
+    "melodic minor": [0, 2, 3, 5, 7, 9, 11],  # ascending form
+    "major pentatonic": [0, 2, 4, 7, 9],
+    "minor pentatonic": [0, 3, 5, 7, 10],
+}
+
+# Alternative spellings accepted by _parse_scale.
+SCALE_ALIASES = {
+    "ionian": "major",
+    "aeolian": "minor",
+    "natural minor": "minor",
 }
 
 # Ordered to give users a practical mix of sharp and flat keys.
@@ -28,25 +47,56 @@ NOTE_TO_SEMITONE = {
 
 DEFAULT_SCALE = "C minor"
 
+# MIDI note ranges behind the UI's "Pitch range" options.
+REGISTERS = {"low": (48, 69), "mid": (55, 76), "high": (62, 84)}
+
+
+# Template weight per pitch class: out-of-scale notes count against a scale,
+# and its tonic counts double, which is what tells relative keys and modes
+# (C major, A minor, D dorian...) apart. A chroma with all its energy on the
+# tonic scores 1, an even spread over the scale's notes about 0.5. (Extra
+# weight on the third and fifth picked the wrong tonic on the example loops.)
+TEMPLATE_WEIGHTS = {"out": -0.5, "in": 0.5, "tonic": 1.0}
+
 
 def _build_scale_templates():
     templates = {}
     for root in SCALE_ROOTS:
         root_offset = NOTE_TO_SEMITONE[root]
         for quality, pattern in SCALE_PATTERNS.items():
-            vec = np.zeros(12, dtype=float)
+            vec = np.full(12, TEMPLATE_WEIGHTS["out"])
             for degree in pattern:
-                vec[(root_offset + degree) % 12] = 1.0
-            templates[f"{root} {quality}"] = vec / (np.linalg.norm(vec) + 1e-9)
+                vec[(root_offset + degree) % 12] = TEMPLATE_WEIGHTS["in"]
+            vec[root_offset] = TEMPLATE_WEIGHTS["tonic"]
+            templates[f"{root} {quality}"] = vec
     return templates
 
 
 SCALE_TEMPLATES = _build_scale_templates()
 
+# The same templates as one (n_scales, 12) matrix so matching is a single product.
+SCALE_NAMES = list(SCALE_TEMPLATES)
+SCALE_TEMPLATE_MATRIX = np.stack([SCALE_TEMPLATES[name] for name in SCALE_NAMES])
+# related[i, j]: template j's tonic is i's, or its pitch-class set is a subset or
+# superset of i's (modes of one scale, a pentatonic and its parent scales).
+# These differ from i by a degree or two at most, so the margin check in
+# scale_from_chroma compares against unrelated templates only.
+_TEMPLATE_ROOTS = np.array([NOTE_TO_SEMITONE[name.split()[0]] for name in SCALE_NAMES])
+_TEMPLATE_MASKS = SCALE_TEMPLATE_MATRIX > TEMPLATE_WEIGHTS["out"]
+_subset = ~np.any(_TEMPLATE_MASKS[:, None, :] & ~_TEMPLATE_MASKS[None, :, :], axis=2)
+_TEMPLATE_RELATED = _subset | _subset.T | (_TEMPLATE_ROOTS[:, None] == _TEMPLATE_ROOTS[None, :])
+
+# "full" runs HPSS + CQT chroma over the whole signal; "fast" takes a plain
+# STFT chroma from a sample of frames, which is ~100x cheaper on long loops.
+SCALE_MODES = ("full", "fast")
+FAST_N_FFT = 4096
+FAST_MAX_FRAMES = 64
+FAST_FMAX = 5000.0
+
 
 def list_available_scales():
     """Return the scales the app can generate, keeping UI and pitch logic in sync."""
-    return [f"{root} {quality}" for root in SCALE_ROOTS for quality in ("major", "minor")]
+    return [f"{root} {quality}" for root in SCALE_ROOTS for quality in SCALE_PATTERNS]
 
 
 def _parse_scale(scale: str):
@@ -59,10 +109,11 @@ def _parse_scale(scale: str):
     if len(parts) < 2:
         root, quality = parts[0], "minor"
     else:
-        root, quality = parts[0], parts[1]
+        root, quality = parts[0], " ".join(parts[1:])
 
     root = root[0].upper() + root[1:] if len(root) > 1 else root.upper()
     quality = quality.lower()
+    quality = SCALE_ALIASES.get(quality, quality)
 
     if root not in NOTE_TO_SEMITONE:
         root = DEFAULT_SCALE.split()[0]
@@ -122,8 +173,226 @@ def assign_pitches(events, scale="C minor", register=(55,76), step_prob=0.8, max
     return notes
 
 
-def detect_scale_from_audio(y, sr):
-    """Return (scale, score) using a chroma template match; None if inconclusive."""
+OFFBEAT_SLOTS = np.array([1, 3, 5, 7, 9, 11, 13, 15])
+
+
+@dataclass(frozen=True)
+class HookBatch:
+    """N hooks with the same note count stored as (n, notes) onset/duration/pitch columns."""
+
+    onsets: np.ndarray
+    durations: np.ndarray
+    pitches: np.ndarray
+
+    def __len__(self):
+        return self.onsets.shape[0]
+
+    def hook(self, i: int) -> List[Tuple[int, int, int]]:
+        """Return hook i as the (onset, dur, pitch) tuples used by sample_rhythm/assign_pitches."""
+        return list(zip(self.onsets[i].tolist(), self.durations[i].tolist(), self.pitches[i].tolist()))
+
+    def to_notes(self) -> List[List[Tuple[int, int, int]]]:
+        return [self.hook(i) for i in range(len(self))]
+
+    def take(self, indices) -> "HookBatch":
+        indices = np.asarray(indices, dtype=int)
+        return HookBatch(self.onsets[indices], self.durations[indices], self.pitches[indices])
+
+
+def _stage_rngs(seed):
+    # Independent streams so rhythms don't change when only pitch settings do.
+    rhythm_seq, pitch_seq = np.random.SeedSequence(seed).spawn(2)
+    return np.random.default_rng(rhythm_seq), np.random.default_rng(pitch_seq)
+
+
+def rhythm_weights(hist16, syncopation=0.5):
+    """Slot probabilities used by the samplers: the loop's histogram plus an off-beat push."""
+    weights = np.array(hist16, dtype=float)
+    weights[..., OFFBEAT_SLOTS] += syncopation * weights.mean(axis=-1, keepdims=True)
+    return weights / weights.sum(axis=-1, keepdims=True)
+
+
+def sample_rhythms(hist16, n, density=7, syncopation=0.5, rng=None):
+    """Vectorized sample_rhythm: n rows of sorted onset slots plus 1/2-step durations.
+
+    hist16 may be a single (16,) histogram, one histogram per row (n, 16), or
+    (m, 1, 16) for m histograms that share the same random draws; onsets then
+    come back as (m, n, k) while durations stay (n, k).
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    weights = rhythm_weights(hist16, syncopation)
+    k = min(density, 16)
+
+    # Gumbel top-k draws k distinct slots per row with probability-proportional weighting.
+    with np.errstate(divide="ignore"):
+        keys = np.log(weights) + rng.gumbel(size=(n, 16))
+    onsets = np.sort(np.argpartition(-keys, k - 1, axis=-1)[..., :k], axis=-1)
+    durations = 1 + (rng.random((n, k)) < 0.25).astype(np.int64)  # 16ths, sometimes 8ths
+    return onsets.astype(np.int64), durations
+
+
+def _fit_to_register_array(pitches, register):
+    lo, hi = register
+    pitches = np.where(pitches < lo, pitches + 12 * ((lo - pitches + 11) // 12), pitches)
+    return np.where(pitches > hi, pitches - 12 * ((pitches - hi + 11) // 12), pitches)
+
+
+def _scale_walk(n_notes, n, n_degrees, step_prob, max_leap, rng):
+    """(n, n_notes) scale-degree indices of a random walk that mostly steps and never goes below 0."""
+    start = rng.integers(0, n_degrees, size=(n, 1))
+    steps = np.where(
+        rng.random((n, n_notes)) < step_prob,
+        rng.choice([-1, 1], size=(n, n_notes)),
+        rng.integers(-max_leap, max_leap + 1, size=(n, n_notes)),
+    )
+    # Running sum clamped at zero (idx = max(0, idx + step)) via the Lindley identity.
+    walk = start + np.cumsum(steps, axis=1)
+    return walk - np.minimum(np.minimum.accumulate(walk, axis=1), 0)
+
+
+def _degree_pitches(idx, scale, register):
+    """MIDI pitches for scale-degree indices, folded into the register; also returns the tonic."""
+    root, _, degrees = _parse_scale(scale)
+    degrees = np.asarray(degrees)
+    root_midi = 4 * 12 + NOTE_TO_SEMITONE[root]
+    pitches = root_midi + 12 * (idx // len(degrees)) + degrees[idx % len(degrees)]
+    return _fit_to_register_array(pitches, register), _fit_to_register(root_midi, register)
+
+
+def assign_pitches_batch(n_notes, n, scale="C minor", register=(55,76), step_prob=0.8, max_leap=4, rng=None):
+    """Vectorized assign_pitches: an (n, n_notes) array of scale-walk pitches ending on the tonic."""
+    rng = rng if rng is not None else np.random.default_rng()
+    _, _, degrees = _parse_scale(scale)
+    idx = _scale_walk(n_notes, n, len(degrees), step_prob, max_leap, rng)
+    pitches, tonic = _degree_pitches(idx, scale, register)
+    if n_notes:
+        pitches[:, -1] = tonic  # resolve to tonic
+    return pitches.astype(np.int64)
+
+
+@timed("motif.generate_hooks")
+def generate_hooks(hist16, n, density=7, syncopation=0.5, scale="C minor", register=(55,76), seed=0, step_prob=0.8, max_leap=4):
+    """Generate n hooks at once; the same arguments and seed always give the same batch."""
+    rhythm_rng, pitch_rng = _stage_rngs(seed)
+    onsets, durations = sample_rhythms(hist16, n, density=density, syncopation=syncopation, rng=rhythm_rng)
+    pitches = assign_pitches_batch(
+        onsets.shape[1], n, scale=scale, register=register, step_prob=step_prob, max_leap=max_leap, rng=pitch_rng,
+    )
+    return HookBatch(onsets, durations, pitches)
+
+# Bar-by-bar phrase forms: a letter is a one-bar motif, a prime a variation of it.
+PHRASE_FORMS = {
+    1: "A",
+    2: "A A'",
+    4: "A A' A B",
+    8: "A A' A B A A' A B'",
+}
+# Share of each phrase bar's slot weights taken from its own loop bar; the
+# rest comes from the whole-loop histogram, so sparse or partial bars still work.
+PHRASE_BAR_WEIGHT = 0.5
+# Scale steps a varied bar moves the second half of its motif's melody by.
+VARIATION_SHIFTS = np.array([-2, -1, 1, 2])
+
+
+def _parse_form(form):
+    letters = form.split()
+    names = sorted({letter.rstrip("'") for letter in letters})
+    motif = np.array([names.index(letter.rstrip("'")) for letter in letters])
+    varied = np.array([letter.endswith("'") for letter in letters])
+    return len(names), motif, varied
+
+
+def fold_groove(groove):
+    """Normalized one-bar histogram of a (bars, 16) groove matrix; a (16,) histogram passes through normalized."""
+    hist = np.atleast_2d(np.asarray(groove, dtype=float)).sum(axis=0)
+    return hist / hist.sum() if hist.sum() > 0 else np.ones(hist.size) / hist.size
+
+
+def phrase_weights(groove, bars, syncopation=0.5):
+    """(bars, 16) slot probabilities: phrase bar b follows loop bar b (cycling), blended with the whole loop."""
+    groove = np.atleast_2d(np.asarray(groove, dtype=float))
+    totals = groove.sum(axis=1, keepdims=True)
+    rows = np.divide(groove, totals, out=np.zeros_like(groove), where=totals > 0)
+    per_bar = rows[np.arange(bars) % rows.shape[0]]
+    return rhythm_weights(PHRASE_BAR_WEIGHT * per_bar + (1.0 - PHRASE_BAR_WEIGHT) * fold_groove(groove), syncopation)
+
+
+@timed("motif.generate_phrases")
+def generate_phrases(
+    groove, n, bars=4, density=7, syncopation=0.5, scale="C minor", register=(55,76), seed=0,
+    variation=0.5, step_prob=0.8, max_leap=4,
+):
+    """n multi-bar phrases laid out as PHRASE_FORMS[bars], as one HookBatch of bars * density notes.
+
+    groove is a (bars, 16) groove matrix or a (16,) histogram. Every bar holds
+    min(density, 16) notes drawn from that bar's weights. Bars of the same motif
+    share their random draws, so they repeat wherever the loop's bars agree; a
+    varied bar adds `variation`-scaled noise to the draws and moves the second
+    half of the motif's melody by a scale step. The last note resolves to the tonic.
+    """
+    if bars not in PHRASE_FORMS:
+        raise ValueError(f"Unsupported phrase length {bars!r}; expected one of {sorted(PHRASE_FORMS)}")
+    n_motifs, motif, varied = _parse_form(PHRASE_FORMS[bars])
+    rhythm_rng, pitch_rng = _stage_rngs(seed)
+    k = min(density, 16)
+
+    # Gumbel top-k per bar, as in sample_rhythms, with draws shared per motif.
+    gumbel = rhythm_rng.gumbel(size=(n_motifs, n, 16))[motif]
+    gumbel[varied] += variation * rhythm_rng.gumbel(size=(int(varied.sum()), n, 16))
+    with np.errstate(divide="ignore"):
+        keys = np.log(phrase_weights(groove, bars, syncopation))[:, None, :] + gumbel
+    slots = np.sort(np.argpartition(-keys, k - 1, axis=-1)[..., :k], axis=-1)
+    onsets = slots + 16 * np.arange(bars)[:, None, None]
+    durations = (1 + (rhythm_rng.random((n_motifs, n, k)) < 0.25).astype(np.int64))[motif]
+
+    _, _, degrees = _parse_scale(scale)
+    idx = _scale_walk(k, n_motifs * n, len(degrees), step_prob, max_leap, pitch_rng).reshape(n_motifs, n, k)[motif]
+    shift = pitch_rng.choice(VARIATION_SHIFTS, size=(int(varied.sum()), n, 1))
+    idx[varied] = np.maximum(idx[varied] + shift * (np.arange(k) >= k // 2), 0)
+    pitches, tonic = _degree_pitches(idx, scale, register)
+
+    def flat(per_bar):  # (bars, n, k) -> (n, bars * k), bar after bar
+        return np.ascontiguousarray(per_bar.transpose(1, 0, 2).reshape(n, bars * k)).astype(np.int64)
+
+    pitches = flat(pitches)
+    pitches[:, -1] = tonic
+    return HookBatch(flat(onsets), flat(durations), pitches)
+
+
+def sampled_chroma(magnitude, sr, n_fft, *, fmax=FAST_FMAX, max_frames=FAST_MAX_FRAMES):
+    """Mean chroma of up to max_frames evenly spaced columns of a magnitude spectrogram."""
+    magnitude = np.asarray(magnitude)
+    if magnitude.ndim != 2 or magnitude.shape[1] == 0:
+        return np.zeros(12)
+    if magnitude.shape[1] > max_frames:
+        magnitude = magnitude[:, np.linspace(0, magnitude.shape[1] - 1, max_frames).astype(int)]
+    n_bins = min(magnitude.shape[0], int(np.ceil(fmax * n_fft / sr)) + 1)
+    power = np.zeros(magnitude.shape, dtype=np.float32)
+    power[:n_bins] = np.abs(magnitude[:n_bins]) ** 2
+    import librosa  # audio stack loads on first analysis, not with generation
+
+    return librosa.feature.chroma_stft(S=power, sr=sr, n_fft=n_fft).mean(axis=1)
+
+
+def _fast_chroma(y, sr, n_fft=FAST_N_FFT, max_frames=FAST_MAX_FRAMES):
+    """Chroma from the FFTs of a few evenly spaced frames; no HPSS, no full STFT."""
+    if y.size < n_fft:
+        y = np.pad(y, (0, n_fft - y.size))
+    n_frames = min(max_frames, 1 + (y.size - n_fft) // (n_fft // 2))
+    starts = np.linspace(0, y.size - n_fft, n_frames).astype(int)
+    frames = y[starts[:, None] + np.arange(n_fft)] * np.hanning(n_fft).astype(np.float32)
+    magnitude = np.abs(np.fft.rfft(frames, axis=1)).T
+    return sampled_chroma(magnitude, sr, n_fft, max_frames=max_frames)
+
+
+@timed("motif.detect_scale_from_audio")
+def detect_scale_from_audio(y, sr, mode="full"):
+    """Return (scale, score) using a chroma template match; None if inconclusive.
+
+    mode="fast" trades the HPSS + CQT chroma for an STFT chroma over sampled frames.
+    """
+    if mode not in SCALE_MODES:
+        raise ValueError(f"Unknown scale detection mode {mode!r}; expected one of {SCALE_MODES}")
     if y is None or sr is None:
         return None, 0.0
 
@@ -131,31 +400,63 @@ def detect_scale_from_audio(y, sr):
     if y.size == 0 or not np.any(np.abs(y)):
         return None, 0.0
 
-    harmonic, _ = librosa.effects.hpss(y)
+    if mode == "fast":
+        with span("motif.fast_chroma"):
+            return scale_from_chroma(_fast_chroma(y, sr))
+
+    import librosa
+
+    with span("motif.hpss"):
+        harmonic, _ = librosa.effects.hpss(y)
     source = harmonic if np.any(np.abs(harmonic)) else y
-    chroma = librosa.feature.chroma_cqt(y=source, sr=sr)
+    with span("motif.chroma_cqt"):
+        chroma = librosa.feature.chroma_cqt(y=source, sr=sr)
     if chroma.size == 0:
         return None, 0.0
 
-    chroma_vector = chroma.mean(axis=1)
-    if not np.any(chroma_vector):
+    return scale_from_chroma(chroma.mean(axis=1))
+
+
+# Tuned on the example loops (pinned by tests/test_analysis.py): tonal ones
+# score 0.24-0.36 with margins of 0.015 and up, most drum-only ones 0.22 or
+# less; noise scores about 0.15. A kick can still line up with a template
+# (shuffle_92bpm scores 0.26), but drums spread energy over every pitch class:
+# their chroma peaks at under 1.8x its mean, tonal loops' at 2.2x and up.
+SCALE_MIN_SCORE = 0.23
+SCALE_MIN_MARGIN = 0.01
+SCALE_MIN_PEAK = 2.0
+
+
+def match_scales(chroma):
+    """Score (n, 12) chroma rows against every template in one product.
+
+    Each row is scaled to sum to 1 and scored as its dot product with the
+    weighted templates (TEMPLATE_WEIGHTS). Returns per row the index into
+    SCALE_NAMES of the best template, its score and the best score among
+    templates unrelated to it (other tonic, neither subset nor superset).
+    A subset never outscores a scale containing it, since the parent's extra
+    notes weigh positive where the subset's weigh negative; on an exact tie
+    the parent wins, as it comes first in SCALE_NAMES.
+    """
+    chroma = np.atleast_2d(np.asarray(chroma, dtype=float))
+    share = chroma / np.maximum(chroma.sum(axis=1, keepdims=True), 1e-12)
+    scores = share @ SCALE_TEMPLATE_MATRIX.T
+    best = np.argmax(scores, axis=1)
+    best_score = scores[np.arange(len(scores)), best]
+    second_score = np.where(_TEMPLATE_RELATED[best], -np.inf, scores).max(axis=1)
+    return best, best_score, second_score
+
+
+def scale_from_chroma(chroma_vector):
+    """Match a 12-bin chroma profile against the scale templates; None if inconclusive."""
+    chroma_vector = np.asarray(chroma_vector, dtype=float)
+    if chroma_vector.size != 12 or not np.any(chroma_vector):
         return None, 0.0
 
-    chroma_norm = chroma_vector / (np.linalg.norm(chroma_vector) + 1e-9)
-    best_scale = None
-    best_score = -1.0
-    second_score = -1.0
-
-    for scale_name, template in SCALE_TEMPLATES.items():
-        score = float(np.dot(chroma_norm, template))
-        if score > best_score:
-            second_score = best_score
-            best_score = score
-            best_scale = scale_name
-        elif score > second_score:
-            second_score = score
-
-    if best_score < 0.25 or (second_score >= 0 and best_score - second_score < 0.08):
-        return None, float(best_score)
+    best, best_score, second_score = (float(v[0]) for v in match_scales(chroma_vector.reshape(1, 12)))
+    if best_score < SCALE_MIN_SCORE or best_score - second_score < SCALE_MIN_MARGIN:
+        return None, best_score
+    if chroma_vector.max() < SCALE_MIN_PEAK * chroma_vector.mean():  # no pitch class stands out
+        return None, best_score
 
-    return best_scale, float(best_score)
+    return SCALE_NAMES[int(best)], best_score
@@ -1,14 +1,37 @@
+import io, os
+
 import numpy as np, librosa
 
-def load_mono(file, sr=22050):
-    y, sr = librosa.load(file, sr=sr, mono=True)
+from audio_store import audio_digest
+from instrument import timed
+
+@timed("rhythm.load_mono")
+def load_mono(file, sr=22050, store=None):
+    # with an audio_store.AudioStore the decode is read back as a memmap; trim slices it without copying
+    if store is None:
+        y, sr = librosa.load(file, sr=sr, mono=True)
+    else:
+        if isinstance(file, (str, os.PathLike)):  # the same path-or-file-object inputs librosa.load takes
+            with open(file, "rb") as fh: data = fh.read()
+        else:
+            data = file.read()
+        digest = audio_digest(data)
+        y = store.get(digest, sr)
+        if y is None: y = store.put(digest, sr, librosa.load(io.BytesIO(data), sr=sr, mono=True)[0])
     y, _ = librosa.effects.trim(y, top_db=30)
     rms = np.sqrt(np.mean(y**2)) + 1e-8
     y = y * (0.1 / rms)
     return y, sr
 
+@timed("rhythm.estimate_bpm_and_beats")
 def estimate_bpm_and_beats(y, sr):
     onset_env = librosa.onset.onset_strength(y=y, sr=sr)
+    median_env = lambda: librosa.onset.onset_strength(y=y, sr=sr, aggregate=np.median)
+    return bpm_and_beats_from_envelope(onset_env, sr, median_env=median_env)
+
+def bpm_and_beats_from_envelope(onset_env, sr, median_env=None):
+    # median_env: callable giving the median-aggregated envelope beat_track(y=...) would compute,
+    # only called for the plain-tracker fallback (defaults to onset_env when there is none)
     tempo_candidates = np.atleast_1d(librosa.beat.tempo(onset_envelope=onset_env, sr=sr, aggregate=None))
     tempo_guess = 120.0
     if tempo_candidates.size:
@@ -35,7 +58,8 @@ def estimate_bpm_and_beats(y, sr):
             tempo_track /= 2.0
 
     if beat_times.size < 2:  # fall back to the plain tracker if needed
-        tempo_track, beat_frames = librosa.beat.beat_track(y=y, sr=sr, trim=True)
+        fallback_env = median_env() if median_env is not None else onset_env
+        tempo_track, beat_frames = librosa.beat.beat_track(onset_envelope=fallback_env, sr=sr, trim=True)
         tempo_track = float(np.atleast_1d(tempo_track)[0]) if np.size(tempo_track) else tempo_guess
         beat_times = librosa.frames_to_time(beat_frames, sr=sr)
 
@@ -43,19 +67,55 @@ def estimate_bpm_and_beats(y, sr):
 
 def ticks_from_beats(beat_times, subdiv=4):
     # subdiv=4 → 16th notes
-    if len(beat_times) < 2: return np.array([])
-    tick_times = []
-    for i in range(len(beat_times)-1):
-        start, end = beat_times[i], beat_times[i+1]
-        seg = np.linspace(start, end, subdiv, endpoint=False)
-        tick_times.extend(seg.tolist())
-    return np.array(tick_times)
-
-def groove_histogram(y, sr, tick_times):
-    onsets = librosa.onset.onset_detect(y=y, sr=sr, units="time")
-    if tick_times.size == 0: return np.ones(16)/16
-    hist = np.zeros(16)
-    for t in onsets:
-        idx = np.argmin(np.abs(tick_times - t))
-        hist[idx % 16] += 1
-    return hist / hist.sum() if hist.sum() > 0 else np.ones(16)/16
+    beat_times = np.asarray(beat_times, dtype=float)
+    if beat_times.size < 2: return np.array([])
+    # Same arithmetic as a per-beat np.linspace(start, end, subdiv, endpoint=False).
+    steps = np.diff(beat_times)[:, None] / subdiv
+    return (np.arange(subdiv) * steps + beat_times[:-1, None]).ravel()
+
+def nearest_tick_indices(times, tick_times):
+    """Index of the closest tick for each time (ties go to the earlier tick)."""
+    times = np.asarray(times, dtype=float)
+    if tick_times.size < 2: return np.zeros(times.shape, dtype=int)
+    idx = np.clip(np.searchsorted(tick_times, times), 1, tick_times.size - 1)
+    idx -= (times - tick_times[idx - 1]) <= (tick_times[idx] - times)
+    return idx
+
+@timed("rhythm.groove_histogram")
+def groove_histogram(y, sr, tick_times, grid=16, weighted=False):
+    onset_env = librosa.onset.onset_strength(y=y, sr=sr)
+    frames = librosa.onset.onset_detect(onset_envelope=onset_env, sr=sr)
+    onsets = librosa.frames_to_time(frames, sr=sr)
+    weights = onset_env[frames] if weighted else None
+    return histogram_from_onsets(onsets, tick_times, grid=grid, weights=weights)
+
+def groove_matrix_from_onsets(onsets, tick_times, grid=16, weights=None):
+    """(bars, grid) onset counts, bar b covering ticks [b*grid, (b+1)*grid); the last bar may be partial."""
+    if tick_times.size == 0: return np.zeros((1, grid))
+    n_bars = -(-tick_times.size // grid)
+    idx = nearest_tick_indices(onsets, tick_times)
+    return np.bincount(idx, weights=weights, minlength=n_bars * grid).astype(float).reshape(n_bars, grid)
+
+def histogram_from_onsets(onsets, tick_times, grid=16, weights=None):
+    # grid = ticks per bar (16 for 16ths in 4/4, 32 for subdiv=8, 12 for triplet 8ths, ...)
+    if tick_times.size == 0: return np.ones(grid)/grid
+    hist = groove_matrix_from_onsets(onsets, tick_times, grid=grid, weights=weights).sum(axis=0)
+    return hist / hist.sum() if hist.sum() > 0 else np.ones(grid)/grid
+
+def timing_offsets_from_onsets(onsets, tick_times, grid=16):
+    """Mean offset of onsets from their nearest tick per bar slot, in ticks (+ = late, within ±0.5).
+
+    Slots without onsets get 0. Onsets before the first or after the last tick are ignored.
+    """
+    if tick_times.size < 2: return np.zeros(grid)
+    onsets = np.asarray(onsets, dtype=float)
+    idx = nearest_tick_indices(onsets, tick_times)
+    gaps = np.diff(tick_times)
+    # Early onsets are measured against the gap before their tick, late ones against the gap after.
+    spacing = np.where(onsets < tick_times[idx], np.r_[gaps[0], gaps][idx], np.r_[gaps, gaps[-1]][idx])
+    offsets = (onsets - tick_times[idx]) / spacing
+    inside = np.abs(offsets) <= 0.5
+    slots = idx[inside] % grid
+    totals = np.bincount(slots, weights=offsets[inside], minlength=grid)
+    counts = np.bincount(slots, minlength=grid)
+    return np.divide(totals, counts, out=np.zeros(grid), where=counts > 0)
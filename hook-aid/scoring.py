@@ -0,0 +1,194 @@
+"""Vectorized scoring and top-K selection over a pool of generated hooks."""
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from instrument import timed
+from motif import (
+    HookBatch,
+    NOTE_TO_SEMITONE,
+    _parse_scale,
+    _stage_rngs,
+    assign_pitches_batch,
+    fold_groove,
+    generate_hooks,
+    generate_phrases,
+    rhythm_weights,
+    sample_rhythms,
+)
+
+
+# Relative weight of each quality term in the combined score.
+SCORE_WEIGHTS = {
+    "groove": 0.45,
+    "scale_fit": 0.2,
+    "contour": 0.35,
+}
+
+
+def _scale_mask(scale: str) -> np.ndarray:
+    root, _, degrees = _parse_scale(scale)
+    mask = np.zeros(12, dtype=bool)
+    mask[(NOTE_TO_SEMITONE[root] + np.asarray(degrees)) % 12] = True
+    return mask
+
+
+def pitch_profile(scale: str, chroma=None) -> np.ndarray:
+    """(12,) weight in [0, 1] per pitch class: in-scale classes scaled by the loop's chroma.
+
+    Hooks are generated in `scale`, so the scale mask alone would score every
+    candidate 1.0; the chroma (LoopAnalysis.chroma) favours hooks that sit on
+    the pitch classes the loop actually sounds. Without one, only the mask is used.
+    """
+    profile = _scale_mask(scale).astype(float)
+    if chroma is not None:
+        chroma = np.clip(np.asarray(chroma, dtype=float), 0.0, None)
+        if chroma.max(initial=0.0) > 0:
+            profile *= chroma / chroma.max()
+    return profile
+
+
+def _grid_width(batch: HookBatch) -> int:
+    """Slots covering every onset: 16 for one-bar hooks, 16 * bars for phrases."""
+    return 16 * (int(batch.onsets.max(initial=0)) // 16 + 1)
+
+
+def _onset_grid(batch: HookBatch) -> np.ndarray:
+    grid = np.zeros((len(batch), _grid_width(batch)), dtype=bool)
+    np.put_along_axis(grid, batch.onsets, True, axis=1)
+    return grid
+
+
+def score_components(batch: HookBatch, hist16, scale: str, syncopation: float = 0.0, chroma=None) -> Dict[str, np.ndarray]:
+    """Per-hook quality terms in [0, 1]: groove alignment, scale fit and melodic contour.
+
+    Groove alignment is measured against the same syncopation-adjusted slot
+    weights the sampler used, so ranking doesn't undo the "Groove push" setting.
+    Multi-bar phrases are measured bar by bar against the same one-bar weights.
+    Scale fit weighs each note by pitch_profile(scale, chroma).
+    """
+    hist = rhythm_weights(hist16, syncopation)
+    bars = int(batch.onsets.max()) // 16 + 1 if batch.onsets.size else 1
+    k = -(-batch.onsets.shape[1] // bars)  # notes per bar; phrases hold the same count in every bar
+
+    # Share of the loop's onset mass the hook lands on, relative to the best k slots of every bar.
+    best_mass = bars * np.sort(hist)[::-1][:k].sum() or 1.0
+    groove = hist[batch.onsets % 16].sum(axis=1) / best_mass
+
+    scale_fit = pitch_profile(scale, chroma)[batch.pitches % 12].mean(axis=1)
+
+    intervals = np.diff(batch.pitches, axis=1)
+    if intervals.shape[1] == 0:
+        contour = np.ones(len(batch))
+    else:
+        size = np.abs(intervals)
+        step_ratio = (size <= 2).mean(axis=1)
+        leap_ratio = (size > 7).mean(axis=1)
+        repeat_ratio = (size == 0).mean(axis=1)
+        signs = np.sign(intervals)
+        if signs.shape[1] > 1:
+            turn_ratio = (signs[:, 1:] * signs[:, :-1] < 0).mean(axis=1)
+        else:
+            turn_ratio = np.full(len(batch), 0.5)
+        # Mostly stepwise, few big leaps or repeats, and a mix of rises and falls.
+        contour = (
+            0.4 * step_ratio
+            + 0.3 * (1.0 - leap_ratio)
+            + 0.3 * (1.0 - 2.0 * np.abs(turn_ratio - 0.5))
+            - 0.3 * repeat_ratio
+        )
+        contour = np.clip(contour, 0.0, 1.0)
+
+    return {"groove": groove, "scale_fit": scale_fit, "contour": contour}
+
+
+@timed("scoring.score_hooks")
+def score_hooks(batch: HookBatch, hist16, scale: str, syncopation: float = 0.0, chroma=None) -> np.ndarray:
+    """Weighted sum of score_components for every hook in the batch."""
+    parts = score_components(batch, hist16, scale, syncopation=syncopation, chroma=chroma)
+    return sum(SCORE_WEIGHTS[name] * values for name, values in parts.items())
+
+
+@timed("scoring.select_top_k")
+def select_top_k(batch: HookBatch, scores: np.ndarray, k: int = 5, diversity: float = 0.3) -> np.ndarray:
+    """Greedy max-marginal-relevance pick of k hooks, penalising overlap with earlier picks.
+
+    Similarity between two hooks is the mean of their onset-grid Jaccard index
+    and the share of notes with the same pitch on the same slot.
+    """
+    n = len(batch)
+    k = min(k, n)
+    if k == 0:
+        return np.zeros(0, dtype=int)
+
+    grid = _onset_grid(batch).astype(np.float32)
+    counts = grid.sum(axis=1)
+    pitch_grid = np.full(grid.shape, -1, dtype=np.int64)
+    np.put_along_axis(pitch_grid, batch.onsets, batch.pitches, axis=1)
+
+    adjusted = np.asarray(scores, dtype=float).copy()
+    max_sim = np.zeros(n)
+    picked = []
+    for _ in range(k):
+        choice = int(np.argmax(adjusted - diversity * max_sim))
+        picked.append(choice)
+        shared = grid @ grid[choice]
+        jaccard = shared / np.maximum(counts + counts[choice] - shared, 1.0)
+        same_notes = ((pitch_grid == pitch_grid[choice]) & (pitch_grid >= 0)).sum(axis=1)
+        note_match = same_notes / np.maximum(np.maximum(counts, counts[choice]), 1.0)
+        max_sim = np.maximum(max_sim, 0.5 * (jaccard + note_match))
+        adjusted[choice] = -np.inf
+    return np.asarray(picked, dtype=int)
+
+
+@timed("scoring.rank_hooks")
+def rank_hooks(hist16, k=5, pool=2000, density=7, syncopation=0.5, scale="C minor", register=(55,76), seed=0, diversity=0.3, chroma=None) -> HookBatch:
+    """Generate a pool of candidates and return the k best, most distinct hooks.
+
+    chroma is the loop's (12,) pitch-class profile, used for the scale-fit term.
+    """
+    batch = generate_hooks(
+        hist16, pool, density=density, syncopation=syncopation, scale=scale, register=register, seed=seed,
+    )
+    scores = score_hooks(batch, hist16, scale, syncopation=syncopation, chroma=chroma)
+    return batch.take(select_top_k(batch, scores, k=k, diversity=diversity))
+
+
+@timed("scoring.rank_hooks_batch")
+def rank_hooks_batch(hists, k=5, pool=2000, density=7, syncopation=0.5, scale="C minor", register=(55,76), seed=0, diversity=0.3, chromas=None) -> List[HookBatch]:
+    """rank_hooks for several histograms that share every other setting.
+
+    With a shared seed the random draws are the same for each histogram, so the
+    whole pool is sampled in one vectorized call; the result for each row equals
+    rank_hooks(hists[i], ..., chroma=chromas[i]).
+    """
+    hists = np.asarray(hists, dtype=float).reshape(-1, 16)
+    if chromas is None:
+        chromas = [None] * len(hists)
+    rhythm_rng, pitch_rng = _stage_rngs(seed)
+    onsets, durations = sample_rhythms(hists[:, None, :], pool, density=density, syncopation=syncopation, rng=rhythm_rng)
+    # Pitches don't depend on the histogram, so one walk serves every row.
+    pitches = assign_pitches_batch(onsets.shape[-1], pool, scale=scale, register=register, rng=pitch_rng)
+
+    ranked = []
+    for hist, rows, chroma in zip(hists, onsets, chromas):
+        batch = HookBatch(rows, durations, pitches)
+        scores = score_hooks(batch, hist, scale, syncopation=syncopation, chroma=chroma)
+        ranked.append(batch.take(select_top_k(batch, scores, k=k, diversity=diversity)))
+    return ranked
+
+
+@timed("scoring.rank_phrases")
+def rank_phrases(groove, k=5, pool=1000, bars=4, density=7, syncopation=0.5, scale="C minor", register=(55,76), seed=0, diversity=0.3, variation=0.5, chroma=None) -> HookBatch:
+    """rank_hooks for multi-bar phrases generated from a (bars, 16) groove matrix (or a (16,) histogram).
+
+    Groove alignment is scored against the folded one-bar histogram; similarity
+    for the diversity pick compares whole phrases slot by slot.
+    """
+    batch = generate_phrases(
+        groove, pool, bars=bars, density=density, syncopation=syncopation, scale=scale, register=register,
+        seed=seed, variation=variation,
+    )
+    hist = fold_groove(groove)
+    scores = score_hooks(batch, hist, scale, syncopation=syncopation, chroma=chroma)
+    return batch.take(select_top_k(batch, scores, k=k, diversity=diversity))
@@ -0,0 +1,480 @@
+"""Local HTTP API for hook generation: asyncio front end, process-pool back end.
+
+    python cli.py serve --port 8765
+
+    POST /analyze                audio body -> loop analysis JSON
+    POST /hooks?density=7&...    audio body -> {"bpm", "scale", "hooks": [[[onset, dur, pitch], ...], ...]}
+    POST /bundle?midi=1&...      audio body -> ZIP with the same layout as the app download
+                                 (rendered with the loop's micro-timing unless feel=0;
+                                 loop=1 adds each hook mixed over the uploaded loop;
+                                 format=flac|flac24|wav24|wav-float, sample_rate=, deflate=1)
+    GET  /health                 queue depth and batching counters
+
+Generation settings are query parameters (hooks, pool, density, syncopation,
+scale, register, seed, bars, bpm). Concurrent /hooks and /bundle requests with the
+same settings are collected for up to BATCH_WINDOW_S and ranked in a single
+worker call (scoring.rank_hooks_batch). Queues are bounded: once they are
+full the server answers 503 with Retry-After rather than queueing forever.
+Uploads already seen, byte for byte or as a re-encoded copy (fingerprint.py),
+reuse the stored analysis; with a cache directory (--cache-dir or
+HOOK_AID_CACHE_DIR) analyses and the fingerprint index survive restarts.
+"""
+import asyncio
+import json
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from functools import partial
+from http import HTTPStatus
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from analysis import LoopAnalysis, analyze_bytes, decode_loop, warm_up
+from audio_store import AudioStore
+from bundle import bundle_file
+from cache import AnalysisCache, analysis_key
+from export import AUDIO_FORMATS
+from fingerprint import FingerprintIndex, fingerprint_bytes, index_path, reuse_analysis
+from motif import DEFAULT_SCALE, PHRASE_FORMS, REGISTERS, SCALE_PATTERNS, SCALE_ROOTS, list_available_scales
+from scoring import rank_hooks_batch, rank_phrases
+from ui_helpers import build_zip_name
+
+
+ANALYSIS_SR = 22050
+ANALYSIS_SUBDIV = 4
+BUNDLE_SR = 22050
+MAX_BODY_BYTES = 64 * 2**20
+BATCH_WINDOW_S = 0.02
+BATCH_MAX = 32
+QUEUE_SIZE = 64
+MAX_PENDING_JOBS = 16
+RETRY_AFTER_S = 1
+
+
+class HTTPError(Exception):
+    def __init__(self, status: HTTPStatus, message: str = ""):
+        super().__init__(message or status.phrase)
+        self.status = status
+
+
+class ServiceBusy(HTTPError):
+    def __init__(self, message: str = "server busy, retry shortly"):
+        super().__init__(HTTPStatus.SERVICE_UNAVAILABLE, message)
+
+
+@dataclass(frozen=True)
+class HookRequest:
+    """Generation settings for one request; requests with equal settings share a batch."""
+
+    hooks: int = 5
+    pool: int = 2000
+    density: int = 7
+    syncopation: float = 0.5
+    scale: Optional[str] = None  # None: the detected scale, else DEFAULT_SCALE
+    register: str = "mid"
+    seed: int = 0
+    bars: int = 1
+
+
+def _query_value(query: Dict[str, List[str]], name: str, cast, default, lo=None, hi=None):
+    if name not in query:
+        return default
+    try:
+        value = cast(query[name][-1])
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"invalid {name}: {query[name][-1]!r}")
+    if (lo is not None and value < lo) or (hi is not None and value > hi):
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"{name} must be between {lo} and {hi}")
+    return value
+
+
+# Accepted scale names by lower-cased spelling, so "c Minor" and "C minor" share one batching group.
+_SCALES = {scale.lower(): scale for scale in list_available_scales()}
+
+
+def parse_hook_request(query: Dict[str, List[str]]) -> HookRequest:
+    """Build a HookRequest from parsed query parameters, rejecting out-of-range values."""
+    defaults = HookRequest()
+    register = _query_value(query, "register", str, defaults.register)
+    if register not in REGISTERS:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"register must be one of {sorted(REGISTERS)}")
+    bars = _query_value(query, "bars", int, defaults.bars)
+    if bars not in PHRASE_FORMS:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, f"bars must be one of {sorted(PHRASE_FORMS)}")
+    scale = _query_value(query, "scale", str, defaults.scale)
+    if scale is not None:
+        scale = _SCALES.get(" ".join(scale.split()).lower())
+    if scale is None and "scale" in query:
+        raise HTTPError(
+            HTTPStatus.BAD_REQUEST, f"scale must be a root ({', '.join(SCALE_ROOTS)}) and one of {list(SCALE_PATTERNS)}",
+        )
+    return HookRequest(
+        hooks=_query_value(query, "hooks", int, defaults.hooks, 1, 50),
+        pool=_query_value(query, "pool", int, defaults.pool, 1, 20000),
+        density=_query_value(query, "density", int, defaults.density, 1, 16),
+        syncopation=_query_value(query, "syncopation", float, defaults.syncopation, 0.0, 1.0),
+        scale=scale,
+        register=register,
+        seed=_query_value(query, "seed", int, defaults.seed, 0),
+        bars=bars,
+    )
+
+
+def _rank_group(
+    grooves: List[np.ndarray], request: HookRequest, chromas: Optional[List[np.ndarray]] = None,
+) -> List[List[List[Tuple[int, int, int]]]]:
+    """Worker-side: rank hooks for every groove in a batch (plain lists pickle cheaply).
+
+    One-bar requests carry histograms and are ranked in one vectorized call;
+    phrase requests carry per-bar groove matrices of differing lengths.
+    chromas holds each loop's pitch-class profile for the scale-fit term.
+    """
+    chromas = chromas if chromas is not None else [None] * len(grooves)
+    settings = dict(
+        k=request.hooks,
+        pool=request.pool,
+        density=request.density,
+        syncopation=request.syncopation,
+        scale=request.scale,
+        register=REGISTERS[request.register],
+        seed=request.seed,
+    )
+    if request.bars == 1:
+        ranked = rank_hooks_batch(np.stack(grooves), chromas=chromas, **settings)
+    else:
+        ranked = [
+            rank_phrases(groove, bars=request.bars, chroma=chroma, **settings) for groove, chroma in zip(grooves, chromas)
+        ]
+    return [batch.to_notes() for batch in ranked]
+
+
+def _bundle_bytes(
+    hooks, bpm: float, include_midi: bool, timing=None, loop_bytes: Optional[bytes] = None, loop_start: float = 0.0,
+    loop_bpm: Optional[float] = None, *, sample_rate: int = BUNDLE_SR, audio_format: str = "wav", deflate: bool = False,
+) -> bytes:
+    """Worker-side: render and zip the hooks (over the decoded loop too, if given)."""
+    loop = decode_loop(loop_bytes, sr=sample_rate) if loop_bytes is not None else None
+    return bundle_file(
+        hooks, bpm=bpm, sample_rate=sample_rate, include_midi=include_midi, timing=timing, loop=loop, loop_start=loop_start,
+        loop_bpm=loop_bpm, audio_format=audio_format, deflate=deflate,
+    ).getvalue()
+
+
+def _analysis_json(analysis: LoopAnalysis) -> Dict:
+    return {
+        "bpm": analysis.bpm,
+        "duration": analysis.duration,
+        "scale": analysis.scale,
+        "scale_score": analysis.scale_score,
+        "beat_times": analysis.beat_times.tolist(),
+        "histogram": analysis.histogram.tolist(),
+        "groove_matrix": analysis.groove_matrix.tolist(),
+        "timing_offsets": analysis.timing_offsets.tolist(),
+        "chroma": analysis.chroma.tolist(),
+    }
+
+
+class HookService:
+    """Request handling, analysis de-duplication and micro-batching around an executor."""
+
+    def __init__(
+        self,
+        executor: Optional[Executor] = None,
+        *,
+        workers: Optional[int] = None,
+        queue_size: int = QUEUE_SIZE,
+        max_pending_jobs: int = MAX_PENDING_JOBS,
+        batch_window: float = BATCH_WINDOW_S,
+        batch_max: int = BATCH_MAX,
+        cache: Optional[AnalysisCache] = None,
+        index: Optional[FingerprintIndex] = None,
+        store: Optional[AudioStore] = None,
+        cache_dir: Optional[str] = None,
+    ):
+        self._owns_executor = executor is None
+        # Spawned, not forked: numba/BLAS thread pools don't survive a fork.
+        self.executor = executor or ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=warm_up,
+        )
+        # Compared with None, since an empty cache or index is falsy; cache_dir keeps both on disk, as in the app.
+        self.cache = cache if cache is not None else AnalysisCache(max_entries=64, cache_dir=cache_dir)
+        path = index_path(cache_dir, sr=ANALYSIS_SR, subdiv=ANALYSIS_SUBDIV, scale_mode="full") if cache_dir else None
+        self.index = index if index is not None else FingerprintIndex(path, groove_bins=4 * ANALYSIS_SUBDIV)
+        self.store = store
+        self.batch_window = batch_window
+        self.batch_max = max(1, batch_max)
+        self.max_pending_jobs = max(1, max_pending_jobs)
+        self._queue: "asyncio.Queue" = asyncio.Queue(maxsize=max(1, queue_size))
+        self._inflight: Dict[str, "asyncio.Future"] = {}
+        self._pending_jobs = 0
+        self._batcher: Optional[asyncio.Task] = None
+        self._groups: set = set()
+        self.counters = {"requests": 0, "rejected": 0, "batches": 0, "batched_requests": 0}
+
+    async def start(self) -> None:
+        if self._batcher is None:
+            self._batcher = asyncio.create_task(self._collect_batches())
+            if self._owns_executor:
+                self.executor.submit(int)  # spawn and warm the workers before the first request
+
+    async def close(self) -> None:
+        if self._batcher is not None:
+            self._batcher.cancel()
+            await asyncio.gather(self._batcher, return_exceptions=True)
+            self._batcher = None
+        if self._owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def health(self) -> Dict:
+        return {
+            "status": "ok",
+            "queued": self._queue.qsize(),
+            "pending_jobs": self._pending_jobs,
+            **self.counters,
+            "analysis_cache": self.cache.stats(),
+            "fingerprint_index": self.index.stats(),
+            "audio_store": self.store.stats() if self.store is not None else None,
+        }
+
+    async def _run_job(self, fn, *args, **kwargs):
+        """Run fn in the executor unless MAX_PENDING_JOBS are already outstanding."""
+        if self._pending_jobs >= self.max_pending_jobs:
+            self.counters["rejected"] += 1
+            raise ServiceBusy()
+        self._pending_jobs += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, partial(fn, *args, **kwargs))
+        finally:
+            self._pending_jobs -= 1
+
+    async def analyze(self, audio_bytes: bytes) -> LoopAnalysis:
+        """Cached analysis; identical uploads in flight at the same time share one job."""
+        key = analysis_key(audio_bytes, sr=ANALYSIS_SR, subdiv=ANALYSIS_SUBDIV)
+        analysis = self.cache.get(key)
+        if analysis is not None:
+            return analysis
+        if key not in self._inflight:
+            job = asyncio.ensure_future(self._analyze_uncached(key, audio_bytes))
+            self._inflight[key] = job
+            job.add_done_callback(lambda _: self._inflight.pop(key, None))
+        analysis = await asyncio.shield(self._inflight[key])
+        self.cache.put(key, analysis)
+        return analysis
+
+    async def _analyze_uncached(self, key: str, audio_bytes: bytes) -> LoopAnalysis:
+        """Reuse a near-duplicate's scale detection if the fingerprint index has one, else analyze.
+
+        The quick pass over this upload supplies everything timing-related (see reuse_analysis).
+        """
+        fingerprint, quick = await self._run_job(
+            fingerprint_bytes, audio_bytes, sr=ANALYSIS_SR, subdiv=ANALYSIS_SUBDIV, store=self.store,
+        )
+        match = self.index.match(fingerprint)
+        stored = self.cache.get(match) if match is not None else None
+        if match is not None and stored is None:
+            self.index.discard(match)  # evicted from the cache; this upload's row takes its place
+        analysis = reuse_analysis(quick, stored) if stored is not None else None
+        if analysis is None:
+            analysis = await self._run_job(
+                analyze_bytes, audio_bytes, sr=ANALYSIS_SR, subdiv=ANALYSIS_SUBDIV, store=self.store,
+            )
+            self.index.add(key, fingerprint)
+        return analysis
+
+    async def generate(self, histogram: np.ndarray, request: HookRequest, chroma: Optional[np.ndarray] = None):
+        """Queue one histogram (or groove matrix, for phrases) for the next batch with matching settings."""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((request, np.asarray(histogram, dtype=float), chroma, future))
+        except asyncio.QueueFull:
+            self.counters["rejected"] += 1
+            raise ServiceBusy()
+        return await future
+
+    async def _collect_batches(self) -> None:
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.max_pending_jobs)
+        while True:
+            items = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(items) < self.batch_max:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            groups: Dict[HookRequest, list] = {}
+            for request, histogram, chroma, future in items:
+                groups.setdefault(request, []).append((histogram, chroma, future))
+            for request, members in groups.items():
+                # Waiting for a slot stops draining the queue, which is what turns
+                # a saturated pool into 503s at the front door.
+                await slots.acquire()
+                task = asyncio.create_task(self._run_group(request, members))
+                self._groups.add(task)
+                task.add_done_callback(lambda t: (slots.release(), self._groups.discard(t)))
+
+    async def _run_group(self, request: HookRequest, members) -> None:
+        self.counters["batches"] += 1
+        self.counters["batched_requests"] += len(members)
+        grooves = [groove for groove, _, _ in members]
+        chromas = [chroma for _, chroma, _ in members]
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, _rank_group, grooves, request, chromas)
+        except Exception as exc:
+            for _, _, future in members:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (_, _, future), hooks in zip(members, results):
+            if not future.done():
+                future.set_result(hooks)
+
+    async def hooks_for(self, analysis: LoopAnalysis, request: HookRequest, bpm: Optional[float] = None) -> Dict:
+        scale = request.scale or analysis.scale or DEFAULT_SCALE
+        groove = analysis.histogram if request.bars == 1 else analysis.groove_matrix
+        hooks = await self.generate(groove, replace(request, scale=scale), chroma=analysis.chroma)
+        return {
+            "bpm": bpm or analysis.bpm,
+            "scale": scale,
+            "scale_detected": analysis.scale is not None,
+            "timing_offsets": analysis.timing_offsets.tolist(),
+            "hooks": hooks,
+        }
+
+    async def dispatch(self, method: str, target: str, body: bytes) -> Tuple[HTTPStatus, Dict[str, str], bytes]:
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        route = (method, url.path.rstrip("/") or "/")
+        self.counters["requests"] += 1
+
+        if route == ("GET", "/health"):
+            return _json(self.health())
+        if route not in {("POST", "/analyze"), ("POST", "/hooks"), ("POST", "/bundle")}:
+            raise HTTPError(HTTPStatus.NOT_FOUND, f"no route for {method} {url.path}")
+        if not body:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, "request body must contain WAV/MP3 audio")
+
+        if route[1] == "/analyze":
+            return _json(_analysis_json(await self._checked_analysis(body)))
+
+        request = parse_hook_request(query)
+        bpm = _query_value(query, "bpm", float, None, 20.0, 400.0)
+        analysis = await self._checked_analysis(body)
+        result = await self.hooks_for(analysis, request, bpm=bpm)
+        if route[1] == "/hooks":
+            return _json(result)
+
+        include_midi = _query_value(query, "midi", int, 0, 0, 1) == 1
+        timing = result["timing_offsets"] if _query_value(query, "feel", int, 1, 0, 1) == 1 else None
+        with_loop = _query_value(query, "loop", int, 0, 0, 1) == 1
+        loop_start = float(analysis.beat_times[0]) if analysis.beat_times.size else 0.0
+        audio_format = query.get("format", ["wav"])[-1]
+        if audio_format not in AUDIO_FORMATS:
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"format must be one of {sorted(AUDIO_FORMATS)}")
+        payload = await self._run_job(
+            _bundle_bytes, result["hooks"], result["bpm"], include_midi, timing, body if with_loop else None, loop_start,
+            analysis.bpm,
+            sample_rate=_query_value(query, "sample_rate", int, BUNDLE_SR, 8000, 96000),
+            audio_format=audio_format,
+            deflate=_query_value(query, "deflate", int, 0, 0, 1) == 1,
+        )
+        name = build_zip_name(query.get("name", [""])[-1])
+        return HTTPStatus.OK, {"Content-Type": "application/zip", "Content-Disposition": f'attachment; filename="{name}"'}, payload
+
+    async def _checked_analysis(self, body: bytes) -> LoopAnalysis:
+        try:
+            return await self.analyze(body)
+        except HTTPError:
+            raise
+        except Exception as exc:  # decoder errors from librosa/soundfile/audioread
+            raise HTTPError(HTTPStatus.BAD_REQUEST, f"could not analyze audio: {type(exc).__name__}: {exc}")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """asyncio.start_server callback: one request per connection."""
+        headers = {}
+        try:
+            try:
+                method, target, body = await _read_request(reader)
+                status, headers, payload = await self.dispatch(method, target, body)
+            except HTTPError as exc:
+                status, payload = exc.status, json.dumps({"error": str(exc)}).encode()
+                headers = {"Content-Type": "application/json"}
+                if isinstance(exc, ServiceBusy):
+                    headers["Retry-After"] = str(RETRY_AFTER_S)
+            except Exception as exc:
+                status, payload = HTTPStatus.INTERNAL_SERVER_ERROR, json.dumps({"error": f"{type(exc).__name__}: {exc}"}).encode()
+                headers = {"Content-Type": "application/json"}
+            head = [f"HTTP/1.1 {status.value} {status.phrase}", f"Content-Length: {len(payload)}", "Connection: close"]
+            head += [f"{name}: {value}" for name, value in headers.items()]
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def _json(data) -> Tuple[HTTPStatus, Dict[str, str], bytes]:
+    return HTTPStatus.OK, {"Content-Type": "application/json"}, json.dumps(data).encode()
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Tuple[str, str, bytes]:
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.LimitOverrunError:
+        raise HTTPError(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _ = lines[0].split(" ", 2)
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get("content-length", "0"))
+    except ValueError:
+        raise HTTPError(HTTPStatus.BAD_REQUEST, "invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HTTPError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"uploads are limited to {MAX_BODY_BYTES // 2**20} MiB")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, body
+
+
+async def serve(service: HookService, host: str = "127.0.0.1", port: int = 8765) -> asyncio.AbstractServer:
+    """Start the batcher and listen; returns the asyncio server (port 0 picks a free port)."""
+    await service.start()
+    return await asyncio.start_server(service.handle, host, port)
+
+
+def run(
+    host: str = "127.0.0.1", port: int = 8765, workers: Optional[int] = None, audio_store: Optional[str] = None,
+    cache_dir: Optional[str] = None, log=print,
+) -> None:
+    """Blocking entry point used by `cli.py serve`."""
+
+    async def main():
+        service = HookService(
+            workers=workers, store=AudioStore(audio_store) if audio_store else None, cache_dir=cache_dir,
+        )
+        server = await serve(service, host, port)
+        bound = server.sockets[0].getsockname()
+        log(f"hook-aid serving on http://{bound[0]}:{bound[1]}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await service.close()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,42 @@
+import io
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+
+def make_click_loop(bpm=120.0, seconds=4.0, sr=22050, *, per_beat=2, late=0.0, soft_every=1, soft=1.0, drone_hz=None, lead_in=0.0):
+    """Synthetic loop: Hann-window clicks on a grid of `per_beat` steps per beat, as float32.
+
+    Every other click lands `late` of a step behind the grid (swing). With
+    soft_every=n only every n-th click is at full level, the rest at `soft`.
+    drone_hz adds a quiet sine under the clicks; lead_in delays both.
+    """
+    t = np.arange(int(sr * seconds)) / sr
+    y = np.zeros(t.size)
+    if drone_hz is not None:
+        y += 0.2 * np.sin(2 * np.pi * drone_hz * t) * (t >= lead_in)
+    click = np.hanning(256)
+    step = 60.0 / bpm / per_beat
+    for i, start in enumerate(np.arange(lead_in, seconds - 0.05, step)):
+        at = int((start + late * step * (i % 2)) * sr)
+        y[at:at + click.size] += click * (1.0 if i % soft_every == 0 else soft)
+    return y.astype(np.float32)
+
+
+def make_loop_wav(bpm=110.0, seconds=4.0, sr=22050, *, gain=1.0, subtype="PCM_16", **loop_kwargs):
+    """make_click_loop encoded as WAV bytes, as an upload would arrive."""
+    buf = io.BytesIO()
+    y = gain * make_click_loop(bpm, seconds, sr, **loop_kwargs)
+    sf.write(buf, y.astype(np.float32), sr, format="WAV", subtype=subtype)
+    return buf.getvalue()
+
+
+@pytest.fixture
+def click_loop():
+    return make_click_loop
+
+
+@pytest.fixture
+def loop_wav():
+    return make_loop_wav
@@ -0,0 +1,104 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import librosa
+import numpy as np
+import pytest
+import soundfile as sf
+
+import instrument
+
+EXAMPLES = ROOT / "examples"
+from analysis import analyze_bytes, analyze_loop, analyze_stream, warm_up
+from rhythm import estimate_bpm_and_beats, groove_histogram, ticks_from_beats
+
+
+def test_timing_offsets_capture_swing(click_loop):
+    # 16th clicks with accented downbeats; every other 16th `late` of a 16th behind the grid.
+    def offsets(late):
+        return analyze_loop(click_loop(100.0, 8.0, per_beat=4, late=late, soft_every=4, soft=0.1), 22050).timing_offsets
+
+    straight, swung = offsets(0.0), offsets(1 / 3)
+    assert straight.shape == swung.shape == (16,)
+    assert np.abs(straight).max() < 0.1
+    assert np.abs(swung[0::2]).max() < 0.1
+    assert np.all(swung[1::2] > 0.2)
+
+
+def test_analyze_loop_matches_standalone_stages(click_loop):
+    y, sr = click_loop(120.0, 6.0), 22050
+    result = analyze_loop(y, sr)
+
+    bpm, beats = estimate_bpm_and_beats(y, sr)
+    hist = groove_histogram(y, sr, ticks_from_beats(beats))
+
+    assert result.bpm == bpm
+    np.testing.assert_allclose(result.beat_times, beats)
+    np.testing.assert_allclose(result.histogram, hist)
+    assert result.chroma.shape == (12,)
+
+
+def test_analyze_loop_span_wraps_its_stages(click_loop):
+    with instrument.request("analysis") as report:
+        analyze_loop(click_loop(120.0, 4.0), 22050)
+    spans = {item["name"]: item["depth"] for item in report.spans}
+    assert spans["analysis.analyze_loop"] == 0
+    assert spans["analysis.stft"] == spans["analysis.groove"] == 1
+
+
+def test_analyze_loop_handles_silence():
+    sr = 22050
+    result = analyze_loop(np.zeros(sr * 2, dtype=np.float32), sr)
+    assert result.scale is None
+    assert result.scale_score == 0.0
+    assert np.isclose(result.histogram.sum(), 1.0)
+
+
+def test_analyze_stream_matches_in_memory_analysis(tmp_path, click_loop):
+    y, sr = click_loop(120.0, 40.0, 44100), 44100
+    path = tmp_path / "clicks.wav"
+    sf.write(path, y, sr)
+
+    full = analyze_loop(*librosa.load(path, sr=22050))
+    streamed = analyze_stream(str(path), block_frames=64)
+    assert abs(streamed.bpm - full.bpm) <= 0.01 * full.bpm
+    assert np.abs(streamed.histogram - full.histogram).sum() < 0.1
+    assert streamed.duration == pytest.approx(40.0, abs=0.01)
+
+    early = analyze_stream(str(path), block_frames=64, early_stop=True, check_every=2)
+    assert early.duration < streamed.duration
+    assert abs(early.bpm - full.bpm) <= 0.01 * full.bpm
+
+
+def test_warm_up_runs_the_analysis_once():
+    assert warm_up() > 0.0
+
+
+# The example loops' detections, which SCALE_MIN_SCORE/MARGIN/PEAK were tuned on.
+# The two minor loops come out phrygian on purpose: bass_cminor's bass leans on
+# Db (2.5x D) and keys_eminor's chords on F (3.5x F#), so with the b2 heard that
+# often phrygian is what the chroma supports; the tonic is the part that matters.
+EXAMPLE_SCALES = {
+    "bass_cminor_90bpm.wav": "C phrygian",
+    "keys_eminor_100bpm.wav": "E phrygian",
+    "plucks_gmajor_110bpm.wav": "G major",
+    "brokenbeat_128bpm.wav": None,
+    "fouronthefloor_124bpm.wav": None,
+    "groove_100bpm.wav": None,
+    "halftime_70bpm.wav": None,
+    "reggaeton_96bpm.wav": None,
+    "shuffle_92bpm.wav": None,
+    "straight_120bpm.wav": None,
+}
+
+
+@pytest.mark.parametrize("scale_mode", ["full", "fast"])
+def test_example_loops_keep_their_detected_scales(scale_mode):
+    detected = {
+        name: analyze_bytes((EXAMPLES / name).read_bytes(), scale_mode=scale_mode).scale for name in EXAMPLE_SCALES
+    }
+    assert detected == EXAMPLE_SCALES
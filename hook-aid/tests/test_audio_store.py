@@ -0,0 +1,73 @@
+import os
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import numpy as np
+import pytest
+
+import instrument
+from analysis import analyze_bytes, decode_audio
+from audio_store import AudioStore, audio_digest
+from rhythm import load_mono
+
+
+EXAMPLE = ROOT / "examples" / "shuffle_92bpm.wav"
+
+
+def test_store_returns_read_only_memmaps(tmp_path):
+    store = AudioStore(tmp_path)
+    assert store.get("abc", 22050) is None
+    y = np.linspace(-1.0, 1.0, 1000, dtype=np.float32)
+    stored = store.put("abc", 22050, y)
+    assert isinstance(stored, np.memmap)
+    np.testing.assert_array_equal(store.get("abc", 22050), y)
+    assert store.get("abc", 44100) is None
+    with pytest.raises(ValueError):
+        stored[0] = 0.0
+    assert store.put("empty", 22050, np.zeros(0)).size == 0
+    assert store.stats() == {"entries": 2, "bytes": 4000}
+
+
+def test_decode_and_analysis_reuse_the_stored_signal(tmp_path):
+    audio = EXAMPLE.read_bytes()
+    store = AudioStore(tmp_path)
+    plain, sr = decode_audio(audio)
+    with instrument.request("first") as first:
+        cached = analyze_bytes(audio, store=store)
+    with instrument.request("second") as second:
+        again = analyze_bytes(audio, store=store)
+    assert first.counters == {"audio_store.miss": 1} and second.counters == {"audio_store.hit": 1}
+
+    np.testing.assert_array_equal(decode_audio(audio, store=store)[0], plain)
+    assert (tmp_path / f"{audio_digest(audio)}-sr{sr}.f32").exists()
+    reference = analyze_bytes(audio)
+    assert cached.bpm == again.bpm == reference.bpm
+    np.testing.assert_array_equal(again.histogram, reference.histogram)
+
+
+def test_store_evicts_least_recently_used_past_its_budget(tmp_path):
+    store = AudioStore(tmp_path, max_bytes=8000)
+    y = np.zeros(1000, dtype=np.float32)  # 4000 bytes each
+    for age, digest in enumerate(["a", "b"]):
+        store.put(digest, 22050, y)
+        os.utime(store._file(digest, 22050), (1000 + age, 1000 + age))
+    assert store.get("a", 22050) is not None  # now more recent than b
+    with instrument.request("put") as report:
+        store.put("c", 22050, y)
+    assert report.counters["audio_store.evict"] == 1
+    assert store.get("b", 22050) is None
+    assert store.get("a", 22050) is not None and store.get("c", 22050) is not None
+    assert store.stats()["bytes"] <= 8000
+
+
+def test_load_mono_reads_paths_and_file_objects_through_the_store(tmp_path):
+    store = AudioStore(tmp_path)
+    from_path, sr = load_mono(EXAMPLE, store=store)
+    with open(EXAMPLE, "rb") as fh:
+        from_file, _ = load_mono(fh, store=store)
+    np.testing.assert_array_equal(from_path, from_file)
+    assert len(store) == 1
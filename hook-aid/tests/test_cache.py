@@ -0,0 +1,63 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import numpy as np
+
+from analysis import LoopAnalysis
+from cache import AnalysisCache, analysis_key
+
+
+def _fake_analysis(bpm=100.0, scale="C minor"):
+    return LoopAnalysis(
+        sr=22050,
+        duration=2.0,
+        bpm=bpm,
+        beat_times=np.array([0.0, 0.6, 1.2]),
+        tick_times=np.linspace(0.0, 1.2, 8, endpoint=False),
+        onset_times=np.array([0.0, 0.3]),
+        histogram=np.ones(16) / 16,
+        groove_matrix=np.ones((2, 16)),
+        timing_offsets=np.zeros(16),
+        chroma=np.arange(12, dtype=float),
+        scale=scale,
+        scale_score=0.7,
+    )
+
+
+def test_analysis_key_depends_on_parameters():
+    assert analysis_key(b"abc", sr=22050, subdiv=4) != analysis_key(b"abc", sr=22050, subdiv=3)
+    assert analysis_key(b"abc", sr=22050, subdiv=4) != analysis_key(b"abd", sr=22050, subdiv=4)
+    assert analysis_key(b"abc", sr=22050, subdiv=4) != analysis_key(b"abc", sr=22050, subdiv=4, scale_mode="fast")
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = AnalysisCache(max_entries=2)
+    cache.put("a", _fake_analysis(1.0))
+    cache.put("b", _fake_analysis(2.0))
+    assert cache.get("a").bpm == 1.0
+    cache.put("c", _fake_analysis(3.0))
+    assert cache.get("b") is None
+    assert cache.stats() == {"entries": 2, "hits": 1, "disk_hits": 0, "misses": 1}
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    calls = []
+
+    def compute(payload):
+        calls.append(payload)
+        return _fake_analysis(scale=None)
+
+    first = AnalysisCache(cache_dir=tmp_path)
+    first.get_or_compute(b"loop", compute, sr=22050, subdiv=4)
+
+    second = AnalysisCache(cache_dir=tmp_path)
+    restored = second.get_or_compute(b"loop", compute, sr=22050, subdiv=4)
+
+    assert len(calls) == 1
+    assert second.disk_hits == 1
+    assert restored.scale is None
+    np.testing.assert_array_equal(restored.chroma, np.arange(12, dtype=float))
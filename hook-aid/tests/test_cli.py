@@ -0,0 +1,63 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import json
+import zipfile
+
+from cli import JOURNAL_NAME, MANIFEST_NAME, BatchSettings, file_hash, find_loops, load_manifest, run_batch, settings_key
+
+
+EXAMPLE = ROOT / "examples" / "groove_100bpm.wav"
+
+
+def test_batch_writes_bundles_and_resumes(tmp_path):
+    loops = tmp_path / "loops"
+    loops.mkdir()
+    (loops / "a.wav").write_bytes(EXAMPLE.read_bytes())
+    (loops / "notes.txt").write_text("not audio")
+    assert [p.name for p in find_loops([str(loops)])] == ["a.wav"]
+
+    out = tmp_path / "out"
+    logs = []
+    manifest = run_batch([str(loops)], str(out), workers=1, settings=BatchSettings(pool=200), log=logs.append)
+    (entry,) = manifest["loops"].values()
+    assert entry["timings"].keys() == {"decode", "analysis", "generation", "export"}
+    with zipfile.ZipFile(out / entry["bundle"]) as zf:
+        assert "hooks_combined.wav" in zf.namelist()
+
+    # Same content under another name is recognised by hash and skipped.
+    (loops / "copy.wav").write_bytes(EXAMPLE.read_bytes())
+    run_batch([str(loops / "*.wav")], str(out), workers=1, settings=BatchSettings(pool=200), log=logs.append)
+    assert logs[-1] == "0 loop(s) to process, 1 already done"
+    assert not (out / JOURNAL_NAME).exists()
+
+    # Other settings make the old bundle stale, so the loop is processed again.
+    manifest = run_batch([str(loops)], str(out), workers=1, settings=BatchSettings(pool=200, bars=2), log=logs.append)
+    assert logs[-2] == "1 loop(s) to process, 0 already done"
+    assert manifest["loops"][file_hash(loops / "a.wav")]["settings_key"] == settings_key(BatchSettings(pool=200, bars=2))
+
+
+def test_journal_from_an_interrupted_run_is_applied(tmp_path):
+    entry = {"file": "a.wav", "bundle": "a.zip", "settings_key": "x"}
+    (tmp_path / MANIFEST_NAME).write_text(json.dumps({"version": 1, "loops": {}}))
+    (tmp_path / JOURNAL_NAME).write_text(
+        json.dumps({"hash": "aa", "entry": entry}) + "\n"
+        + json.dumps({"hash": "bb", "failure": {"file": "b.wav", "error": "boom"}}) + "\n"
+        + '{"hash": "cc", "ent'  # torn write
+    )
+    manifest = load_manifest(tmp_path)
+    assert manifest["loops"] == {"aa": entry}
+    assert manifest["failures"] == {"bb": {"file": "b.wav", "error": "boom"}}
+
+
+def test_audio_store_is_reused_by_later_runs(tmp_path):
+    store = tmp_path / "decoded"
+    for out in ("first", "second"):  # e.g. re-running with new settings into a fresh folder
+        run_batch([str(EXAMPLE)], str(tmp_path / out), workers=1, settings=BatchSettings(pool=100), audio_store=str(store), log=lambda _: None)
+    traces = [json.loads((tmp_path / out / "trace.jsonl").read_text())["counters"] for out in ("first", "second")]
+    assert traces == [{"audio_store.miss": 1}, {"audio_store.hit": 1}]
+    assert len(list(store.glob("*.f32"))) == 1
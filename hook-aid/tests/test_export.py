@@ -0,0 +1,281 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import io
+import subprocess
+import time
+import wave
+
+import mido
+import numpy as np
+
+from export import (
+    AUDIO_FORMATS,
+    LOOP_GAIN,
+    encode_audio,
+    hooks_to_midi_bytes,
+    hooks_to_wav_bytes,
+    loop_mix,
+    midi_files,
+    notes_to_midi_bytes,
+    notes_to_wav_bytes,
+    render_hooks,
+)
+
+
+HOOKS = [
+    [(0, 1, 60), (1, 2, 62), (2, 1, 64), (8, 2, 67)],
+    [(4, 1, 55)],
+    [],
+]
+
+
+def _frames(wav_bytes):
+    with wave.open(io.BytesIO(wav_bytes)) as wf:
+        return np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+
+
+def test_render_hooks_tracks_match_single_hook_export():
+    rendered = render_hooks(HOOKS, bpm=100)
+    assert rendered.buffer.shape == (3, rendered.lengths.max())
+    for i, notes in enumerate(HOOKS):
+        assert rendered.wav_bytes(i) == notes_to_wav_bytes(notes, bpm=100)
+
+
+def test_timing_profile_moves_audio_and_midi_notes():
+    timing = np.zeros(16)
+    timing[[1, 8]] = [0.5, -0.25]
+    notes = [(0, 1, 60), (1, 1, 62), (8, 1, 64)]
+    assert render_hooks([notes], bpm=100, timing=np.zeros(16)).wav_bytes(0) == notes_to_wav_bytes(notes, bpm=100)
+
+    straight = render_hooks([notes], bpm=120, sample_rate=8000).track(0)
+    felt = render_hooks([notes], bpm=120, sample_rate=8000, timing=timing).track(0)
+    unit = 1000  # samples per 16th at 120 BPM and 8 kHz
+    assert felt.size == straight.size + unit // 2
+    np.testing.assert_array_equal(felt[:unit], straight[:unit])
+    np.testing.assert_array_equal(felt[unit + unit // 2 : 2 * unit + unit // 2], straight[unit : 2 * unit])
+    np.testing.assert_array_equal(felt[8 * unit - unit // 4 : 9 * unit - unit // 4], straight[8 * unit : 9 * unit])
+
+    track = mido.MidiFile(file=io.BytesIO(notes_to_midi_bytes(notes, bpm=120, timing=timing))).tracks[0]
+    on_ticks = np.cumsum([msg.time for msg in track])[[msg.type == "note_on" for msg in track]]
+    np.testing.assert_array_equal(on_ticks, [0, 180, 930])  # 120 ticks per 16th
+
+
+def test_mix_is_derived_from_the_rendered_buffer():
+    rendered = render_hooks(HOOKS, bpm=100)
+    mix = _frames(rendered.mix_wav_bytes())
+    assert mix.size == rendered.lengths.max()
+    assert rendered.mix_wav_bytes() == hooks_to_wav_bytes(HOOKS, bpm=100)
+    assert np.abs(mix).max() > 0
+
+
+class _ForwardOnly(io.RawIOBase):
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+
+def test_bundle_streams_wavs_and_optional_midi():
+    import zipfile
+
+    from bundle import bundle_file, write_bundle
+
+    names = write_bundle(_ForwardOnly(), HOOKS[:2], bpm=100, include_midi=True)
+    assert names == ["hook_1.wav", "hook_2.wav", "hooks_combined.wav", "hook_1.mid", "hook_2.mid", "hooks.mid"]
+
+    with zipfile.ZipFile(bundle_file(HOOKS[:2], bpm=100)) as zf:
+        assert zf.namelist() == names[:3]
+        assert zf.read("hook_1.wav") == notes_to_wav_bytes(HOOKS[0], bpm=100)
+        assert zf.read("hooks_combined.wav") == hooks_to_wav_bytes(HOOKS[:2], bpm=100)
+
+
+def test_loop_mix_tiles_the_loop_from_its_first_beat():
+    sr = 8000  # 1000 samples per 16th at 120 BPM
+    loop = np.stack([np.linspace(-0.5, 0.5, 5000), np.linspace(0.5, -0.5, 5000)]).astype(np.float32)
+    rendered = render_hooks(HOOKS[:2], bpm=120, sample_rate=sr)
+    mix = loop_mix(rendered, loop, bpm=120, bars=1, start=0.25)
+    assert mix.bed.shape == (16000, 2)
+
+    expected_bed = LOOP_GAIN * loop[:, (2000 + np.arange(16000)) % 5000].T
+    for i in range(len(mix)):
+        hook = np.zeros(16000, dtype=np.float32)
+        hook[: rendered.lengths[i]] = rendered.track(i)[:16000]
+        np.testing.assert_allclose(mix.track(i), np.clip(expected_bed + hook[:, None], -1, 1), atol=1e-6)
+
+    with wave.open(io.BytesIO(mix.wav_bytes(1))) as wf:
+        assert (wf.getnchannels(), wf.getnframes(), wf.getframerate()) == (2, 16000, sr)
+        frames = np.frombuffer(wf.readframes(16000), dtype=np.int16).reshape(-1, 2)
+    np.testing.assert_array_equal(frames, (mix.track(1) * 32767.0).astype(np.int16))
+
+
+def test_loop_mix_keeps_a_non_integer_tempo_on_the_hook_grid():
+    sr, loop_bpm, bpm = 8000, 99.38, 99  # hooks render at the rounded tempo
+    beat = 60.0 / loop_bpm * sr
+    loop = np.zeros(int(round(8 * beat)), dtype=np.float32)  # two bars of clicks, wrapped 4 times below
+    for k in range(8):
+        loop[int(round(k * beat)) + np.arange(8)] = 1.0
+    rendered = render_hooks(HOOKS[:1], bpm=bpm, sample_rate=sr)
+
+    def click_drift(**kwargs):
+        bed = loop_mix(rendered, loop, bpm=bpm, bars=8, **kwargs).bed[:, 0]
+        grid = np.arange(32) * 60.0 / bpm * sr
+        found = [int(at) + np.argmax(bed[int(at) : int(at) + 200]) for at in grid[1:] - 100]
+        return np.abs(np.array(found) - grid[1:]).max() / sr
+
+    assert click_drift(loop_bpm=loop_bpm) < 0.002
+    assert click_drift() > 0.01  # tiled at its own length, the loop drifts ~2.3 ms a beat until it wraps
+
+
+def test_bundle_adds_hooks_over_the_loop():
+    import zipfile
+
+    from bundle import bundle_file
+
+    loop = np.random.default_rng(0).uniform(-0.5, 0.5, 30000).astype(np.float32)
+    with zipfile.ZipFile(bundle_file(HOOKS[:2], bpm=100, loop=loop, loop_start=0.1)) as zf:
+        assert zf.namelist()[3:] == ["hook_1_with_loop.wav", "hook_2_with_loop.wav"]
+        with wave.open(io.BytesIO(zf.read("hook_1_with_loop.wav"))) as wf:
+            assert wf.getnchannels() == 2 and wf.getnframes() == int(round(16 * 0.15 * 22050))
+
+
+def test_bundle_formats_round_trip_and_flac_is_stored():
+    import zipfile
+
+    import pytest
+    import soundfile as sf
+
+    from bundle import bundle_file
+
+    rendered = render_hooks(HOOKS[:2], bpm=100)
+    buf = bundle_file(HOOKS[:2], bpm=100, include_midi=True, audio_format="flac", deflate=True)
+    with zipfile.ZipFile(buf) as zf:
+        assert zf.namelist()[:3] == ["hook_1.flac", "hook_2.flac", "hooks_combined.flac"]
+        assert zf.getinfo("hook_1.flac").compress_type == zipfile.ZIP_STORED
+        assert zf.getinfo("hooks.mid").compress_type == zipfile.ZIP_DEFLATED
+        audio, sr = sf.read(io.BytesIO(zf.read("hook_1.flac")), dtype="int16")
+    assert sr == 22050
+    np.testing.assert_array_equal(audio, (rendered.track(0) * 32767.0).astype(np.int16))
+
+    with zipfile.ZipFile(bundle_file(HOOKS[:1], bpm=100, audio_format="wav-float")) as zf:
+        audio, _ = sf.read(io.BytesIO(zf.read("hook_1.wav")), dtype="float32")
+    np.testing.assert_array_equal(audio, render_hooks(HOOKS[:1], bpm=100).track(0))
+
+    with pytest.raises(ValueError, match="format"):
+        bundle_file(HOOKS[:1], bpm=100, audio_format="ogg")
+
+
+def test_loop_mixes_encode_block_by_block_like_the_wav_path():
+    import zipfile
+
+    import soundfile as sf
+
+    from bundle import bundle_file
+
+    loop = np.random.default_rng(1).uniform(-0.5, 0.5, (2, 30000)).astype(np.float32)
+    kwargs = dict(bpm=100, loop=loop, loop_start=0.1)
+    with zipfile.ZipFile(bundle_file(HOOKS[:2], **kwargs)) as wav, \
+            zipfile.ZipFile(bundle_file(HOOKS[:2], audio_format="flac", **kwargs)) as flac:
+        for i in (1, 2):
+            expected, _ = sf.read(io.BytesIO(wav.read(f"hook_{i}_with_loop.wav")), dtype="int16")
+            audio, _ = sf.read(io.BytesIO(flac.read(f"hook_{i}_with_loop.flac")), dtype="int16")
+            np.testing.assert_array_equal(audio, expected)
+
+
+def test_empty_audio_is_the_same_silence_in_every_format():
+    import soundfile as sf
+
+    for shape in ((0,), (0, 2)):
+        for audio_format in AUDIO_FORMATS:
+            data = encode_audio(np.zeros(shape, dtype=np.float32), sample_rate=8000, audio_format=audio_format)
+            info = sf.info(io.BytesIO(data))
+            assert (info.frames, info.channels) == (800, max(shape[1:], default=1)), (audio_format, shape)
+
+
+def test_encode_window_bounds_the_files_in_flight():
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    from bundle import _in_order
+
+    started, release = [], threading.Event()
+
+    def job(i):
+        def run():
+            started.append(i)
+            if i == 0:
+                release.wait(5)
+            return i
+        return run
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        results = _in_order(pool, [(i, job(i)) for i in range(10)], window=2)
+        time.sleep(0.05)
+        assert started == []  # nothing runs before the bundle asks for it
+        threading.Timer(0.1, release.set).start()
+        assert next(results) == (0, 0)
+        assert sorted(started) == [0, 1]  # one window's worth, not all ten
+        assert list(results) == [(i, i) for i in range(1, 10)]
+
+
+def test_generation_and_export_do_not_load_the_audio_stack():
+    script = (
+        "import sys; import numpy as np\n"
+        "from graph import GenerationGraph; from bundle import bundle_file\n"
+        "hooks = GenerationGraph().rank(np.ones(16) / 16, pool=100).to_notes()\n"
+        "bundle_file(hooks, bpm=100, include_midi=True)\n"
+        "print(sorted(m for m in ('librosa', 'mido', 'numba', 'scipy') if m in sys.modules))\n"
+    )
+    out = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "[]"
+
+
+def _mido_track(notes, channel, tpb):
+    """The per-message mido writer the NumPy encoder replaced."""
+    track, tick = [], 0
+    for onset, dur, pitch in sorted(notes, key=lambda item: (item[0], item[2])):
+        start = max(0, int(round(onset * tpb / 4.0)))
+        length = max(1, int(round(dur * tpb / 4.0)))
+        track.append(mido.Message("note_on", note=pitch, velocity=96, time=max(0, start - tick), channel=channel))
+        track.append(mido.Message("note_off", note=pitch, velocity=0, time=length, channel=channel))
+        tick = start + length
+    return track
+
+
+def _mido_bytes(hooks, bpm, tpb, multi):
+    tempo = [mido.MetaMessage("set_tempo", tempo=mido.bpm2tempo(bpm), time=0), mido.MetaMessage("time_signature", time=0)]
+    mid = mido.MidiFile(type=1 if multi else 0, ticks_per_beat=tpb)
+    if multi:
+        mid.tracks.append(mido.MidiTrack(tempo))
+    for idx, notes in enumerate(hooks):
+        head = [mido.MetaMessage("track_name", name=f"hook_{idx + 1}", time=0)] if multi else tempo
+        channel = idx % 16 if multi else 0
+        program = [mido.Message("program_change", program=0, channel=channel, time=0)]
+        mid.tracks.append(mido.MidiTrack(head + program + _mido_track(notes, channel, tpb)))
+    buf = io.BytesIO()
+    mid.save(file=buf)
+    return buf.getvalue()
+
+
+def test_midi_encoder_matches_mido_byte_for_byte():
+    rng = np.random.default_rng(7)
+    for _ in range(20):
+        hooks = [
+            [(int(rng.integers(0, 64)), int(rng.integers(0, 9)), int(rng.integers(0, 128))) for _ in range(rng.integers(0, 10))]
+            for _ in range(rng.integers(1, 6))
+        ]
+        hooks[0].append((40000, 70000, 60))  # multi-byte delta times
+        bpm, tpb = float(rng.uniform(40, 220)), int(rng.choice([96, 480, 960]))
+        assert midi_files(hooks, bpm=bpm, ticks_per_beat=tpb) == [_mido_bytes([h], bpm, tpb, False) for h in hooks]
+        assert notes_to_midi_bytes(hooks[-1], bpm=bpm, ticks_per_beat=tpb) == _mido_bytes([hooks[-1]], bpm, tpb, False)
+        assert hooks_to_midi_bytes(hooks, bpm=bpm, ticks_per_beat=tpb) == _mido_bytes(hooks, bpm, tpb, True)
+    assert hooks_to_midi_bytes(HOOKS, bpm=100) == _mido_bytes(HOOKS, 100, 480, True)  # includes an empty hook
@@ -0,0 +1,80 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import numpy as np
+
+from analysis import analyze_bytes
+from fingerprint import Fingerprint, FingerprintIndex, fingerprint_bytes, reuse_analysis
+
+
+def test_re_encoded_copy_matches_and_other_loops_do_not(loop_wav):
+    def _loop(pitch_hz=220.0, **kwargs):  # clicks over a drone, so there is chroma to compare
+        return loop_wav(gain=0.5, drone_hz=pitch_hz, **kwargs)
+
+    index = FingerprintIndex()
+    original, _ = fingerprint_bytes(_loop())
+    index.add("original", original)
+
+    copy, _ = fingerprint_bytes(_loop(subtype="PCM_24"))
+    assert index.match(copy) == "original"
+    other_key, _ = fingerprint_bytes(_loop(pitch_hz=311.1))
+    assert index.match(other_key) is None
+    other_tempo, _ = fingerprint_bytes(_loop(bpm=128.0))
+    assert index.match(other_tempo) is None
+    assert index.stats() == {"entries": 1, "matches": 1, "misses": 2}
+
+
+def test_groove_is_compared_under_whole_beat_rotations():
+    index = FingerprintIndex()
+    hist = np.zeros(16, dtype=np.float32)
+    hist[[0, 6, 10]] = 1.0
+    chroma = np.ones(12, dtype=np.float32) / np.sqrt(12)
+    index.add("loop", Fingerprint(120.0, np.concatenate([hist / np.linalg.norm(hist), chroma])))
+
+    rotated = np.roll(hist, 4) / np.linalg.norm(hist)
+    key, distance = index.nearest(Fingerprint(120.5, np.concatenate([rotated, chroma])))
+    assert key == "loop" and distance < 1e-6
+    shifted = np.roll(hist, 1) / np.linalg.norm(hist)
+    assert index.match(Fingerprint(120.0, np.concatenate([shifted, chroma]))) is None
+
+
+def test_index_persists_and_drops_a_torn_append(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.random((3, 28)).astype(np.float32)
+    index = FingerprintIndex(tmp_path)
+    for i, vector in enumerate(vectors):
+        index.add(f"key{i}", Fingerprint(100.0 + 5 * i, vector))
+    with open(tmp_path / "rows.f32", "ab") as fh:
+        fh.write(vectors[0][:10].tobytes())  # crashed halfway through a fourth add
+
+    reloaded = FingerprintIndex(tmp_path)
+    assert len(reloaded) == 3
+    assert reloaded.nearest(Fingerprint(110.0, vectors[2])) == ("key2", 0.0)
+    assert FingerprintIndex(tmp_path, groove_bins=12).stats()["entries"] == 0  # other settings start fresh
+
+
+
+def test_discarded_keys_stop_matching_after_a_reload(tmp_path):
+    vectors = np.random.default_rng(1).random((2, 28)).astype(np.float32)
+    index = FingerprintIndex(tmp_path)
+    index.add("gone", Fingerprint(100.0, vectors[0]))
+    index.add("kept", Fingerprint(100.0, vectors[1]))
+    index.discard("gone")
+    for reopened in (index, FingerprintIndex(tmp_path)):
+        assert reopened.nearest(Fingerprint(100.0, vectors[0]))[0] == "kept"
+        assert len(reopened) == 1
+
+def test_reused_analysis_keeps_the_uploads_own_timing(loop_wav):
+    original = loop_wav(seconds=8.0, gain=0.5, drone_hz=220.0)
+    padded = loop_wav(seconds=8.5, gain=0.5, drone_hz=220.0, lead_in=0.5)  # same loop after 0.5 s of silence
+    stored = analyze_bytes(original)
+    _, quick = fingerprint_bytes(padded)
+    merged = reuse_analysis(quick, stored)
+    assert merged.scale == stored.scale and merged.chroma is stored.chroma
+    assert merged.beat_times is quick.beat_times and merged.onset_times is quick.onset_times
+    assert merged.duration == 8.5 and stored.duration == 8.0
+    assert merged.onset_times[0] > 0.45 > stored.onset_times[0]  # nothing from the silent lead-in
@@ -0,0 +1,46 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import numpy as np
+
+from export import render_hooks
+from graph import GenerationGraph
+from scoring import rank_hooks
+
+
+HIST = np.linspace(2.0, 1.0, 16) / np.linspace(2.0, 1.0, 16).sum()
+
+
+def test_rank_matches_rank_hooks():
+    graph = GenerationGraph()
+    kwargs = dict(k=5, pool=300, density=6, syncopation=0.4, scale="D dorian", register=(55, 76), seed=3)
+    cached = graph.rank(HIST, **kwargs)
+    direct = rank_hooks(HIST, **kwargs)
+    assert cached.to_notes() == direct.to_notes()
+
+
+def test_only_invalidated_stages_recompute():
+    graph = GenerationGraph()
+    graph.rank(HIST, pool=200, scale="C minor", register=(55, 76))
+    graph.rank(HIST, pool=200, scale="C minor", register=(48, 69))
+    stats = graph.stats()
+    assert stats["rhythms"] == {"entries": 1, "hits": 1, "misses": 1}
+    assert stats["pitches"]["misses"] == 2
+
+    graph.rank(HIST, pool=200, scale="C minor", register=(55, 76))
+    stats = graph.stats()
+    assert stats["pitches"]["hits"] == 1 and stats["ranking"]["hits"] == 1
+
+
+def test_audio_is_cached_per_notes_and_bpm():
+    graph = GenerationGraph()
+    hooks = graph.rank(HIST, pool=200).to_notes()
+    first = graph.audio(hooks, bpm=100)
+    assert graph.audio([list(h) for h in hooks], bpm=100) is first
+    assert graph.audio(hooks, bpm=120) is not first
+    np.testing.assert_array_equal(first.buffer, render_hooks(hooks, bpm=100).buffer)
+    assert graph.stats()["audio"] == {"entries": 2, "hits": 1, "misses": 2}
@@ -0,0 +1,50 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import json
+
+import instrument
+
+
+@instrument.timed("demo.inner")
+def _inner():
+    instrument.count("demo.calls")
+    return 42
+
+
+def test_spans_are_noops_without_a_request():
+    assert _inner() == 42
+    assert instrument.current() is None
+
+
+def test_request_collects_nested_spans_and_counters(monkeypatch):
+    monkeypatch.setenv(instrument.PROFILE_ENV, "tracemalloc")
+    with instrument.request("demo") as report:
+        with instrument.span("demo.outer"):
+            _inner()
+            _inner()
+
+    names = [(item["name"], item["depth"]) for item in report.spans]
+    assert names == [("demo.inner", 1), ("demo.inner", 1), ("demo.outer", 0)]
+    assert report.counters == {"demo.calls": 2}
+    assert all("peak_bytes" in item for item in report.spans)
+    assert report.totals()["demo.outer"] <= report.total_s
+    assert json.loads(report.to_json())["name"] == "demo"
+    assert instrument.current() is None
+
+
+def test_overlapping_requests_share_tracemalloc(monkeypatch):
+    import tracemalloc
+
+    monkeypatch.setenv(instrument.PROFILE_ENV, "tracemalloc")
+    assert not tracemalloc.is_tracing()
+    first = instrument.start("first")
+    second = instrument.start("second")  # e.g. another Streamlit session
+    instrument.finish(first)
+    assert tracemalloc.is_tracing()
+    instrument.finish(second)
+    assert not tracemalloc.is_tracing()
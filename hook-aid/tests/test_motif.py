@@ -0,0 +1,132 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import numpy as np
+import pytest
+
+from motif import (
+    SCALE_MIN_MARGIN,
+    SCALE_NAMES,
+    SCALE_TEMPLATES,
+    _fast_chroma,
+    _fit_to_register,
+    _parse_scale,
+    detect_scale_from_audio,
+    generate_hooks,
+    generate_phrases,
+    list_available_scales,
+    match_scales,
+    midi_mapper,
+    scale_from_chroma,
+)
+
+
+def test_generate_hooks_is_seed_reproducible():
+    hist = np.linspace(1.0, 2.0, 16)
+    first = generate_hooks(hist, 64, density=6, scale="E minor", seed=7)
+    second = generate_hooks(hist, 64, density=6, scale="E minor", seed=7)
+    np.testing.assert_array_equal(first.onsets, second.onsets)
+    np.testing.assert_array_equal(first.pitches, second.pitches)
+    assert first.onsets.shape == (64, 6)
+
+
+def test_generate_hooks_respects_grid_scale_and_register():
+    batch = generate_hooks(np.ones(16), 500, density=8, scale="D major", register=(55, 76), seed=1)
+    assert np.all(np.diff(batch.onsets, axis=1) > 0)
+    assert set(np.unique(batch.durations)) <= {1, 2}
+    assert batch.pitches.min() >= 55 and batch.pitches.max() <= 76
+    d_major = {(2 + d) % 12 for d in (0, 2, 4, 5, 7, 9, 11)}
+    assert set(np.unique(batch.pitches % 12)) <= d_major
+    tonic = _fit_to_register(midi_mapper("D major")(0), (55, 76))
+    assert np.all(batch.pitches[:, -1] == tonic)
+
+
+def test_register_change_keeps_rhythms():
+    hist = np.ones(16)
+    low = generate_hooks(hist, 10, register=(48, 69), seed=3)
+    high = generate_hooks(hist, 10, register=(62, 84), seed=3)
+    np.testing.assert_array_equal(low.onsets, high.onsets)
+    assert low.hook(0)[0][:2] == (int(low.onsets[0, 0]), int(low.durations[0, 0]))
+
+
+def test_fast_chroma_peaks_on_played_pitch_classes():
+    sr = 22050
+    t = np.arange(sr * 3) / sr
+    # A C major triad: C4, E4, G4.
+    y = sum(np.sin(2 * np.pi * f * t) for f in (261.63, 329.63, 392.0)).astype(np.float32)
+    chroma = _fast_chroma(y, sr)
+    assert set(np.argsort(chroma)[-3:]) == {0, 4, 7}
+
+
+def test_scale_from_chroma_scores_against_every_template():
+    chroma = np.random.default_rng(3).random(12)
+    _, score = scale_from_chroma(chroma)
+    share = chroma / chroma.sum()
+    assert score == pytest.approx(max(float(share @ t) for t in SCALE_TEMPLATES.values()))
+
+
+def test_pentatonics_never_beat_their_parent_scales():
+    # Energy only on C major pentatonic notes: the pentatonic ties C major at best.
+    chroma = np.zeros(12)
+    chroma[[0, 2, 4, 7, 9]] = [3.0, 1.0, 1.5, 1.5, 1.0]
+    assert scale_from_chroma(chroma)[0] == "C major"
+    rows = np.random.default_rng(8).random((200, 12))
+    best, _, _ = match_scales(rows)
+    assert not any(SCALE_NAMES[i].endswith("pentatonic") for i in best)
+
+    # C major and A minor share every note; the margin is taken against other keys.
+    chroma = np.full(12, 0.02)
+    chroma[[0, 2, 4, 5, 7, 9, 11]] = [3.0, 1.0, 2.0, 1.0, 2.0, 1.0, 1.0]
+    best, best_score, second_score = match_scales(chroma)
+    assert SCALE_NAMES[best[0]] == "C major"
+    assert best_score[0] - second_score[0] > SCALE_MIN_MARGIN
+
+
+def test_detect_scale_rejects_unknown_mode():
+    with pytest.raises(ValueError):
+        detect_scale_from_audio(np.ones(1024, dtype=np.float32), 22050, mode="turbo")
+
+
+def test_multi_word_scales_parse_and_generate():
+    assert _parse_scale("f# Harmonic Minor") == ("F#", "harmonic minor", [0, 2, 3, 5, 7, 8, 11])
+    assert _parse_scale("A aeolian")[1] == "minor"
+    assert "Eb minor pentatonic" in list_available_scales()
+
+    batch = generate_hooks(np.ones(16), 200, density=6, scale="A minor pentatonic", seed=2)
+    a_min_pent = {(9 + d) % 12 for d in (0, 3, 5, 7, 10)}
+    assert set(np.unique(batch.pitches % 12)) <= a_min_pent
+
+
+def test_match_scales_batches_rows_and_breaks_mode_ties_by_root():
+    rows = np.random.default_rng(5).random((300, 12))
+    best, best_score, _ = match_scales(rows)
+    for i in (0, 123, 299):
+        assert scale_from_chroma(rows[i])[1] == pytest.approx(best_score[i])
+
+    # A-minor-shaped chroma: every C-major mode ties on score, the emphasized root decides.
+    chroma = np.zeros(12)
+    chroma[[9, 11, 0, 2, 4, 5, 7]] = [3.0, 1.0, 1.5, 1.0, 2.0, 1.0, 1.0]
+    best, best_score, second_score = match_scales(chroma)
+    assert SCALE_NAMES[best[0]] == "A minor"
+    assert second_score[0] < best_score[0]
+
+
+def test_phrases_follow_their_form_and_resolve_to_tonic():
+    groove = np.tile(np.eye(16)[[0, 4, 8, 12]].sum(axis=0), (4, 1))
+    batch = generate_phrases(groove, 50, bars=4, density=4, scale="A minor", variation=0.0, seed=2)
+    assert batch.onsets.shape == (50, 16)
+    bars = batch.onsets.reshape(50, 4, 4)
+    np.testing.assert_array_equal(bars // 16, np.broadcast_to(np.arange(4)[:, None], (50, 4, 4)))
+    # "A A' A B": bar 3 repeats bar 1 exactly; with no variation noise A' keeps A's rhythm.
+    np.testing.assert_array_equal(bars[:, 2] - 32, bars[:, 0])
+    np.testing.assert_array_equal(bars[:, 1] - 16, bars[:, 0])
+    np.testing.assert_array_equal(batch.pitches[:, 8:11], batch.pitches[:, 0:3])
+    tonic = _fit_to_register(midi_mapper("A minor")(0), (55, 76))
+    assert np.all(batch.pitches[:, -1] == tonic)
+
+    with pytest.raises(ValueError):
+        generate_phrases(groove, 10, bars=3)
@@ -0,0 +1,60 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import numpy as np
+
+from rhythm import bpm_and_beats_from_envelope, groove_matrix_from_onsets, histogram_from_onsets, nearest_tick_indices, ticks_from_beats
+
+
+def test_ticks_from_beats_matches_linspace_per_beat():
+    beats = np.array([0.0, 0.5, 1.02, 1.49])
+    expected = np.concatenate([
+        np.linspace(beats[i], beats[i + 1], 4, endpoint=False) for i in range(beats.size - 1)
+    ])
+    np.testing.assert_array_equal(ticks_from_beats(beats, subdiv=4), expected)
+    assert ticks_from_beats(beats[:1]).size == 0
+
+
+def test_nearest_tick_prefers_earlier_tick_on_ties():
+    ticks = np.array([0.0, 1.0, 2.0])
+    idx = nearest_tick_indices([-0.3, 0.5, 0.6, 1.5, 9.0], ticks)
+    np.testing.assert_array_equal(idx, [0, 0, 1, 1, 2])
+
+
+def test_histogram_supports_weights_and_wider_grids():
+    ticks = np.arange(64) * 0.125
+    hist = histogram_from_onsets([0.0, 0.125, 4.0], ticks, grid=32, weights=[1.0, 3.0, 1.0])
+    assert hist.shape == (32,)
+    np.testing.assert_allclose(hist[[0, 1]], [0.4, 0.6])
+
+
+def test_groove_matrix_splits_onsets_by_bar():
+    ticks = np.arange(40) * 0.125  # two full bars and a partial third
+    onsets = [0.0, 0.5, 2.0, 2.25, 4.75]
+    matrix = groove_matrix_from_onsets(onsets, ticks)
+    assert matrix.shape == (3, 16)
+    np.testing.assert_array_equal(matrix.sum(axis=1), [2, 2, 1])
+    assert matrix[1, 0] == 1 and matrix[2, 6] == 1
+    hist = matrix.sum(axis=0)
+    np.testing.assert_allclose(histogram_from_onsets(onsets, ticks), hist / hist.sum())
+
+
+def test_fallback_tracker_uses_the_median_envelope(monkeypatch):
+    import librosa
+
+    seen = []
+
+    def beat_track(onset_envelope, sr, start_bpm=None, trim=True):
+        seen.append(onset_envelope)
+        beats = np.array([], dtype=int) if len(seen) == 1 else np.array([10, 20, 30])
+        return 100.0, beats
+
+    monkeypatch.setattr(librosa.beat, "beat_track", beat_track)
+    mean_env, median_env = np.ones(200), np.full(200, 2.0)
+    bpm, beats = bpm_and_beats_from_envelope(mean_env, 22050, median_env=lambda: median_env)
+    assert seen[0] is mean_env and seen[1] is median_env
+    assert bpm == 100.0 and beats.size == 3
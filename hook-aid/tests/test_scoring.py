@@ -0,0 +1,92 @@
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import numpy as np
+
+from motif import HookBatch, generate_hooks, generate_phrases
+from scoring import rank_hooks, rank_hooks_batch, rank_phrases, score_components, score_hooks, select_top_k
+
+
+def _four_on_floor():
+    hist = np.zeros(16)
+    hist[[0, 4, 8, 12]] = 1.0
+    return hist / hist.sum()
+
+
+def test_groove_and_scale_terms():
+    batch = HookBatch(
+        onsets=np.array([[0, 4, 8, 12], [1, 3, 5, 7]]),
+        durations=np.ones((2, 4), dtype=int),
+        pitches=np.array([[60, 62, 63, 60], [61, 66, 69, 61]]),
+    )
+    parts = score_components(batch, _four_on_floor(), "C minor")
+    np.testing.assert_allclose(parts["groove"], [1.0, 0.0])
+    np.testing.assert_allclose(parts["scale_fit"], [1.0, 0.0])
+
+
+def test_scale_fit_follows_the_loop_chroma():
+    batch = generate_hooks(np.ones(16), 300, density=6, scale="C minor", seed=4)
+    assert np.all(score_components(batch, np.ones(16), "C minor")["scale_fit"] == 1.0)
+
+    chroma = np.zeros(12)
+    chroma[[0, 3, 7]] = [1.0, 0.6, 0.8]  # a C minor triad
+    fit = score_components(batch, np.ones(16), "C minor", chroma=chroma)["scale_fit"]
+    assert 0.0 <= fit.min() < fit.max() <= 1.0
+    triad_share = np.isin(batch.pitches % 12, [0, 3, 7]).mean(axis=1)
+    assert np.corrcoef(fit, triad_share)[0, 1] > 0.9
+
+
+def test_select_top_k_skips_duplicates():
+    batch = HookBatch(
+        onsets=np.array([[0, 4, 8], [0, 4, 8], [2, 6, 10]]),
+        durations=np.ones((3, 3), dtype=int),
+        pitches=np.array([[60, 62, 63], [60, 62, 63], [60, 62, 63]]),
+    )
+    picked = select_top_k(batch, np.array([1.0, 0.99, 0.8]), k=2, diversity=0.5)
+    assert picked.tolist() == [0, 2]
+
+
+def test_rank_hooks_prefers_loop_groove_and_stays_fast():
+    hist = _four_on_floor()
+    pool = generate_hooks(hist, 5000, density=4, syncopation=0.0, seed=0)
+    start = time.perf_counter()
+    scores = score_hooks(pool, hist, "C minor")
+    picked = select_top_k(pool, scores, k=5)
+    assert time.perf_counter() - start < 0.5
+    assert scores[picked].mean() > scores.mean()
+
+    best = rank_hooks(hist, k=5, pool=500, density=4, syncopation=0.0)
+    assert len(best) == 5
+
+
+def test_rank_hooks_batch_matches_per_histogram_calls():
+    rng = np.random.default_rng(11)
+    hists = rng.random((3, 16))
+    kwargs = dict(k=4, pool=250, density=6, syncopation=0.3, scale="G mixolydian", register=(48, 69), seed=5)
+    batched = rank_hooks_batch(hists, **kwargs)
+    for hist, got in zip(hists, batched):
+        assert got.to_notes() == rank_hooks(hist, **kwargs).to_notes()
+
+
+def test_rank_phrases_scores_every_bar():
+    groove = np.tile(_four_on_floor(), (2, 1))
+    best = rank_phrases(groove, k=3, pool=300, bars=8, density=4, syncopation=0.0)
+    assert best.onsets.shape == (3, 32)
+    assert best.onsets.max() >= 7 * 16
+    assert len({tuple(map(tuple, hook)) for hook in best.to_notes()}) == 3
+
+
+def test_phrase_components_stay_in_unit_range():
+    rng = np.random.default_rng(3)
+    for bars in (2, 4, 8):
+        groove = rng.random((bars, 16))
+        batch = generate_phrases(groove, 200, bars=bars, density=7, seed=bars)
+        parts = score_components(batch, groove.sum(axis=0), "C minor")
+        for name, values in parts.items():
+            assert 0.0 <= values.min() and values.max() <= 1.0, name
+        assert parts["groove"].max() > 0.5  # still a per-bar share, not shrunk by the bar count
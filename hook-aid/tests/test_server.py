@@ -0,0 +1,148 @@
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+import asyncio
+import io
+import json
+import multiprocessing
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from cache import AnalysisCache, analysis_key
+from fingerprint import fingerprint_bytes
+from motif import REGISTERS
+from scoring import rank_hooks
+from server import HookRequest, HookService, ServiceBusy, serve
+
+
+async def _request(port, method, path, body=b""):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body)
+    await writer.drain()
+    raw = await reader.read()
+    writer.close()
+    head, _, payload = raw.partition(b"\r\n\r\n")
+    return int(head.split()[1]), head.decode("latin-1"), payload
+
+
+def _run_with_server(executor, scenario, **service_kwargs):
+    async def main():
+        service = HookService(executor, **service_kwargs)
+        server = await serve(service, port=0)
+        try:
+            return await scenario(server.sockets[0].getsockname()[1], service)
+        finally:
+            server.close()
+            await server.wait_closed()
+            await service.close()
+
+    return asyncio.run(main())
+
+
+def test_concurrent_hook_requests_share_one_batch(loop_wav):
+    audio = loop_wav()
+
+    async def scenario(port, service):
+        _, _, analysis = await _request(port, "POST", "/analyze", audio)
+        responses = await asyncio.gather(*(_request(port, "POST", "/hooks?pool=300&density=6", audio) for _ in range(3)))
+        return json.loads(analysis), responses, service.health()
+
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        analysis, responses, health = _run_with_server(pool, scenario, batch_window=0.2)
+
+    assert [status for status, _, _ in responses] == [200, 200, 200]
+    bodies = [json.loads(payload) for _, _, payload in responses]
+    expected = rank_hooks(
+        np.asarray(analysis["histogram"]), k=5, pool=300, density=6, scale=bodies[0]["scale"], register=REGISTERS["mid"],
+        chroma=np.asarray(analysis["chroma"]),
+    ).to_notes()
+    for body in bodies:
+        assert [[tuple(note) for note in hook] for hook in body["hooks"]] == expected
+    assert health["batches"] == 1 and health["batched_requests"] == 3
+
+
+def test_bundle_endpoint_and_bad_parameters(loop_wav):
+    audio = loop_wav()
+
+    async def scenario(port, service):
+        bundle = await _request(port, "POST", "/bundle?pool=200&midi=1&loop=1&name=loop.wav", audio)
+        bad = await _request(port, "POST", "/hooks?register=sky", audio)
+        missing = await _request(port, "GET", "/nowhere")
+        phrases = await _request(port, "POST", "/hooks?pool=200&bars=4&density=4", audio)
+        bad_bars = await _request(port, "POST", "/hooks?bars=3", audio)
+        flac = await _request(port, "POST", "/bundle?pool=200&format=flac&sample_rate=44100", audio)
+        bad_format = await _request(port, "POST", "/bundle?format=ogg", audio)
+        bad_scale = await _request(port, "POST", "/hooks?scale=H%20major", audio)
+        lower_scale = await _request(port, "POST", "/hooks?pool=200&scale=eb%20dorian", audio)
+        return bundle, bad, missing, phrases, bad_bars, flac, bad_format, bad_scale, lower_scale
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        bundle, bad, missing, phrases, bad_bars, flac, bad_format, bad_scale, lower_scale = _run_with_server(pool, scenario)
+
+    status, head, payload = bundle
+    assert status == 200 and 'filename="hooks - loop.zip"' in head
+    names = zipfile.ZipFile(io.BytesIO(payload)).namelist()
+    assert "hook_1.wav" in names and "hooks.mid" in names and "hook_1_with_loop.wav" in names
+    assert bad[0] == 400 and "register" in json.loads(bad[2])["error"]
+    assert missing[0] == 404
+    assert phrases[0] == 200 and all(len(hook) == 16 for hook in json.loads(phrases[2])["hooks"])
+    assert bad_bars[0] == 400 and "bars" in json.loads(bad_bars[2])["error"]
+    assert flac[0] == 200 and "hook_1.flac" in zipfile.ZipFile(io.BytesIO(flac[2])).namelist()
+    assert bad_format[0] == 400 and "format" in json.loads(bad_format[2])["error"]
+    assert bad_scale[0] == 400 and "scale" in json.loads(bad_scale[2])["error"]
+    assert lower_scale[0] == 200 and json.loads(lower_scale[2])["scale"] == "Eb dorian"
+
+
+def test_full_queue_is_rejected():
+    async def scenario():
+        service = HookService(ThreadPoolExecutor(max_workers=1), queue_size=1)  # batcher not started
+        waiting = asyncio.ensure_future(service.generate(np.ones(16), HookRequest()))
+        await asyncio.sleep(0)
+        with pytest.raises(ServiceBusy):
+            await service.generate(np.ones(16), HookRequest())
+        waiting.cancel()
+        assert service.counters["rejected"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_evicted_near_duplicate_is_replaced_in_the_index(loop_wav):
+    original = loop_wav(gain=0.5, drone_hz=220.0)
+    copies = [loop_wav(gain=0.5, drone_hz=220.0, subtype=subtype) for subtype in ("PCM_24", "FLOAT")]
+    other = loop_wav(bpm=128.0)
+
+    async def scenario():
+        service = HookService(ThreadPoolExecutor(max_workers=1), cache=AnalysisCache(max_entries=1))
+        try:
+            for audio in (original, other, *copies):  # other evicts the original from the cache
+                await service.analyze(audio)
+            return service.index
+        finally:
+            await service.close()
+
+    index = asyncio.run(scenario())
+    key = analysis_key(copies[0], sr=22050, subdiv=4)
+    assert index.nearest(fingerprint_bytes(copies[1])[0])[0] == key  # not the evicted original
+    assert index.stats() == {"entries": 2, "matches": 2, "misses": 2}
+
+
+def test_cache_dir_keeps_analyses_and_fingerprints_on_disk(tmp_path, loop_wav):
+    async def analyze_once():
+        service = HookService(ThreadPoolExecutor(max_workers=1), cache_dir=str(tmp_path))
+        try:
+            await service.analyze(loop_wav())
+            return service.health()
+        finally:
+            await service.close()
+
+    asyncio.run(analyze_once())
+    health = asyncio.run(analyze_once())  # a restarted server
+    assert health["analysis_cache"]["disk_hits"] == 1
+    assert health["fingerprint_index"]["entries"] == 1